@@ -0,0 +1,139 @@
+"""Run hyperparameter sweeps of the bandit algorithms on a process pool.
+
+Each config is (algorithm name, parameter, seed). A config runs n_runs batched
+bandits for n_steps and its mean reward curve is written into a row of one shared
+memory array. The random stream of a config is spawned from SeedSequence(entropy)
+and the config's seed, so results are the same for any number of workers, and
+configs with the same seed see the same bandit problems.
+"""
+
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from typing import List, Optional, Tuple
+from multi_armed_bandit import (
+    k_armed_bandit_problem,
+    batched_epsilon_greedy,
+    batched_upper_confidence_bound_action_selection,
+    batched_incremental_gradient_bandit,
+    batched_gaussian_thompson_sampling,
+)
+
+# algorithm name -> (batched algorithm, whether it takes an rng)
+SWEEP_ALGORITHMS = {
+    "epsilon_greedy": (batched_epsilon_greedy, True),
+    "upper_confidence_bound": (batched_upper_confidence_bound_action_selection, False),
+    "gradient_bandit": (batched_incremental_gradient_bandit, True),
+    "thompson_sampling": (batched_gaussian_thompson_sampling, True),
+}
+
+
+def config_rng(entropy: int, seed: int):
+    """Get the random generator of a config, independent of where it runs."""
+    return np.random.default_rng(np.random.SeedSequence(entropy, spawn_key=(seed,)))
+
+
+def run_config(
+    config: Tuple[str, float, int], k: int, n_steps: int, n_runs: int, entropy: int
+):
+    """Run one sweep config and return its mean reward per step."""
+    name, parameter, seed = config
+    algorithm, uses_rng = SWEEP_ALGORITHMS[name]
+    rng = config_rng(entropy, seed)
+    take_action = k_armed_bandit_problem(k, n_runs, rng=rng)
+    kwargs = {"rng": rng} if uses_rng else {}
+    rewards = algorithm(k, parameter, n_steps, take_action, n_runs, **kwargs)
+    return rewards.mean(axis=0)
+
+
+def _run_config_into_shared_memory(
+    index: int,
+    config: Tuple[str, float, int],
+    k: int,
+    n_steps: int,
+    n_runs: int,
+    entropy: int,
+    shared_memory_name: str,
+    shape: Tuple[int, int],
+):
+    shm = shared_memory.SharedMemory(name=shared_memory_name)
+    try:
+        results = np.ndarray(shape, dtype=np.float64, buffer=shm.buf)
+        results[index] = run_config(config, k, n_steps, n_runs, entropy)
+    finally:
+        shm.close()
+
+
+def run_sweep(
+    configs: List[Tuple[str, float, int]],
+    k: int = 10,
+    n_steps: int = 1000,
+    n_runs: int = 2000,
+    entropy: int = 0,
+    max_workers: Optional[int] = None,
+):
+    """Run every config on a process pool.
+
+    Args:
+        configs (list): (algorithm name, parameter, seed) per config, the algorithm is
+            a key of SWEEP_ALGORITHMS
+        k (int): number of arms
+        n_steps (int): length of each run
+        n_runs (int): runs averaged per config
+        entropy (int): root seed of the sweep
+        max_workers (int, optional): processes to use. Defaults to one per core.
+
+    Returns:
+        np.ndarray: len(configs) x n_steps array of mean reward per step
+    """
+    for name, _, _ in configs:
+        if name not in SWEEP_ALGORITHMS:
+            raise ValueError(f"Unknown algorithm {name}")
+
+    shape = (len(configs), n_steps)
+    shm = shared_memory.SharedMemory(
+        create=True, size=max(np.prod(shape), 1) * np.dtype(np.float64).itemsize
+    )
+    try:
+        with ProcessPoolExecutor(max_workers=max_workers) as pool:
+            futures = [
+                pool.submit(
+                    _run_config_into_shared_memory,
+                    index,
+                    config,
+                    k,
+                    n_steps,
+                    n_runs,
+                    entropy,
+                    shm.name,
+                    shape,
+                )
+                for index, config in enumerate(configs)
+            ]
+            for future in futures:
+                future.result()
+        return np.ndarray(shape, dtype=np.float64, buffer=shm.buf).copy()
+    finally:
+        shm.close()
+        shm.unlink()
+
+
+if __name__ == "__main__":
+    import time
+
+    configs = [
+        (name, parameter, seed)
+        for name, parameters in [
+            ("epsilon_greedy", [0, 0.01, 0.1]),
+            ("upper_confidence_bound", [1, 2, 3]),
+            ("gradient_bandit", [0.1, 0.4]),
+            ("thompson_sampling", [1]),
+        ]
+        for parameter in parameters
+        for seed in range(2)
+    ]
+    start = time.perf_counter()
+    results = run_sweep(configs)
+    print(f"{len(configs)} configs in {time.perf_counter() - start:.2f}s")
+    for config, result in zip(configs, results):
+        print(config, f"final mean reward {result[-100:].mean():.3f}")
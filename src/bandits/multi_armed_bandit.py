@@ -1,30 +1,312 @@
+import heapq
 import numpy as np
-from typing import Callable
+from typing import Callable, Optional, Union
 
 
-def k_armed_bandit_problem(k: int):
+def k_armed_bandit_problem(
+    k: int, n_runs: Optional[int] = None, rng: Optional[np.random.Generator] = None
+):
     """Generate a k_armed_bandit function.
 
+    With n_runs, generates n_runs independent bandits at once. The arm means are then
+    an n_runs x k matrix and take_action takes one action per run, returning one
+    reward per run. The means are available as take_action.means.
+
     Args:
         k (int): Number of arms (actions)
+        n_runs (int, optional): Number of independent bandits. Defaults to a single one.
+        rng (np.random.Generator, optional): random source. Defaults to np.random.
     """
+    rng = np.random if rng is None else rng
+
+    if n_runs is None:
+        means = rng.normal(0, 1, k)
+
+        def take_action(i):
+            """return random reward from normal distribution with mean i
+            and unit variance.
+
+            Returns:
+                index (i) : index to take mean from
+            """
+            return rng.normal(means[i], 1)
 
-    means = np.random.normal(0, 1, k)
+    else:
+        means = rng.normal(0, 1, (n_runs, k))
+        runs = np.arange(n_runs)
 
-    def take_action(i):
-        """return random reward from normal distribution with mean i
-        and unit variance.
+        def take_action(actions):
+            """return a random reward per run from a normal distribution with the
+            mean of the arm taken in that run and unit variance.
 
-        Returns:
-            index (i) : index to take mean from
-        """
-        return np.random.normal(means[i], 1)
+            Returns:
+                actions (np.ndarray) : arm index for each run
+            """
+            return rng.normal(means[runs, actions], 1)
 
+    take_action.means = means
     return take_action
 
 
+def bernoulli_bandit_problem(
+    k: int, n_runs: Optional[int] = None, rng: Optional[np.random.Generator] = None
+):
+    """Generate a k armed bandit that pays 1 with a per arm probability, else 0.
+
+    The probabilities are drawn uniformly from [0, 1] and are available as
+    take_action.means. With n_runs, generates n_runs independent bandits at once as
+    in k_armed_bandit_problem.
+
+    Args:
+        k (int): Number of arms (actions)
+        n_runs (int, optional): Number of independent bandits. Defaults to a single one.
+        rng (np.random.Generator, optional): random source. Defaults to np.random.
+    """
+    rng = np.random if rng is None else rng
+
+    if n_runs is None:
+        means = rng.uniform(size=k)
+
+        def take_action(i):
+            return float(rng.uniform() < means[i])
+
+    else:
+        means = rng.uniform(size=(n_runs, k))
+        runs = np.arange(n_runs)
+
+        def take_action(actions):
+            return (rng.uniform(size=n_runs) < means[runs, actions]).astype(float)
+
+    take_action.means = means
+    return take_action
+
+
+class ArmStatistics:
+    """Running count, mean and variance of the rewards from each arm.
+
+    Statistics live in preallocated arrays of the given shape, k for a single bandit
+    or (n_runs, k) for batched bandits, and are updated with Welford's method so
+    memory does not grow with the number of steps. With history > 0 the last history
+    rewards of each arm are also kept in a ring buffer.
+
+    Args:
+        shape (int | tuple): shape of the arm arrays
+        history (int, optional): rewards retained per arm. Defaults to 0 (none).
+    """
+
+    def __init__(self, shape, history: int = 0):
+        self.count = np.zeros(shape)
+        self.mean = np.zeros(shape)
+        self.sum_squared_deviation = np.zeros(shape)
+        self.history = None
+        if history > 0:
+            self.history = np.full(np.shape(self.count) + (history,), np.nan)
+            self.history_position = np.zeros(np.shape(self.count), dtype=int)
+
+    def update(self, arm, reward):
+        """Add a reward for arm. For batched bandits arm is a (runs, actions) index."""
+        self.count[arm] += 1
+        delta = reward - self.mean[arm]
+        self.mean[arm] += delta / self.count[arm]
+        self.sum_squared_deviation[arm] += delta * (reward - self.mean[arm])
+        if self.history is not None:
+            arm = arm if isinstance(arm, tuple) else (arm,)
+            position = self.history_position[arm]
+            self.history[arm + (position,)] = reward
+            self.history_position[arm] = (position + 1) % self.history.shape[-1]
+
+    @property
+    def variance(self):
+        """Sample variance of the rewards from each arm, 0 for arms pulled under twice."""
+        with np.errstate(divide="ignore", invalid="ignore"):
+            variance = self.sum_squared_deviation / (self.count - 1)
+        return np.where(self.count > 1, variance, 0)
+
+    def recent_rewards(self, arm):
+        """Get the retained rewards of arm, oldest first."""
+        if self.history is None:
+            raise ValueError("ArmStatistics created without history")
+        arm = arm if isinstance(arm, tuple) else (arm,)
+        retained = int(min(self.count[arm], self.history.shape[-1]))
+        position = self.history_position[arm]
+        rewards = np.roll(self.history[arm], -position)
+        return rewards[len(rewards) - retained :]
+
+
+class GaussianPosterior:
+    """Normal posterior over the mean reward of each arm, for rewards with a known
+    variance and a normal prior on the means.
+
+    The posterior is kept as per arm arrays of its precision and precision times mean,
+    with the mean and standard deviation they give cached, so adding a reward is O(1)
+    and sampling every arm is one vectorized standard normal draw.
+
+    Args:
+        shape (int | tuple): shape of the arm arrays, k or (n_runs, k)
+        prior_mean (float, optional): prior mean of every arm. Defaults to 0.
+        prior_variance (float, optional): prior variance of every arm. Defaults to 1.
+        reward_variance (float, optional): variance of the rewards. Defaults to 1.
+    """
+
+    def __init__(
+        self,
+        shape,
+        prior_mean: float = 0.0,
+        prior_variance: float = 1.0,
+        reward_variance: float = 1.0,
+    ):
+        self.reward_variance = reward_variance
+        self.precision = np.full(shape, 1 / prior_variance)
+        self.weighted_mean = np.full(shape, prior_mean / prior_variance)
+        self.mean = self.weighted_mean / self.precision
+        self.std = 1 / np.sqrt(self.precision)
+
+    def update(self, arm, reward):
+        """Add a reward for arm. For batched bandits arm is a (runs, actions) index."""
+        self.precision[arm] += 1 / self.reward_variance
+        self.weighted_mean[arm] += reward / self.reward_variance
+        self.mean[arm] = self.weighted_mean[arm] / self.precision[arm]
+        self.std[arm] = 1 / np.sqrt(self.precision[arm])
+
+    @property
+    def variance(self):
+        return self.std**2
+
+    def sample(self, rng: Optional[np.random.Generator] = None):
+        """Draw a mean for every arm from the posterior."""
+        rng = np.random if rng is None else rng
+        return self.mean + self.std * rng.standard_normal(np.shape(self.mean))
+
+
+class BetaPosterior:
+    """Beta posterior over the success probability of each arm, for rewards in [0, 1].
+
+    Args:
+        shape (int | tuple): shape of the arm arrays, k or (n_runs, k)
+        alpha (float, optional): prior successes of every arm. Defaults to 1.
+        beta (float, optional): prior failures of every arm. Defaults to 1.
+    """
+
+    def __init__(self, shape, alpha: float = 1.0, beta: float = 1.0):
+        self.alpha = np.full(shape, float(alpha))
+        self.beta = np.full(shape, float(beta))
+
+    def update(self, arm, reward):
+        """Add a reward for arm. For batched bandits arm is a (runs, actions) index."""
+        self.alpha[arm] += reward
+        self.beta[arm] += 1 - reward
+
+    @property
+    def mean(self):
+        return self.alpha / (self.alpha + self.beta)
+
+    def sample(self, rng: Optional[np.random.Generator] = None):
+        """Draw a success probability for every arm from the posterior."""
+        rng = np.random if rng is None else rng
+        return rng.beta(self.alpha, self.beta)
+
+
+def softmax(preference: np.ndarray):
+    """Softmax over the last axis. Subtracts the max first so large preferences
+    do not overflow."""
+    exp_preference = np.exp(preference - np.max(preference, axis=-1, keepdims=True))
+    return exp_preference / np.sum(exp_preference, axis=-1, keepdims=True)
+
+
+def sample_actions(prob: np.ndarray, rng: Optional[np.random.Generator] = None):
+    """Sample an action from each row of action probabilities with one uniform draw
+    per row."""
+    rng = np.random if rng is None else rng
+    cumulative = np.cumsum(prob, axis=-1)
+    u = rng.uniform(size=prob.shape[:-1] + (1,)) * cumulative[..., -1:]
+    # guard against u landing on the rounded total
+    action = np.minimum(np.sum(cumulative <= u, axis=-1), prob.shape[-1] - 1)
+    return action if action.ndim else int(action)
+
+
+class RewardRecorder:
+    """Write the reward of each step of a bandit run into a preallocated array.
+
+    The bandit algorithms pass their out, callback and report_every arguments here.
+
+    Args:
+        n_steps (int): length of the run
+        take_action (Callable): the bandit, its means give the optimal action
+        n_runs (int, optional): number of batched runs
+        out (np.ndarray | bool, optional): array, or np.memmap to keep long runs out
+            of memory, to write the rewards into. Defaults to a new array. With
+            out=False no rewards are kept, only the callback aggregates, and the
+            algorithm returns None.
+        callback (Callable, optional): called every report_every steps with a dict
+            holding the step count, the mean reward and the fraction of optimal
+            actions since the previous call. The optimal action is only known if
+            take_action has means, as from k_armed_bandit_problem, otherwise it is
+            nan.
+        report_every (int, optional): steps between callbacks. Defaults to 1000.
+    """
+
+    def __init__(
+        self,
+        n_steps: int,
+        take_action: Callable,
+        n_runs: Optional[int] = None,
+        out: Union[np.ndarray, bool, None] = None,
+        callback: Optional[Callable[[dict], None]] = None,
+        report_every: int = 1000,
+    ):
+        shape = (n_steps,) if n_runs is None else (n_runs, n_steps)
+        if out is False:
+            out = None
+        elif out is None:
+            out = np.zeros(shape)
+        elif out.shape != shape:
+            raise ValueError(f"out has shape {out.shape}, expected {shape}")
+        self.rewards = out
+        self.n_steps = n_steps
+        self.callback = callback
+        self.report_every = report_every
+        means = getattr(take_action, "means", None)
+        self.optimal_action = None if means is None else np.argmax(means, axis=-1)
+        self.reward_sum = 0.0
+        self.optimal_count = 0
+        self.count = 0
+
+    def record(self, step: int, action, reward):
+        if self.rewards is not None:
+            self.rewards[..., step] = reward
+        if self.callback is None:
+            return
+        self.reward_sum += np.sum(reward)
+        self.count += np.size(reward)
+        if self.optimal_action is not None:
+            self.optimal_count += np.count_nonzero(action == self.optimal_action)
+        if (step + 1) % self.report_every == 0 or step + 1 == self.n_steps:
+            self.callback(
+                {
+                    "step": step + 1,
+                    "mean_reward": self.reward_sum / self.count,
+                    "optimal_action": (
+                        np.nan
+                        if self.optimal_action is None
+                        else self.optimal_count / self.count
+                    ),
+                }
+            )
+            self.reward_sum = 0.0
+            self.optimal_count = 0
+            self.count = 0
+
+
 def incremental_epsilon_greedy(
-    k: int, epsilon: float, n_steps: int, take_action: Callable[[int], int]
+    k: int,
+    epsilon: float,
+    n_steps: int,
+    take_action: Callable[[int], int],
+    arm_statistics: Optional[ArmStatistics] = None,
+    out: Union[np.ndarray, bool, None] = None,
+    callback: Optional[Callable[[dict], None]] = None,
+    report_every: int = 1000,
+    rng: Optional[np.random.Generator] = None,
 ):
     """Run an epsilon greedy algorithm on a k_armed_bandit.
 
@@ -35,35 +317,44 @@ def incremental_epsilon_greedy(
         epsilon (float, optional): probability of random action. Defaults to 0.1.
         n_steps (int, optional): length of episode. Defaults to 100.
         take_action (Callable): function for probalistic reward from bandit
+        arm_statistics (ArmStatistics, optional): statistics to update, pass one to
+            inspect them (or their reward history) after the run
+        out, callback, report_every: how rewards are recorded, see RewardRecorder
+        rng (np.random.Generator, optional): random source. Defaults to np.random.
 
     Returns:
         _type_: an array of rewards per step
     """
-    Q = np.zeros(k)
-    Q_selected_count = np.zeros(
-        k
-    )  # hold counts of number times each action selected for incremental mean
-    total_reward = []
+    rng = np.random if rng is None else rng
+    if arm_statistics is None:
+        arm_statistics = ArmStatistics(k)
+    Q = arm_statistics.mean  # incremental mean of each action
+    recorder = RewardRecorder(
+        n_steps, take_action, out=out, callback=callback, report_every=report_every
+    )
     for i in range(n_steps):
         # epsilon greedy action selection
         next_action = np.argmax(Q)
-        if np.random.uniform() < epsilon:
-            next_action = np.random.randint(0, k)
+        if rng.uniform() < epsilon:
+            next_action = rng.choice(k)
         reward = take_action(next_action)
 
         # updates
-        total_reward.append(reward)
-        Q_selected_count[next_action] += 1
-        count = Q_selected_count[next_action]
-
-        # incremental mean
-        avg = Q[next_action]
-        Q[next_action] = (1 - (1 / count)) * avg + (1 / count) * reward
-    return np.array(total_reward)
+        recorder.record(i, next_action, reward)
+        arm_statistics.update(next_action, reward)
+    return recorder.rewards
 
 
 def epsilon_greedy(
-    k: int, epsilon: float, n_steps: int, take_action: Callable[[int], int]
+    k: int,
+    epsilon: float,
+    n_steps: int,
+    take_action: Callable[[int], int],
+    arm_statistics: Optional[ArmStatistics] = None,
+    out: Union[np.ndarray, bool, None] = None,
+    callback: Optional[Callable[[dict], None]] = None,
+    report_every: int = 1000,
+    rng: Optional[np.random.Generator] = None,
 ):
     """Run an epsilon greedy algorithm on a k_armed_bandit.
 
@@ -72,36 +363,51 @@ def epsilon_greedy(
         epsilon (float, optional): probability of random action. Defaults to 0.1.
         n_steps (int, optional): length of episode. Defaults to 100.
         take_action (Callable): function for probalistic reward from bandit
+        arm_statistics (ArmStatistics, optional): statistics to update. Create it with
+            history to keep the rewards from each bandit.
+        out, callback, report_every: how rewards are recorded, see RewardRecorder
+        rng (np.random.Generator, optional): random source. Defaults to np.random.
 
     Returns:
         _type_: an array of rewards per step
     """
-    Q = np.zeros(k)
-    reward_from_bandit_memory: list[list[int]] = [[] for _ in range(k)]
+    rng = np.random if rng is None else rng
+    if arm_statistics is None:
+        arm_statistics = ArmStatistics(k)
 
-    total_reward = []
-    for _ in range(n_steps):
+    recorder = RewardRecorder(
+        n_steps, take_action, out=out, callback=callback, report_every=report_every
+    )
+    for i in range(n_steps):
         # greedy selection, epislon chance of random
-        next_action: int = np.argmax(Q)
-        if np.random.uniform() < epsilon:
-            next_action = np.random.randint(0, k)
+        next_action: int = np.argmax(arm_statistics.mean)
+        if rng.uniform() < epsilon:
+            next_action = rng.choice(k)
 
         # find reward from action and add to memory
         reward: int = take_action(next_action)
-        total_reward.append(reward)
+        recorder.record(i, next_action, reward)
 
-        # update memory
-        reward_from_bandit_memory[next_action].append(reward)
+        # Q of action is mean of rewards from that action, kept as a running mean
+        arm_statistics.update(next_action, reward)
+    return recorder.rewards
 
-        # Q of action is mean of rewards from that action
-        Q[next_action] = sum(reward_from_bandit_memory[next_action]) / len(
-            reward_from_bandit_memory[next_action]
-        )
-    return np.array(total_reward)
+
+def upper_confidence_bounds(Q: np.ndarray, count: np.ndarray, c: float, t: int):
+    """Get the upper confidence bound Q + c * sqrt(ln t / count) of arms pulled at
+    least once."""
+    return Q + c * np.sqrt(np.log(t) / count)
 
 
 def upper_confidence_bound_action_selection(
-    k: int, c: float, n_steps: int, take_action: Callable[[int], int]
+    k: int,
+    c: float,
+    n_steps: int,
+    take_action: Callable[[int], int],
+    arm_statistics: Optional[ArmStatistics] = None,
+    out: Union[np.ndarray, bool, None] = None,
+    callback: Optional[Callable[[dict], None]] = None,
+    report_every: int = 1000,
 ):
     """Run the ucb action selection algorithm on a k_armed_bandit.
 
@@ -112,34 +418,119 @@ def upper_confidence_bound_action_selection(
         epsilon (float, optional): probability of random action. Defaults to 0.1.
         n_steps (int, optional): length of episode. Defaults to 100.
         take_action (Callable): function for probalistic reward from bandit
+        arm_statistics (ArmStatistics, optional): statistics to update
+        out, callback, report_every: how rewards are recorded, see RewardRecorder
 
     Returns:
         _type_: an array of rewards per step
     """
-    Q = np.zeros(k)
-    Q_selected_count = np.zeros(
-        k
-    )  # hold counts of number times each action selected for incremental mean
-    total_reward = []
+    if arm_statistics is None:
+        arm_statistics = ArmStatistics(k)
+    Q = arm_statistics.mean
+    Q_selected_count = arm_statistics.count
+    recorder = RewardRecorder(
+        n_steps, take_action, out=out, callback=callback, report_every=report_every
+    )
+    untried = np.flatnonzero(Q_selected_count == 0)
     for i in range(n_steps):
-        # UCB action selection
-        next_action = np.argmax(Q + c * np.sqrt(np.log(i + 1) / Q_selected_count))
+        if i < len(untried):
+            # explicit initial pull of each arm
+            next_action = untried[i]
+        else:
+            # UCB action selection
+            next_action = np.argmax(
+                upper_confidence_bounds(Q, Q_selected_count, c, i + 1)
+            )
 
         reward = take_action(next_action)
 
         # updates
-        total_reward.append(reward)
-        Q_selected_count[next_action] += 1
-        count = Q_selected_count[next_action]
+        recorder.record(i, next_action, reward)
+        arm_statistics.update(next_action, reward)
+    return recorder.rewards
+
+
+def lazy_upper_confidence_bound_action_selection(
+    k: int,
+    c: float,
+    n_steps: int,
+    take_action: Callable[[int], int],
+    arm_statistics: Optional[ArmStatistics] = None,
+    out: Union[np.ndarray, bool, None] = None,
+    callback: Optional[Callable[[dict], None]] = None,
+    report_every: int = 1000,
+    refresh_every: Optional[int] = None,
+):
+    """Run ucb action selection on a k_armed_bandit with a lazily updated heap of
+    bounds, for bandits with very many arms.
 
-        # incremental mean
-        avg = Q[next_action]
-        Q[next_action] = (1 - (1 / count)) * avg + (1 / count) * reward
-    return np.array(total_reward)
+    Every untried arm is pulled once first. After that the bounds sit in a max heap,
+    and a step pops the top arm, pulls it and pushes back its new bound, which is
+    O(log k). The bounds of the other arms grow with ln t and are only recomputed
+    when the whole heap is rebuilt every refresh_every steps, so between rebuilds
+    they are slight underestimates. With refresh_every=1 this is
+    upper_confidence_bound_action_selection.
+
+    Args:
+        k (int): number of bandits
+        c (float): degree of exploration
+        n_steps (int): length of episode
+        take_action (Callable): function for probalistic reward from bandit
+        arm_statistics (ArmStatistics, optional): statistics to update
+        out, callback, report_every: how rewards are recorded, see RewardRecorder
+        refresh_every (int, optional): steps between rebuilding the heap with every
+            bound. Defaults to k, an amortized O(1) per step.
+
+    Returns:
+        np.ndarray: an array of rewards per step
+    """
+    if arm_statistics is None:
+        arm_statistics = ArmStatistics(k)
+    if refresh_every is None:
+        refresh_every = k
+    Q = arm_statistics.mean
+    Q_selected_count = arm_statistics.count
+    recorder = RewardRecorder(
+        n_steps, take_action, out=out, callback=callback, report_every=report_every
+    )
+    untried = np.flatnonzero(Q_selected_count == 0)
+    heap = None
+    next_refresh = 0
+    for i in range(n_steps):
+        if i < len(untried):
+            # explicit initial pull of each arm
+            next_action = untried[i]
+        else:
+            if i >= next_refresh:
+                bounds = upper_confidence_bounds(Q, Q_selected_count, c, i + 1)
+                heap = list(zip((-bounds).tolist(), range(k)))
+                heapq.heapify(heap)
+                next_refresh = i + refresh_every
+            _, next_action = heapq.heappop(heap)
+
+        reward = take_action(next_action)
+
+        # updates
+        recorder.record(i, next_action, reward)
+        arm_statistics.update(next_action, reward)
+        if heap is not None:
+            bound = upper_confidence_bounds(
+                Q[next_action], Q_selected_count[next_action], c, i + 2
+            )
+            heapq.heappush(heap, (-float(bound), next_action))
+    return recorder.rewards
 
 
 def incremental_gradient_bandit(
-    k: int, alpha: float, n_steps: int, take_action: Callable[[int], int]
+    k: int,
+    alpha: float,
+    n_steps: int,
+    take_action: Callable[[int], int],
+    arm_statistics: Optional[ArmStatistics] = None,
+    out: Union[np.ndarray, bool, None] = None,
+    callback: Optional[Callable[[dict], None]] = None,
+    report_every: int = 1000,
+    rng: Optional[np.random.Generator] = None,
 ):
     """Run a gradient based bandit algorithm on a k_armed_bandit.
 
@@ -150,38 +541,392 @@ def incremental_gradient_bandit(
         epsilon (float, optional): probability of random action. Defaults to 0.1.
         n_steps (int, optional): length of episode. Defaults to 100.
         take_action (Callable): function for probalistic reward from bandit
+        arm_statistics (ArmStatistics, optional): statistics to update
+        out, callback, report_every: how rewards are recorded, see RewardRecorder
+        rng (np.random.Generator, optional): random source. Defaults to np.random.
 
     Returns:
         _type_: an array of rewards per step
     """
+    rng = np.random if rng is None else rng
+    if arm_statistics is None:
+        arm_statistics = ArmStatistics(k)
     preference = np.zeros(k)
-    A_selected_count = np.zeros(k)
-    R_mean = np.zeros(k)
-    total_reward = []
+    R_mean = arm_statistics.mean
+    recorder = RewardRecorder(
+        n_steps, take_action, out=out, callback=callback, report_every=report_every
+    )
+    for i in range(n_steps):
+        # find probalistic preference for each action, with softmax, and sample from it
+        prob_preference = softmax(preference)
+        next_action = sample_actions(prob_preference, rng)
+        reward = take_action(next_action)
+
+        # updates
+        recorder.record(i, next_action, reward)
+
+        # update preference, selected action moves towards 1 - pi, the rest towards -pi
+        gradient = -prob_preference
+        gradient[next_action] += 1
+        preference += alpha * (reward - R_mean) * gradient
+
+        # incremental mean
+        arm_statistics.update(next_action, reward)
+    return recorder.rewards
+
+
+def batched_epsilon_greedy(
+    k: int,
+    epsilon: float,
+    n_steps: int,
+    take_action: Callable[[np.ndarray], np.ndarray],
+    n_runs: int,
+    arm_statistics: Optional[ArmStatistics] = None,
+    out: Union[np.ndarray, bool, None] = None,
+    callback: Optional[Callable[[dict], None]] = None,
+    report_every: int = 1000,
+    rng: Optional[np.random.Generator] = None,
+):
+    """Run epsilon_greedy on n_runs bandits at once.
+
+    Args:
+        k (int): number of bandits
+        epsilon (float): probability of random action
+        n_steps (int): length of episode
+        take_action (Callable): batched bandit from k_armed_bandit_problem(k, n_runs)
+        n_runs (int): number of independent runs
+        arm_statistics (ArmStatistics, optional): n_runs x k statistics to update
+        out, callback, report_every: how rewards are recorded, see RewardRecorder
+        rng (np.random.Generator, optional): random source. Defaults to np.random.
+
+    Returns:
+        np.ndarray: n_runs x n_steps array of rewards
+    """
+    rng = np.random if rng is None else rng
+    if arm_statistics is None:
+        arm_statistics = ArmStatistics((n_runs, k))
+    runs = np.arange(n_runs)
+    recorder = RewardRecorder(
+        n_steps,
+        take_action,
+        n_runs,
+        out=out,
+        callback=callback,
+        report_every=report_every,
+    )
     for i in range(n_steps):
-        # find probalistic preference for each action, with softmax
-        prob_preference = np.exp(preference) / np.sum(np.exp(preference))
-        next_action = np.argmax(prob_preference)
+        # greedy selection, epislon chance of random
+        next_action = np.argmax(arm_statistics.mean, axis=1)
+        explore = rng.uniform(size=n_runs) < epsilon
+        next_action[explore] = rng.choice(k, size=np.count_nonzero(explore))
+
+        reward = take_action(next_action)
+        recorder.record(i, next_action, reward)
+
+        # Q of action is mean of rewards from that action
+        arm_statistics.update((runs, next_action), reward)
+    return recorder.rewards
+
+
+def batched_incremental_epsilon_greedy(
+    k: int,
+    epsilon: float,
+    n_steps: int,
+    take_action: Callable[[np.ndarray], np.ndarray],
+    n_runs: int,
+    arm_statistics: Optional[ArmStatistics] = None,
+    out: Union[np.ndarray, bool, None] = None,
+    callback: Optional[Callable[[dict], None]] = None,
+    report_every: int = 1000,
+    rng: Optional[np.random.Generator] = None,
+):
+    """Run incremental_epsilon_greedy on n_runs bandits at once.
+
+    Both epsilon greedy variants keep a running mean, so this is batched_epsilon_greedy.
+    """
+    return batched_epsilon_greedy(
+        k,
+        epsilon,
+        n_steps,
+        take_action,
+        n_runs,
+        arm_statistics,
+        out=out,
+        callback=callback,
+        report_every=report_every,
+        rng=rng,
+    )
+
+
+def batched_upper_confidence_bound_action_selection(
+    k: int,
+    c: float,
+    n_steps: int,
+    take_action: Callable[[np.ndarray], np.ndarray],
+    n_runs: int,
+    arm_statistics: Optional[ArmStatistics] = None,
+    out: Union[np.ndarray, bool, None] = None,
+    callback: Optional[Callable[[dict], None]] = None,
+    report_every: int = 1000,
+):
+    """Run upper_confidence_bound_action_selection on n_runs bandits at once.
+
+    Args:
+        k (int): number of bandits
+        c (float): degree of exploration
+        n_steps (int): length of episode
+        take_action (Callable): batched bandit from k_armed_bandit_problem(k, n_runs)
+        n_runs (int): number of independent runs
+        arm_statistics (ArmStatistics, optional): n_runs x k statistics to update
+        out, callback, report_every: how rewards are recorded, see RewardRecorder
+
+    Returns:
+        np.ndarray: n_runs x n_steps array of rewards
+    """
+    if arm_statistics is None:
+        arm_statistics = ArmStatistics((n_runs, k))
+    runs = np.arange(n_runs)
+    Q = arm_statistics.mean
+    Q_selected_count = arm_statistics.count
+    recorder = RewardRecorder(
+        n_steps,
+        take_action,
+        n_runs,
+        out=out,
+        callback=callback,
+        report_every=report_every,
+    )
+    for i in range(n_steps):
+        # UCB action selection, untried actions have an infinite bound so each arm
+        # is pulled once first
+        bound = upper_confidence_bounds(Q, np.maximum(Q_selected_count, 1), c, i + 1)
+        bound[Q_selected_count == 0] = np.inf
+        next_action = np.argmax(bound, axis=1)
+
         reward = take_action(next_action)
 
         # updates
-        total_reward.append(reward)
-        A_selected_count[next_action] += 1
-
-        # update preference
-        preference[next_action] = preference[next_action] + alpha * (
-            reward - R_mean[next_action]
-        ) * (1 - prob_preference[next_action])
-        for a in range(k):
-            if a != next_action:
-                preference[a] = (
-                    preference[a] - alpha * (reward - R_mean[a]) * prob_preference[a]
-                )
+        recorder.record(i, next_action, reward)
+        arm_statistics.update((runs, next_action), reward)
+    return recorder.rewards
+
+
+def batched_incremental_gradient_bandit(
+    k: int,
+    alpha: float,
+    n_steps: int,
+    take_action: Callable[[np.ndarray], np.ndarray],
+    n_runs: int,
+    arm_statistics: Optional[ArmStatistics] = None,
+    out: Union[np.ndarray, bool, None] = None,
+    callback: Optional[Callable[[dict], None]] = None,
+    report_every: int = 1000,
+    rng: Optional[np.random.Generator] = None,
+):
+    """Run incremental_gradient_bandit on n_runs bandits at once.
+
+    Args:
+        k (int): number of bandits
+        alpha (float): step size of the preference update
+        n_steps (int): length of episode
+        take_action (Callable): batched bandit from k_armed_bandit_problem(k, n_runs)
+        n_runs (int): number of independent runs
+        arm_statistics (ArmStatistics, optional): n_runs x k statistics to update
+        out, callback, report_every: how rewards are recorded, see RewardRecorder
+        rng (np.random.Generator, optional): random source. Defaults to np.random.
+
+    Returns:
+        np.ndarray: n_runs x n_steps array of rewards
+    """
+    rng = np.random if rng is None else rng
+    if arm_statistics is None:
+        arm_statistics = ArmStatistics((n_runs, k))
+    runs = np.arange(n_runs)
+    preference = np.zeros((n_runs, k))
+    R_mean = arm_statistics.mean
+    recorder = RewardRecorder(
+        n_steps,
+        take_action,
+        n_runs,
+        out=out,
+        callback=callback,
+        report_every=report_every,
+    )
+    for i in range(n_steps):
+        # find probalistic preference for each action, with softmax, and sample from it
+        prob_preference = softmax(preference)
+        next_action = sample_actions(prob_preference, rng)
+        reward = take_action(next_action)
+
+        # updates
+        recorder.record(i, next_action, reward)
+
+        # update preference, selected action moves towards 1 - pi, the rest towards -pi
+        gradient = -prob_preference
+        gradient[runs, next_action] += 1
+        preference += alpha * (reward[:, None] - R_mean) * gradient
 
         # incremental mean
-        count = A_selected_count[next_action]
-        R_mean[next_action] = (1 - (1 / count)) * R_mean[next_action] + (
-            1 / count
-        ) * reward
-        # Q[next_action] = (1 - (1 / count)) * avg + (1 / count) * reward
-    return np.array(total_reward)
+        arm_statistics.update((runs, next_action), reward)
+    return recorder.rewards
+
+
+def thompson_sampling(
+    posterior,
+    n_steps: int,
+    take_action: Callable,
+    n_runs: Optional[int] = None,
+    out: Union[np.ndarray, bool, None] = None,
+    callback: Optional[Callable[[dict], None]] = None,
+    report_every: int = 1000,
+    rng: Optional[np.random.Generator] = None,
+):
+    """Run Thompson sampling with a posterior over the arms.
+
+    Each step draws a value for every arm from the posterior, takes the arm with the
+    largest draw and adds its reward to the posterior, so a step costs O(k).
+
+    Args:
+        posterior (GaussianPosterior | BetaPosterior): posterior to sample from and
+            update, shaped k for a single bandit or (n_runs, k) for batched bandits
+        n_steps (int): length of episode
+        take_action (Callable): bandit, batched if n_runs is given
+        n_runs (int, optional): number of independent runs
+        out, callback, report_every: how rewards are recorded, see RewardRecorder
+        rng (np.random.Generator, optional): random source. Defaults to np.random.
+
+    Returns:
+        np.ndarray: rewards per step, n_runs x n_steps if batched
+    """
+    rng = np.random if rng is None else rng
+    runs = None if n_runs is None else np.arange(n_runs)
+    recorder = RewardRecorder(
+        n_steps,
+        take_action,
+        n_runs,
+        out=out,
+        callback=callback,
+        report_every=report_every,
+    )
+    for i in range(n_steps):
+        # act greedily with respect to one draw from the posterior
+        next_action = np.argmax(posterior.sample(rng), axis=-1)
+        reward = take_action(next_action)
+
+        # updates
+        recorder.record(i, next_action, reward)
+        posterior.update(next_action if runs is None else (runs, next_action), reward)
+    return recorder.rewards
+
+
+def gaussian_thompson_sampling(
+    k: int,
+    prior_variance: float,
+    n_steps: int,
+    take_action: Callable[[int], int],
+    posterior: Optional[GaussianPosterior] = None,
+    out: Union[np.ndarray, bool, None] = None,
+    callback: Optional[Callable[[dict], None]] = None,
+    report_every: int = 1000,
+    rng: Optional[np.random.Generator] = None,
+):
+    """Run Thompson sampling on a k_armed_bandit with unit variance rewards.
+
+    Args:
+        k (int): number of bandits
+        prior_variance (float): variance of the zero mean prior on each arm's mean
+        n_steps (int): length of episode
+        take_action (Callable): function for probalistic reward from bandit
+        posterior (GaussianPosterior, optional): posterior to update, pass one to set
+            the prior or reward variance, or to inspect it after the run
+        out, callback, report_every: how rewards are recorded, see RewardRecorder
+        rng (np.random.Generator, optional): random source. Defaults to np.random.
+
+    Returns:
+        np.ndarray: an array of rewards per step
+    """
+    if posterior is None:
+        posterior = GaussianPosterior(k, prior_variance=prior_variance)
+    return thompson_sampling(
+        posterior, n_steps, take_action, None, out, callback, report_every, rng
+    )
+
+
+def bernoulli_thompson_sampling(
+    k: int,
+    prior_successes: float,
+    n_steps: int,
+    take_action: Callable[[int], int],
+    posterior: Optional[BetaPosterior] = None,
+    out: Union[np.ndarray, bool, None] = None,
+    callback: Optional[Callable[[dict], None]] = None,
+    report_every: int = 1000,
+    rng: Optional[np.random.Generator] = None,
+):
+    """Run Thompson sampling on a bernoulli_bandit_problem.
+
+    Args:
+        k (int): number of bandits
+        prior_successes (float): alpha and beta of the Beta prior on each arm
+        n_steps (int): length of episode
+        take_action (Callable): bandit paying rewards in [0, 1]
+        posterior (BetaPosterior, optional): posterior to update
+        out, callback, report_every: how rewards are recorded, see RewardRecorder
+        rng (np.random.Generator, optional): random source. Defaults to np.random.
+
+    Returns:
+        np.ndarray: an array of rewards per step
+    """
+    if posterior is None:
+        posterior = BetaPosterior(k, prior_successes, prior_successes)
+    return thompson_sampling(
+        posterior, n_steps, take_action, None, out, callback, report_every, rng
+    )
+
+
+def batched_gaussian_thompson_sampling(
+    k: int,
+    prior_variance: float,
+    n_steps: int,
+    take_action: Callable[[np.ndarray], np.ndarray],
+    n_runs: int,
+    posterior: Optional[GaussianPosterior] = None,
+    out: Union[np.ndarray, bool, None] = None,
+    callback: Optional[Callable[[dict], None]] = None,
+    report_every: int = 1000,
+    rng: Optional[np.random.Generator] = None,
+):
+    """Run gaussian_thompson_sampling on n_runs bandits at once.
+
+    Returns:
+        np.ndarray: n_runs x n_steps array of rewards
+    """
+    if posterior is None:
+        posterior = GaussianPosterior((n_runs, k), prior_variance=prior_variance)
+    return thompson_sampling(
+        posterior, n_steps, take_action, n_runs, out, callback, report_every, rng
+    )
+
+
+def batched_bernoulli_thompson_sampling(
+    k: int,
+    prior_successes: float,
+    n_steps: int,
+    take_action: Callable[[np.ndarray], np.ndarray],
+    n_runs: int,
+    posterior: Optional[BetaPosterior] = None,
+    out: Union[np.ndarray, bool, None] = None,
+    callback: Optional[Callable[[dict], None]] = None,
+    report_every: int = 1000,
+    rng: Optional[np.random.Generator] = None,
+):
+    """Run bernoulli_thompson_sampling on n_runs bandits at once.
+
+    Returns:
+        np.ndarray: n_runs x n_steps array of rewards
+    """
+    if posterior is None:
+        posterior = BetaPosterior((n_runs, k), prior_successes, prior_successes)
+    return thompson_sampling(
+        posterior, n_steps, take_action, n_runs, out, callback, report_every, rng
+    )
@@ -0,0 +1,18 @@
+import numpy as np
+from bandit_sweep import run_sweep, run_config
+
+
+def test_sweep_is_reproducible_across_worker_counts():
+    configs = [
+        ("epsilon_greedy", 0.1, 0),
+        ("upper_confidence_bound", 2, 0),
+        ("gradient_bandit", 0.1, 1),
+        ("epsilon_greedy", 0.1, 1),
+    ]
+    kwargs = {"k": 5, "n_steps": 50, "n_runs": 20, "entropy": 1}
+    serial = run_sweep(configs, max_workers=1, **kwargs)
+    parallel = run_sweep(configs, max_workers=3, **kwargs)
+    assert serial.shape == (4, 50)
+    assert np.array_equal(serial, parallel)
+    assert not np.array_equal(serial[0], serial[3])
+    assert np.array_equal(serial[0], run_config(configs[0], **kwargs))
@@ -0,0 +1,317 @@
+import warnings
+import numpy as np
+from multi_armed_bandit import (
+    ArmStatistics,
+    softmax,
+    sample_actions,
+    k_armed_bandit_problem,
+    epsilon_greedy,
+    incremental_epsilon_greedy,
+    upper_confidence_bound_action_selection,
+    lazy_upper_confidence_bound_action_selection,
+    incremental_gradient_bandit,
+    batched_epsilon_greedy,
+    batched_incremental_epsilon_greedy,
+    batched_upper_confidence_bound_action_selection,
+    batched_incremental_gradient_bandit,
+    bernoulli_bandit_problem,
+    GaussianPosterior,
+    BetaPosterior,
+    gaussian_thompson_sampling,
+    bernoulli_thompson_sampling,
+    batched_gaussian_thompson_sampling,
+    batched_bernoulli_thompson_sampling,
+)
+
+
+def deterministic_bandits(means):
+    """Bandits that always pay their mean, single and batched versions."""
+    runs = np.arange(len(means))
+    single = [lambda i, mean=mean: mean[i] for mean in means]
+    return single, lambda actions: means[runs, actions]
+
+
+def test_batched_bandit_problem_shape():
+    take_action = k_armed_bandit_problem(10, n_runs=50)
+    assert take_action.means.shape == (50, 10)
+    assert take_action(np.zeros(50, dtype=int)).shape == (50,)
+
+
+def test_batched_algorithms_match_single_run_algorithms():
+    # with no exploration and noise free rewards the greedy and ucb algorithms are
+    # deterministic
+    means = np.random.normal(0, 1, (5, 10))
+    single, batched = deterministic_bandits(means)
+    pairs = [
+        (epsilon_greedy, batched_epsilon_greedy, {"epsilon": 0}),
+        (
+            incremental_epsilon_greedy,
+            batched_incremental_epsilon_greedy,
+            {"epsilon": 0},
+        ),
+        (
+            upper_confidence_bound_action_selection,
+            batched_upper_confidence_bound_action_selection,
+            {"c": 2},
+        ),
+    ]
+    for algorithm, batched_algorithm, params in pairs:
+        rewards = batched_algorithm(
+            k=10, n_steps=30, take_action=batched, n_runs=5, **params
+        )
+        assert rewards.shape == (5, 30)
+        for run in range(5):
+            expected = algorithm(k=10, n_steps=30, take_action=single[run], **params)
+            assert np.allclose(rewards[run], expected)
+
+
+def test_arm_statistics_match_numpy():
+    rewards = np.random.normal(0, 1, 50)
+    arms = np.random.randint(0, 3, 50)
+    stats = ArmStatistics(3, history=4)
+    for arm, reward in zip(arms, rewards):
+        stats.update(arm, reward)
+    for arm in range(3):
+        arm_rewards = rewards[arms == arm]
+        assert stats.count[arm] == len(arm_rewards)
+        assert np.isclose(stats.mean[arm], np.mean(arm_rewards))
+        assert np.isclose(stats.variance[arm], np.var(arm_rewards, ddof=1))
+        assert np.array_equal(stats.recent_rewards(arm), arm_rewards[-4:])
+
+
+def test_batched_arm_statistics_history():
+    stats = ArmStatistics((2, 3), history=2)
+    runs = np.arange(2)
+    stats.update((runs, np.array([0, 1])), np.array([1.0, 2.0]))
+    stats.update((runs, np.array([0, 0])), np.array([3.0, 4.0]))
+    assert np.array_equal(stats.count, [[2, 0, 0], [1, 1, 0]])
+    assert np.array_equal(stats.mean, [[2, 0, 0], [4, 2, 0]])
+    assert np.array_equal(stats.recent_rewards((0, 0)), [1.0, 3.0])
+    assert np.array_equal(stats.recent_rewards((1, 2)), [])
+
+
+def test_epsilon_greedy_keeps_reward_history():
+    take_action = k_armed_bandit_problem(5)
+    stats = ArmStatistics(5, history=1000)
+    rewards = epsilon_greedy(
+        k=5, epsilon=0.5, n_steps=200, take_action=take_action, arm_statistics=stats
+    )
+    assert stats.count.sum() == 200
+    retained = np.concatenate([stats.recent_rewards(arm) for arm in range(5)])
+    assert np.isclose(retained.sum(), rewards.sum())
+
+
+def test_rewards_written_into_out(tmp_path):
+    take_action = k_armed_bandit_problem(5)
+    out = np.zeros(100)
+    rewards = incremental_epsilon_greedy(
+        k=5, epsilon=0.1, n_steps=100, take_action=take_action, out=out
+    )
+    assert rewards is out
+    assert np.all(out != 0)
+
+    batched = k_armed_bandit_problem(5, n_runs=3)
+    memmap = np.lib.format.open_memmap(
+        tmp_path / "rewards.npy", mode="w+", shape=(3, 100)
+    )
+    batched_upper_confidence_bound_action_selection(
+        k=5, c=2, n_steps=100, take_action=batched, n_runs=3, out=memmap
+    )
+    memmap.flush()
+    assert np.array_equal(np.load(tmp_path / "rewards.npy"), memmap)
+
+
+def test_callback_reports_every_n_steps():
+    take_action = k_armed_bandit_problem(5, n_runs=20)
+    reports = []
+    rewards = batched_epsilon_greedy(
+        k=5,
+        epsilon=0.1,
+        n_steps=250,
+        take_action=take_action,
+        n_runs=20,
+        callback=reports.append,
+        report_every=100,
+    )
+    assert [report["step"] for report in reports] == [100, 200, 250]
+    assert np.isclose(reports[0]["mean_reward"], rewards[:, :100].mean())
+    assert 0 <= reports[-1]["optimal_action"] <= 1
+
+
+def test_softmax_is_stable_for_large_preferences():
+    prob = softmax(np.array([[1000.0, 1000.0, 0.0], [0.0, 0.0, 0.0]]))
+    assert np.allclose(prob, [[0.5, 0.5, 0], [1 / 3, 1 / 3, 1 / 3]])
+
+
+def test_sample_actions_follows_probabilities():
+    prob = np.tile([0.1, 0.0, 0.6, 0.3], (20000, 1))
+    actions = sample_actions(prob)
+    frequency = np.bincount(actions, minlength=4) / len(actions)
+    assert frequency[1] == 0
+    assert np.allclose(frequency, prob[0], atol=0.02)
+    assert sample_actions(prob[0]) in (0, 2, 3)
+
+
+def test_gradient_bandit_learns_best_arm():
+    means = np.zeros((200, 5))
+    means[:, 3] = 2
+    take_action = lambda actions: means[np.arange(200), actions]
+    take_action.means = means
+    rewards = batched_incremental_gradient_bandit(
+        k=5, alpha=0.1, n_steps=300, take_action=take_action, n_runs=200
+    )
+    assert rewards[:, -50:].mean() > 1.5
+
+    single_rewards = incremental_gradient_bandit(
+        k=5, alpha=0.1, n_steps=300, take_action=lambda i: means[0, i]
+    )
+    assert single_rewards[-50:].mean() > 1.5
+
+
+def test_gaussian_posterior_matches_closed_form():
+    rng = np.random.default_rng(0)
+    rewards = rng.normal(1.5, 2, 40)
+    posterior = GaussianPosterior(
+        3, prior_mean=0.5, prior_variance=4, reward_variance=4
+    )
+    for reward in rewards:
+        posterior.update(1, reward)
+    precision = 1 / 4 + len(rewards) / 4
+    assert np.isclose(posterior.variance[1], 1 / precision)
+    assert np.isclose(posterior.mean[1], (0.5 / 4 + rewards.sum() / 4) / precision)
+    assert np.allclose(posterior.mean[[0, 2]], 0.5)
+    draws = np.array([posterior.sample(rng) for _ in range(2000)])
+    assert np.allclose(draws.mean(axis=0), posterior.mean, atol=0.15)
+
+
+def test_beta_posterior_counts_successes():
+    posterior = BetaPosterior((2, 3))
+    posterior.update((np.arange(2), np.array([0, 2])), np.array([1.0, 0.0]))
+    assert np.array_equal(posterior.alpha, [[2, 1, 1], [1, 1, 1]])
+    assert np.array_equal(posterior.beta, [[1, 1, 1], [1, 1, 2]])
+    assert posterior.sample(np.random.default_rng(0)).shape == (2, 3)
+
+
+def test_bernoulli_bandit_problem():
+    rng = np.random.default_rng(0)
+    take_action = bernoulli_bandit_problem(5, n_runs=2000, rng=rng)
+    rewards = take_action(np.zeros(2000, dtype=int))
+    assert set(np.unique(rewards)) <= {0.0, 1.0}
+    assert np.isclose(rewards.mean(), take_action.means[:, 0].mean(), atol=0.05)
+    assert bernoulli_bandit_problem(5, rng=rng)(2) in (0.0, 1.0)
+
+
+def test_thompson_sampling_finds_best_arm():
+    rng = np.random.default_rng(0)
+    for problem, algorithm, batched_algorithm in [
+        (
+            k_armed_bandit_problem,
+            gaussian_thompson_sampling,
+            batched_gaussian_thompson_sampling,
+        ),
+        (
+            bernoulli_bandit_problem,
+            bernoulli_thompson_sampling,
+            batched_bernoulli_thompson_sampling,
+        ),
+    ]:
+        take_action = problem(10, n_runs=200, rng=rng)
+        best = take_action.means.max(axis=1).mean()
+        rewards = batched_algorithm(10, 1, 1000, take_action, 200, rng=rng)
+        assert rewards.shape == (200, 1000)
+        assert rewards[:, -200:].mean() > 0.9 * best
+
+        take_action = problem(10, rng=rng)
+        rewards = algorithm(10, 1, 2000, take_action, rng=rng)
+        assert rewards.shape == (2000,)
+
+
+def test_thompson_sampling_beats_epsilon_greedy():
+    rng = np.random.default_rng(1)
+    take_action = k_armed_bandit_problem(10, n_runs=500, rng=rng)
+    thompson = batched_gaussian_thompson_sampling(10, 1, 500, take_action, 500, rng=rng)
+    greedy = batched_epsilon_greedy(10, 0.1, 500, take_action, 500, rng=rng)
+    assert thompson.mean() > greedy.mean()
+
+
+def test_ucb_pulls_each_arm_once_without_warnings():
+    means = np.random.normal(0, 1, (3, 8))
+    single, batched = deterministic_bandits(means)
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        rewards = batched_upper_confidence_bound_action_selection(8, 2, 20, batched, 3)
+        for run in range(3):
+            assert np.array_equal(rewards[run, :8], means[run])
+            single_rewards = upper_confidence_bound_action_selection(
+                8, 2, 20, single[run]
+            )
+            assert np.array_equal(single_rewards, rewards[run])
+            lazy_rewards = lazy_upper_confidence_bound_action_selection(
+                8, 2, 20, single[run]
+            )
+            assert np.array_equal(lazy_rewards[:8], means[run])
+
+
+def test_lazy_ucb_with_refresh_every_step_matches_ucb():
+    rng = np.random.default_rng(0)
+    means = rng.normal(0, 1, 50)
+    rewards = rng.normal(means, 1, (400, 50))
+    step = iter(range(10**6))
+
+    def take_action(i):
+        return rewards[next(step) % 400, i]
+
+    expected = upper_confidence_bound_action_selection(50, 1, 400, take_action)
+    step = iter(range(10**6))
+    lazy = lazy_upper_confidence_bound_action_selection(
+        50, 1, 400, take_action, refresh_every=1
+    )
+    assert np.array_equal(lazy, expected)
+
+
+def test_lazy_ucb_on_many_arms():
+    rng = np.random.default_rng(0)
+    k = 20_000
+    take_action = k_armed_bandit_problem(k, rng=rng)
+    statistics = ArmStatistics(k)
+    rewards = lazy_upper_confidence_bound_action_selection(
+        k, 0.5, 3 * k, take_action, arm_statistics=statistics
+    )
+    assert np.all(statistics.count >= 1)
+    # after the initial pulls the search concentrates on good arms
+    assert rewards[k:].mean() > rewards[:k].mean() + 1
+
+
+def test_callback_only_run_keeps_no_rewards():
+    rng = np.random.default_rng(0)
+    take_action = k_armed_bandit_problem(10, n_runs=20, rng=rng)
+    reports = []
+    result = batched_epsilon_greedy(
+        10,
+        0.1,
+        500,
+        take_action,
+        20,
+        out=False,
+        callback=reports.append,
+        report_every=100,
+        rng=rng,
+    )
+    assert result is None
+    assert [report["step"] for report in reports] == [100, 200, 300, 400, 500]
+
+    rng = np.random.default_rng(0)
+    take_action = k_armed_bandit_problem(10, n_runs=20, rng=rng)
+    stored_reports = []
+    rewards = batched_epsilon_greedy(
+        10,
+        0.1,
+        500,
+        take_action,
+        20,
+        callback=stored_reports.append,
+        report_every=100,
+        rng=rng,
+    )
+    assert reports == stored_reports
+    assert np.isclose(reports[-1]["mean_reward"], rewards[:, 400:].mean())
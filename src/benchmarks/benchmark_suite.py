@@ -0,0 +1,505 @@
+"""Benchmark suite for hex world, dynamic programming, Monte Carlo and the bandits.
+
+Each benchmark is a setup function registered with the parameters to run it at, for
+a quick preset and a full one. Setup builds the inputs and returns the call to time,
+so only the call is measured. Every case records its run times and the peak memory
+traced while it runs, and the results are written as JSON for comparing versions.
+
+Run from this directory with the other src directories on PYTHONPATH:
+
+    python benchmark_suite.py --quick --output results.json
+    python benchmark_suite.py --filter mdp --compare results.json
+"""
+
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from typing import Callable, List, Optional
+import numpy as np
+import scipy
+from hex_world import HexWorld, HexMove, VecHexWorld
+from lookahead_policy_evaluation import (
+    loopy_lookahead,
+    memoized_loopy_lookahead,
+    transmission_lookahead,
+    iterative_policy_evaluation,
+    linear_system_policy_evaluation,
+)
+from value_iteration import value_iteration
+from monte_carlo_policy_eval import (
+    get_hex_world_prior,
+    first_visit_monte_carlo_policy_eval,
+)
+from multi_armed_bandit import (
+    k_armed_bandit_problem,
+    epsilon_greedy,
+    incremental_epsilon_greedy,
+    upper_confidence_bound_action_selection,
+    lazy_upper_confidence_bound_action_selection,
+    incremental_gradient_bandit,
+    batched_epsilon_greedy,
+    batched_incremental_epsilon_greedy,
+    batched_upper_confidence_bound_action_selection,
+    batched_incremental_gradient_bandit,
+    bernoulli_bandit_problem,
+    gaussian_thompson_sampling,
+    bernoulli_thompson_sampling,
+    batched_gaussian_thompson_sampling,
+    batched_bernoulli_thompson_sampling,
+)
+
+# benchmark name -> (setup, quick parameters, full parameters)
+BENCHMARKS = {}
+
+
+def benchmark(name: str, quick: List[dict], full: List[dict]):
+    """Register a setup function. It takes the parameters as keyword arguments and
+    returns the zero argument call to time."""
+
+    def register(setup: Callable[..., Callable[[], object]]):
+        BENCHMARKS[name] = (setup, quick, full)
+        return setup
+
+    return register
+
+
+def benchmark_hex_world(rows: int, cols: int, seed: int = 0) -> HexWorld:
+    """Random rows x cols hex world with 10% blank hexagons and a few scored ones."""
+    rng = np.random.default_rng(seed)
+    grid = rng.choice(["0", "X"], size=(rows, cols), p=[0.9, 0.1]).astype("<U3")
+    scored = rng.random((rows, cols)) < 0.02
+    grid[scored] = rng.choice(["10", "-10", "5"], size=np.count_nonzero(scored))
+    grid[-1, -1] = "10"
+    policy = rng.integers(0, len(HexMove), size=(rows, cols))
+    return HexWorld(grid=grid.tolist(), policy=policy)
+
+
+def grid_sizes(*sizes):
+    return [{"rows": rows, "cols": cols} for rows, cols in sizes]
+
+
+@benchmark(
+    "hex_world_construction",
+    quick=grid_sizes((3, 10), (30, 30)),
+    full=grid_sizes((3, 10), (30, 30), (100, 100), (300, 300)),
+)
+def hex_world_construction(rows, cols):
+    return lambda: benchmark_hex_world(rows, cols)
+
+
+@benchmark(
+    "get_mdp",
+    quick=grid_sizes((3, 10)),
+    full=grid_sizes((3, 10), (10, 10), (20, 20)),
+)
+def get_mdp(rows, cols):
+    return benchmark_hex_world(rows, cols).get_mdp
+
+
+@benchmark(
+    "get_mdp_vectorized",
+    quick=grid_sizes((3, 10), (10, 10)),
+    full=grid_sizes((3, 10), (10, 10), (30, 30)),
+)
+def get_mdp_vectorized(rows, cols):
+    return benchmark_hex_world(rows, cols).get_mdp_vectorized
+
+
+@benchmark(
+    "get_mdp_sparse",
+    quick=grid_sizes((3, 10), (30, 30)),
+    full=grid_sizes((3, 10), (30, 30), (100, 100), (300, 300)),
+)
+def get_mdp_sparse(rows, cols):
+    return benchmark_hex_world(rows, cols).get_mdp_sparse
+
+
+@benchmark("loopy_lookahead", quick=grid_sizes((1, 4)), full=grid_sizes((3, 10)))
+def loopy_lookahead_benchmark(rows, cols):
+    hw = benchmark_hex_world(rows, cols)
+    return lambda: loopy_lookahead(hw)
+
+
+@benchmark(
+    "memoized_loopy_lookahead",
+    quick=grid_sizes((3, 10)),
+    full=grid_sizes((3, 10), (10, 10)),
+)
+def memoized_loopy_lookahead_benchmark(rows, cols):
+    hw = benchmark_hex_world(rows, cols)
+    return lambda: memoized_loopy_lookahead(hw)
+
+
+@benchmark(
+    "transmission_lookahead",
+    quick=grid_sizes((1, 4)),
+    full=grid_sizes((3, 10)),
+)
+def transmission_lookahead_benchmark(rows, cols):
+    hw = benchmark_hex_world(rows, cols)
+    T, R = hw.get_mdp_vectorized()
+    return lambda: transmission_lookahead(T, R, hw)
+
+
+@benchmark(
+    "iterative_policy_evaluation",
+    quick=grid_sizes((3, 10), (30, 30)),
+    full=grid_sizes((3, 10), (30, 30), (100, 100), (300, 300)),
+)
+def iterative_policy_evaluation_benchmark(rows, cols):
+    hw = benchmark_hex_world(rows, cols)
+    T, R = hw.get_mdp_sparse()
+    policy = np.append(hw.get_policy_actions(), 0)
+    return lambda: iterative_policy_evaluation(T, R, policy)
+
+
+@benchmark(
+    "linear_system_policy_evaluation",
+    quick=grid_sizes((3, 10), (30, 30)),
+    full=grid_sizes((3, 10), (30, 30), (100, 100), (300, 300)),
+)
+def linear_system_policy_evaluation_benchmark(rows, cols):
+    hw = benchmark_hex_world(rows, cols)
+    T, R = hw.get_mdp_sparse()
+    policy = np.append(hw.get_policy_actions(), 0)
+    return lambda: linear_system_policy_evaluation(T, R, policy)
+
+
+@benchmark(
+    "value_iteration",
+    quick=grid_sizes((3, 10), (30, 30)),
+    full=grid_sizes((3, 10), (30, 30), (100, 100)),
+)
+def value_iteration_benchmark(rows, cols):
+    T, R = benchmark_hex_world(rows, cols).get_mdp_sparse()
+    return lambda: value_iteration(T, R)
+
+
+@benchmark(
+    "first_visit_monte_carlo_policy_eval",
+    quick=[{"rows": 3, "cols": 10, "n_episodes": n} for n in (10, 100)],
+    full=[{"rows": 3, "cols": 10, "n_episodes": n} for n in (10, 100, 1000)]
+    + [{"rows": 30, "cols": 30, "n_episodes": 100}],
+)
+def first_visit_monte_carlo_benchmark(rows, cols, n_episodes):
+    hw = benchmark_hex_world(rows, cols)
+    T, R = hw.get_mdp_sparse()
+    policy_matrix = np.full((hw.num_states, len(HexMove)), 1 / len(HexMove))
+    p_init = get_hex_world_prior(hw.grid)
+    return lambda: first_visit_monte_carlo_policy_eval(
+        T,
+        policy_matrix,
+        R,
+        p_init,
+        n_iterations=10,
+        n_episodes=n_episodes,
+        rng=np.random.default_rng(0),
+    )
+
+
+@benchmark(
+    "vec_hex_world_step",
+    quick=[{"rows": 30, "cols": 30, "n_agents": 10_000}],
+    full=[
+        {"rows": rows, "cols": cols, "n_agents": n}
+        for rows, cols in [(30, 30), (300, 300)]
+        for n in (1_000, 100_000)
+    ],
+)
+def vec_hex_world_step(rows, cols, n_agents, n_steps=100):
+    hw = benchmark_hex_world(rows, cols)
+    env = VecHexWorld(hw, rng=np.random.default_rng(0))
+    policy = hw.get_policy_actions().astype(np.intp)
+
+    def run():
+        env.reset(n_agents)
+        for _ in range(n_steps):
+            env.step(policy[env.states])
+
+    return run
+
+
+# bandit name -> (algorithm, parameter, batched, bandit problem)
+BANDITS = {
+    "epsilon_greedy": (epsilon_greedy, 0.1, False, k_armed_bandit_problem),
+    "incremental_epsilon_greedy": (
+        incremental_epsilon_greedy,
+        0.1,
+        False,
+        k_armed_bandit_problem,
+    ),
+    "upper_confidence_bound": (
+        upper_confidence_bound_action_selection,
+        2,
+        False,
+        k_armed_bandit_problem,
+    ),
+    "lazy_upper_confidence_bound": (
+        lazy_upper_confidence_bound_action_selection,
+        2,
+        False,
+        k_armed_bandit_problem,
+    ),
+    "gradient_bandit": (
+        incremental_gradient_bandit,
+        0.1,
+        False,
+        k_armed_bandit_problem,
+    ),
+    "batched_epsilon_greedy": (
+        batched_epsilon_greedy,
+        0.1,
+        True,
+        k_armed_bandit_problem,
+    ),
+    "batched_incremental_epsilon_greedy": (
+        batched_incremental_epsilon_greedy,
+        0.1,
+        True,
+        k_armed_bandit_problem,
+    ),
+    "batched_upper_confidence_bound": (
+        batched_upper_confidence_bound_action_selection,
+        2,
+        True,
+        k_armed_bandit_problem,
+    ),
+    "batched_gradient_bandit": (
+        batched_incremental_gradient_bandit,
+        0.1,
+        True,
+        k_armed_bandit_problem,
+    ),
+    "gaussian_thompson_sampling": (
+        gaussian_thompson_sampling,
+        1,
+        False,
+        k_armed_bandit_problem,
+    ),
+    "bernoulli_thompson_sampling": (
+        bernoulli_thompson_sampling,
+        1,
+        False,
+        bernoulli_bandit_problem,
+    ),
+    "batched_gaussian_thompson_sampling": (
+        batched_gaussian_thompson_sampling,
+        1,
+        True,
+        k_armed_bandit_problem,
+    ),
+    "batched_bernoulli_thompson_sampling": (
+        batched_bernoulli_thompson_sampling,
+        1,
+        True,
+        bernoulli_bandit_problem,
+    ),
+}
+
+
+def register_bandit(name: str):
+    algorithm, parameter, batched, problem = BANDITS[name]
+    quick = [{"k": 10, "n_steps": 1000}]
+    full = [{"k": k, "n_steps": n} for k in (10, 1000) for n in (1000, 10_000)]
+    if batched:
+        quick = [dict(params, n_runs=100) for params in quick]
+        full = [dict(params, n_runs=2000) for params in full]
+
+    def setup(k, n_steps, n_runs=None):
+        take_action = problem(k, n_runs, rng=np.random.default_rng(0))
+        args = (k, parameter, n_steps, take_action) + ((n_runs,) if batched else ())
+        return lambda: algorithm(*args)
+
+    benchmark(f"bandit_{name}", quick, full)(setup)
+
+
+for name in BANDITS:
+    register_bandit(name)
+
+
+def loop_gradient_bandit(k: int, alpha: float, n_steps: int, take_action):
+    """The gradient bandit as it was before vectorizing, kept as a reference."""
+    preference = np.zeros(k)
+    A_selected_count = np.zeros(k)
+    R_mean = np.zeros(k)
+    total_reward = []
+    for i in range(n_steps):
+        prob_preference = np.exp(preference) / np.sum(np.exp(preference))
+        next_action = np.argmax(prob_preference)
+        reward = take_action(next_action)
+        total_reward.append(reward)
+        A_selected_count[next_action] += 1
+        preference[next_action] = preference[next_action] + alpha * (
+            reward - R_mean[next_action]
+        ) * (1 - prob_preference[next_action])
+        for a in range(k):
+            if a != next_action:
+                preference[a] = (
+                    preference[a] - alpha * (reward - R_mean[a]) * prob_preference[a]
+                )
+        count = A_selected_count[next_action]
+        R_mean[next_action] = (1 - (1 / count)) * R_mean[next_action] + (
+            1 / count
+        ) * reward
+    return np.array(total_reward)
+
+
+@benchmark(
+    "bandit_gradient_bandit_loop_reference",
+    quick=[{"k": 10, "n_steps": 1000}],
+    full=[{"k": k, "n_steps": 2000} for k in (10, 100, 1000, 5000)],
+)
+def loop_gradient_bandit_benchmark(k, n_steps):
+    take_action = k_armed_bandit_problem(k, rng=np.random.default_rng(0))
+    return lambda: loop_gradient_bandit(k, 0.1, n_steps, take_action)
+
+
+def measure(run: Callable[[], object], min_time: float = 0.2, max_repeats: int = 10):
+    """Time run until min_time has passed or max_repeats calls, then trace its peak
+    memory over one more call.
+
+    Returns:
+        dict: run times in seconds and peak traced memory in bytes
+    """
+    times = []
+    while len(times) < max_repeats and (not times or sum(times) < min_time):
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        run()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {
+        "repeats": len(times),
+        "min_seconds": min(times),
+        "mean_seconds": float(np.mean(times)),
+        "std_seconds": float(np.std(times)),
+        "peak_memory_bytes": peak,
+    }
+
+
+def run_benchmarks(
+    names: Optional[List[str]] = None,
+    preset: str = "quick",
+    min_time: float = 0.2,
+    max_repeats: int = 10,
+    report: Optional[Callable[[dict], None]] = None,
+):
+    """Run the registered benchmarks.
+
+    Args:
+        names (list, optional): benchmarks to run, or substrings of their names.
+            Defaults to all of them.
+        preset (str): "quick" or "full" parameters
+        min_time (float): keep repeating a case until it has run this long
+        max_repeats (int): most timed calls per case
+        report (Callable, optional): called with each result as it finishes
+
+    Returns:
+        list: one dict per case with the benchmark name, parameters and measurements
+    """
+    if preset not in ("quick", "full"):
+        raise ValueError(f"Unknown preset {preset}")
+    results = []
+    for name, (setup, quick, full) in BENCHMARKS.items():
+        if names and not any(pattern in name for pattern in names):
+            continue
+        for params in quick if preset == "quick" else full:
+            run = setup(**params)
+            result = {
+                "name": name,
+                "params": params,
+                **measure(run, min_time, max_repeats),
+            }
+            results.append(result)
+            if report is not None:
+                report(result)
+    return results
+
+
+def environment_metadata():
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "git_commit": commit,
+        "python": sys.version.split()[0],
+        "numpy": np.__version__,
+        "scipy": scipy.__version__,
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+    }
+
+
+def write_results(results: list, path: str, preset: str):
+    with open(path, "w") as f:
+        json.dump(
+            {"metadata": environment_metadata(), "preset": preset, "results": results},
+            f,
+            indent=2,
+        )
+
+
+def result_key(result: dict):
+    """Identify a benchmark case by its name and parameters."""
+    return result["name"], json.dumps(result["params"], sort_keys=True)
+
+
+def compare_results(baseline: list, results: list):
+    """Get min_seconds of results over baseline for every case present in both."""
+    baseline_times = {result_key(result): result["min_seconds"] for result in baseline}
+    return {
+        result_key(result): result["min_seconds"] / baseline_times[result_key(result)]
+        for result in results
+        if result_key(result) in baseline_times
+    }
+
+
+def format_result(result: dict) -> str:
+    params = " ".join(f"{k}={v}" for k, v in result["params"].items())
+    return (
+        f"{result['name']:42s} {params:36s} {result['min_seconds'] * 1e3:10.3f}ms "
+        f"{result['peak_memory_bytes'] / 2**20:9.2f}MiB x{result['repeats']}"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--quick", action="store_true", help="small problem sizes")
+    parser.add_argument("--filter", nargs="*", help="benchmark name substrings")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="JSON results to compare against")
+    parser.add_argument("--min-time", type=float, default=0.2)
+    parser.add_argument("--max-repeats", type=int, default=10)
+    args = parser.parse_args()
+
+    preset = "quick" if args.quick else "full"
+    results = run_benchmarks(
+        args.filter,
+        preset,
+        args.min_time,
+        args.max_repeats,
+        report=lambda result: print(format_result(result), flush=True),
+    )
+    if args.output:
+        write_results(results, args.output, preset)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+        print()
+        for (name, params), ratio in compare_results(baseline, results).items():
+            flag = "slower" if ratio > 1.1 else "faster" if ratio < 0.9 else ""
+            print(f"{name:42s} {params:36s} {ratio:6.2f}x {flag}")
@@ -0,0 +1,55 @@
+import json
+import numpy as np
+import pytest
+from benchmark_suite import (
+    BENCHMARKS,
+    run_benchmarks,
+    write_results,
+    compare_results,
+    measure,
+    benchmark_hex_world,
+)
+
+
+def test_benchmark_hex_world_is_reproducible():
+    a, b = benchmark_hex_world(5, 7), benchmark_hex_world(5, 7)
+    assert a.shape == (5, 7)
+    assert np.array_equal(a.scores, b.scores)
+    assert np.array_equal(a.policy, b.policy)
+    assert a.scores[-1] == 10
+
+
+def test_measure_records_time_and_memory():
+    result = measure(lambda: np.ones(1_000_000), min_time=0.0, max_repeats=3)
+    assert result["repeats"] == 1
+    assert result["min_seconds"] > 0
+    assert result["peak_memory_bytes"] >= 8_000_000
+
+
+def test_every_benchmark_has_parameters():
+    for setup, quick, full in BENCHMARKS.values():
+        assert quick and full
+        assert callable(setup(**quick[0]))
+
+
+def test_run_benchmarks_writes_json(tmp_path):
+    results = run_benchmarks(["get_mdp_sparse", "bandit_epsilon_greedy"], max_repeats=1)
+    assert {result["name"] for result in results} == {
+        "get_mdp_sparse",
+        "bandit_epsilon_greedy",
+    }
+    path = tmp_path / "results.json"
+    write_results(results, path, "quick")
+    with open(path) as f:
+        saved = json.load(f)
+    assert saved["preset"] == "quick"
+    assert "numpy" in saved["metadata"]
+    assert saved["results"] == results
+    ratios = compare_results(saved["results"], results)
+    assert len(ratios) == len(results)
+    assert all(ratio == pytest.approx(1) for ratio in ratios.values())
+
+
+def test_unknown_preset():
+    with pytest.raises(ValueError):
+        run_benchmarks(preset="huge")
@@ -1,6 +1,17 @@
-from typing import Tuple, List
-from hex_world import HexWorld, HexMove, Hexagon
+from typing import Tuple, List, Optional
+from collections import OrderedDict
+from hex_world import (
+    HexWorld,
+    HexMove,
+    Hexagon,
+    transition_successors,
+    expected_next_values,
+    self_transition_probs,
+)
 import numpy as np
+import scipy.linalg
+import scipy.sparse
+import scipy.sparse.linalg
 
 GRID = [
     [
@@ -31,6 +42,35 @@ GRID = [
 ]
 EAST_POLICY = [[HexMove.EAST for _ in range(10)] for _ in range(3)]
 MAX_DEPTH = 10
+DENSE_SOLVE_MAX_STATES = 2000  # above this "auto" uses a sparse factorization
+
+
+class LRUCache:
+    """Bounded cache that evicts the least recently used entry, and counts hits and misses."""
+
+    def __init__(self, maxsize=100_000):
+        self.maxsize = maxsize
+        self.table = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.table)
+
+    def get(self, key):
+        """Get the value stored for key, or None if it is not cached."""
+        if key in self.table:
+            self.hits += 1
+            self.table.move_to_end(key)
+            return self.table[key]
+        self.misses += 1
+        return None
+
+    def put(self, key, value):
+        self.table[key] = value
+        self.table.move_to_end(key)
+        if len(self.table) > self.maxsize:
+            self.table.popitem(last=False)
 
 
 def loopy_lookahead_recursive(state: Hexagon, depth=0, gamma=0.99, max_depth=MAX_DEPTH):
@@ -51,9 +91,13 @@ def loopy_lookahead_recursive(state: Hexagon, depth=0, gamma=0.99, max_depth=MAX
     for prob, next_state in lottery:
         if next_state == None:
             rollout += -1 * prob
-            rollout += prob * loopy_lookahead_recursive(state, depth + 1)
+            rollout += prob * loopy_lookahead_recursive(
+                state, depth + 1, gamma, max_depth
+            )
         else:
-            rollout += prob * loopy_lookahead_recursive(next_state, depth + 1)
+            rollout += prob * loopy_lookahead_recursive(
+                next_state, depth + 1, gamma, max_depth
+            )
 
     return gamma * rollout
 
@@ -74,29 +118,105 @@ def loopy_lookahead(hw):
     return U_oo_lookahead
 
 
+def memoized_loopy_lookahead_recursive(
+    state: Hexagon, table: LRUCache, depth=0, gamma=0.99, max_depth=MAX_DEPTH
+):
+    """loopy_lookahead_recursive with a transposition table.
+
+    Subproblems are keyed on (state id, remaining depth, action), so the table is only
+    valid for one HexWorld policy and one gamma. The root (depth 0) is not cached as
+    its value differs for scored states.
+    """
+    if depth > max_depth:
+        return 0
+
+    key = (state.state_id, max_depth - depth, state.policy)
+    if depth > 0:
+        cached = table.get(key)
+        if cached is not None:
+            return cached
+
+    R = 0
+    action = state.policy
+    if depth > 0:
+        R = state.score
+    if R == -1:
+        raise Exception("shouldnt be able to move to hole")
+    if R != 0:
+        return R
+
+    lottery = state.reachable_states(action)
+    rollout = 0
+    for prob, next_state in lottery:
+        if next_state == None:
+            rollout += -1 * prob
+            next_state = state
+        rollout += prob * memoized_loopy_lookahead_recursive(
+            next_state, table, depth + 1, gamma, max_depth
+        )
+
+    if depth > 0:
+        table.put(key, gamma * rollout)
+    return gamma * rollout
+
+
+def memoized_loopy_lookahead(
+    hw: HexWorld, gamma=0.99, max_depth=MAX_DEPTH, table: Optional[LRUCache] = None
+):
+    """loopy_lookahead sharing one transposition table across every start state.
+
+    Pass a table to read its hit and miss counts afterwards.
+    """
+    if table is None:
+        table = LRUCache()
+    U_oo_lookahead = []
+    for row in hw.hexagons:
+        for hexagon in row:
+            if hexagon.score == 0:
+                U_oo_lookahead.append(
+                    memoized_loopy_lookahead_recursive(
+                        hexagon, table, gamma=gamma, max_depth=max_depth
+                    )
+                )
+            else:
+                U_oo_lookahead.append(np.inf)
+    return np.array(U_oo_lookahead)
+
+
 def transmission_lookahead_recursive(
     state: int, T, R, policy, depth=0, gamma=0.99, max_depth=MAX_DEPTH
 ):
     if depth > max_depth:
         return 0
 
+    # policy is one action for every state or an array of actions per state
+    action = policy if np.ndim(policy) == 0 else policy[state]
     reward = 0
     # if depth > 0:
-    reward = R[state, policy]
+    reward = R[state, action]
     if reward != 0:
         return reward
 
-    for next_state_index, next_state_prob in enumerate(T[state, policy]):
-        if next_state_prob > 0:
-            if next_state_index == state:
-                reward += next_state_prob * -1
-            reward += next_state_prob * transmission_lookahead_recursive(
-                next_state_index, T, R, policy, depth + 1
-            )
+    # T can be dense or a SparseTransitionMatrix
+    next_states, next_probs = transition_successors(T, state, action)
+    for next_state_index, next_state_prob in zip(next_states, next_probs):
+        if next_state_index == state:
+            reward += next_state_prob * -1
+        reward += next_state_prob * transmission_lookahead_recursive(
+            next_state_index, T, R, policy, depth + 1
+        )
     return gamma * reward
 
 
-def transmission_lookahead(T, R, hw: HexWorld):
+def transmission_lookahead(T, R, hw: HexWorld, policy=None):
+    """Lookahead every unscored state through the transition matrix.
+
+    policy is an action for every state or an array with one per state, it defaults
+    to the policy of hw.
+    """
+    if policy is None:
+        # the terminal state has no hexagon, give it any action
+        policy = np.append(hw.get_policy_actions(), 0)
     U_trans_lookahead = []
     rows = len(hw.grid)
     cols = len(hw.grid[0])
@@ -106,29 +226,203 @@ def transmission_lookahead(T, R, hw: HexWorld):
             index = i * cols + j
             if hexagon.score == 0:
                 U_trans_lookahead.append(
-                    transmission_lookahead_recursive(
-                        index, T, R, policy=HexMove.EAST.value
-                    )
+                    transmission_lookahead_recursive(index, T, R, policy=policy)
                 )
             else:
                 U_trans_lookahead.append(np.inf)
     return np.array(U_trans_lookahead)
 
 
+def lookahead_backup_terms(T, R, policy, gamma=0.99, wall_cost=1.0):
+    """Split one step of the lookahead under policy into a reward and a discount.
+
+    Follows the convention of transmission_lookahead_recursive: a state with a nonzero
+    reward ends the episode with that reward, and every other state pays -1 for each
+    move back into itself (walking into a wall). The last state is the terminal state
+    of the mdp and is worth 0.
+
+    Args:
+        T: dense transition matrix or SparseTransitionMatrix
+        R (np.ndarray): |states| x |actions| reward matrix
+        policy: action index taken in every state, or an array with one per state
+        gamma (float): discount
+        wall_cost (float): cost of each move back into the same state, 0 for the
+            plain returns the sampling environments pay
+
+    Returns:
+        actions, reward and discount arrays, each with one entry per state, such that
+        V = reward + discount * E[V(s')] under actions.
+    """
+    states = np.arange(len(R))
+    actions = np.broadcast_to(np.asarray(policy), states.shape)
+    R_pi = R[states, actions]
+    self_probs = self_transition_probs(T, actions)
+    done = R_pi != 0
+    reward = np.where(done, R_pi, -wall_cost * gamma * self_probs)
+    discount = np.where(done, 0.0, gamma)
+    reward[-1] = 0
+    discount[-1] = 0
+    return actions, reward, discount
+
+
+def iterative_policy_evaluation(T, R, policy, gamma=0.99, tol=1e-8, max_iter=1000):
+    """Evaluate a policy by sweeping V <- R_pi + gamma * T_pi V until it converges.
+
+    Each sweep is one batched product over all states, so cost per sweep is linear in
+    the number of transitions, rather than exponential in depth like the recursive
+    lookaheads. Running max_depth + 1 sweeps with tol=0 reproduces
+    transmission_lookahead.
+
+    Args:
+        T: dense transition matrix or SparseTransitionMatrix
+        R (np.ndarray): |states| x |actions| reward matrix
+        policy: action index taken in every state, or an array with one per state
+        gamma (float): discount
+        tol (float): stop once the largest change in V is at most tol
+        max_iter (int): maximum number of sweeps
+
+    Returns:
+        value per state, and the largest change in V of each sweep
+    """
+    actions, reward, discount = lookahead_backup_terms(T, R, policy, gamma)
+    V = np.zeros(len(R))
+    residuals = []
+    for _ in range(max_iter):
+        V_next = reward + discount * expected_next_values(T, V, actions)
+        residuals.append(np.max(np.abs(V_next - V)))
+        V = V_next
+        if residuals[-1] <= tol:
+            break
+    return V, np.array(residuals)
+
+
+class LinearPolicyEvaluator:
+    """Evaluate policies exactly by solving (I - gamma T_pi) V = R_pi.
+
+    Uses the reward convention of lookahead_backup_terms, with its wall_cost.
+    Factorizations are cached per (policy, gamma), so evaluating the same policy again,
+    as happens in the inner loop of policy iteration, only costs a triangular solve.
+
+    Methods:
+        "dense": LU factorization of the dense system
+        "sparse": sparse LU factorization (splu)
+        "gmres", "bicgstab": iterative solvers, warm started from the last solution
+        "auto": "dense" for small dense T, otherwise "sparse"
+    """
+
+    def __init__(self, T, R, method="auto", tol=1e-10, cache_size=32, wall_cost=1.0):
+        if method == "auto":
+            dense = isinstance(T, np.ndarray) and len(R) <= DENSE_SOLVE_MAX_STATES
+            method = "dense" if dense else "sparse"
+        if method not in ("dense", "sparse", "gmres", "bicgstab"):
+            raise ValueError(f"Unknown method {method}")
+        self.T = T
+        self.R = R
+        self.method = method
+        self.tol = tol
+        self.wall_cost = wall_cost
+        self.cache = LRUCache(cache_size)
+
+    @property
+    def hits(self):
+        """Evaluations that reused a cached factorization."""
+        return self.cache.hits
+
+    @property
+    def misses(self):
+        """Evaluations that had to factorize."""
+        return self.cache.misses
+
+    def system(self, actions, discount):
+        """Build the sparse matrix I - diag(discount) T_pi."""
+        states = np.arange(len(actions))
+        if isinstance(self.T, np.ndarray):
+            T_pi = scipy.sparse.csr_matrix(self.T[states, actions])
+        else:
+            width = self.T.next_states.shape[2]
+            T_pi = scipy.sparse.csr_matrix(
+                (
+                    self.T.probs[states, actions].ravel(),
+                    (
+                        np.repeat(states, width),
+                        self.T.next_states[states, actions].ravel(),
+                    ),
+                ),
+                shape=(len(states), len(states)),
+            )
+        return scipy.sparse.identity(len(states), format="csr") - (
+            scipy.sparse.diags(discount) @ T_pi
+        )
+
+    def factorize(self, actions, discount):
+        A = self.system(actions, discount)
+        if self.method == "dense":
+            return scipy.linalg.lu_factor(A.toarray())
+        if self.method == "sparse":
+            return scipy.sparse.linalg.splu(A.tocsc())
+        return A
+
+    def evaluate(self, policy, gamma=0.99):
+        """Get the value of each state under policy."""
+        actions, reward, discount = lookahead_backup_terms(
+            self.T, self.R, policy, gamma, self.wall_cost
+        )
+        key = (actions.tobytes(), gamma)
+        entry = self.cache.get(key)
+        if entry is None:
+            entry = [self.factorize(actions, discount), None]
+            self.cache.put(key, entry)
+        factorization, last_V = entry
+
+        if self.method == "dense":
+            V = scipy.linalg.lu_solve(factorization, reward)
+        elif self.method == "sparse":
+            V = factorization.solve(reward)
+        else:
+            solver = getattr(scipy.sparse.linalg, self.method)
+            V, info = solver(factorization, reward, x0=last_V, rtol=self.tol, atol=0)
+            if info != 0:
+                raise RuntimeError(f"{self.method} did not converge, info={info}")
+        entry[1] = V
+        return V
+
+
+def linear_system_policy_evaluation(
+    T, R, policy, gamma=0.99, method="auto", wall_cost=1.0
+):
+    """Evaluate a policy exactly with a single linear solve.
+
+    Use a LinearPolicyEvaluator directly to reuse the factorization across calls.
+    """
+    evaluator = LinearPolicyEvaluator(T, R, method=method, wall_cost=wall_cost)
+    return evaluator.evaluate(policy, gamma)
+
+
 if __name__ == "__main__":
     hw = HexWorld(grid=GRID, policy=EAST_POLICY)
     T, R = hw.get_mdp()
+    shape = hw.get_grid_shape()
 
     print(R.shape)
 
     # do loopy lookahead with oo implementation
     U_loopy_lookahead = loopy_lookahead(hw)
-    print(U_loopy_lookahead.reshape(3, 10))
+    print(U_loopy_lookahead.reshape(shape))
 
     # now do lookahead using transsmission matrix
     U_trans_lookahead = transmission_lookahead(T, R, hw)
     print()
-    print(U_trans_lookahead.reshape(3, 10))
+    print(U_trans_lookahead.reshape(shape))
+
+    # iterate the bellman equation to convergence
+    U_iterative, residuals = iterative_policy_evaluation(T, R, HexMove.EAST.value)
+    print()
+    print(U_iterative[:-1].reshape(shape), len(residuals))
+
+    # solve the system of equations
+    U_linear = linear_system_policy_evaluation(T, R, HexMove.EAST.value)
+    print()
+    print(U_linear[:-1].reshape(shape))
 
     # # look at small depth
     # U_lookahead = np.array(
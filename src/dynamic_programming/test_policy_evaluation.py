@@ -1,7 +1,16 @@
 # import pytest
 import numpy as np
-from hex_world import HexMove, HexWorld
-from policy_evaluation import transmission_lookahead, loopy_lookahead
+from hex_world import HexMove, HexWorld, policy_mdp
+from lookahead_policy_evaluation import (
+    transmission_lookahead,
+    loopy_lookahead,
+    iterative_policy_evaluation,
+    linear_system_policy_evaluation,
+    LinearPolicyEvaluator,
+    LRUCache,
+    memoized_loopy_lookahead,
+    MAX_DEPTH,
+)
 
 GRID = [
     [
@@ -69,3 +78,125 @@ def test_transmission_and_loopy_equal_large_problem():
     Ut = transmission_lookahead(T, R, hw)
     Ul = loopy_lookahead(hw)
     assert np.allclose(Ut, Ul)
+
+
+def test_transmission_lookahead_sparse_equals_dense():
+    hw = HexWorld(grid=GRID, policy=EAST_POLICY)
+    T, R = hw.get_mdp()
+    T_sparse, _ = hw.get_mdp_sparse()
+    Ut = transmission_lookahead(T, R, hw)
+    Us = transmission_lookahead(T_sparse, R, hw)
+    assert np.array_equal(Ut, Us)
+
+
+def test_iterative_evaluation_matches_transmission_lookahead_at_max_depth():
+    hw = HexWorld(grid=GRID, policy=EAST_POLICY)
+    T, R = hw.get_mdp()
+    Ut = transmission_lookahead(T, R, hw)
+    Ui, residuals = iterative_policy_evaluation(
+        T, R, HexMove.EAST.value, tol=0, max_iter=MAX_DEPTH + 1
+    )
+    assert len(residuals) == MAX_DEPTH + 1
+    nonterminal = np.isfinite(Ut)
+    assert np.allclose(Ui[:-1][nonterminal], Ut[nonterminal])
+
+
+def test_iterative_evaluation_converges_sparse_and_dense():
+    hw = HexWorld(grid=GRID, policy=EAST_POLICY)
+    T, R = hw.get_mdp()
+    T_sparse, _ = hw.get_mdp_sparse()
+    Ud, residuals = iterative_policy_evaluation(
+        T, R, HexMove.EAST.value, gamma=0.9, tol=1e-10
+    )
+    Us, _ = iterative_policy_evaluation(
+        T_sparse, R, HexMove.EAST.value, gamma=0.9, tol=1e-10
+    )
+    assert residuals[-1] <= 1e-10
+    assert np.all(np.diff(residuals) <= 0)
+    assert np.allclose(Ud, Us)
+
+
+def test_linear_system_evaluation_matches_iterative_evaluation():
+    hw = HexWorld(grid=GRID, policy=EAST_POLICY)
+    T, R = hw.get_mdp()
+    T_sparse, _ = hw.get_mdp_sparse()
+    Ui, _ = iterative_policy_evaluation(T, R, HexMove.EAST.value, gamma=0.9, tol=0)
+    for method in ["dense", "sparse", "gmres", "bicgstab"]:
+        for transitions in [T, T_sparse]:
+            Ul = linear_system_policy_evaluation(
+                transitions, R, HexMove.EAST.value, gamma=0.9, method=method
+            )
+            assert np.allclose(Ul, Ui)
+
+
+def test_policy_mdp_of_deterministic_policy_matches_its_actions():
+    hw = HexWorld(grid=GRID, policy=EAST_POLICY)
+    T, R = hw.get_mdp()
+    policy_matrix = np.zeros((len(R) - 1, len(HexMove)))
+    policy_matrix[:, HexMove.EAST.value] = 1
+    for wall_cost in [1.0, 0.0]:
+        U = linear_system_policy_evaluation(
+            T, R, HexMove.EAST.value, gamma=0.9, wall_cost=wall_cost
+        )
+        U_pi = linear_system_policy_evaluation(
+            *policy_mdp(T, R, policy_matrix), 0, gamma=0.9, wall_cost=wall_cost
+        )
+        assert np.allclose(U_pi, U)
+    # without the wall cost no value is below the lowest reward
+    assert np.min(U) >= min(np.min(R), 0)
+
+
+def test_linear_policy_evaluator_caches_factorization():
+    hw = HexWorld(grid=GRID, policy=EAST_POLICY)
+    T, R = hw.get_mdp()
+    evaluator = LinearPolicyEvaluator(T, R, cache_size=1)
+    U = evaluator.evaluate(HexMove.EAST.value)
+    assert np.array_equal(evaluator.evaluate(HexMove.EAST.value), U)
+    assert (evaluator.hits, evaluator.misses) == (1, 1)
+    evaluator.evaluate(HexMove.EAST.value, gamma=0.9)
+    evaluator.evaluate(HexMove.EAST.value)
+    assert (evaluator.hits, evaluator.misses) == (1, 3)
+
+
+def test_memoized_loopy_lookahead_equals_loopy_small_problem():
+    grid = [["10", "0", "0", "0", "0", "10"], ["X", "X", "X", "X", "X", "X"]]
+    policy = [[HexMove.EAST for _ in row] for row in grid]
+    hw = HexWorld(grid=grid, policy=policy)
+    table = LRUCache()
+    Um = memoized_loopy_lookahead(hw, table=table)
+    assert np.array_equal(Um, loopy_lookahead(hw))
+    assert table.hits > 0
+    assert len(table) <= len(hw.grid[0]) * (MAX_DEPTH + 1)
+
+
+def test_memoized_loopy_lookahead_large_problem():
+    hw = HexWorld(grid=GRID, policy=EAST_POLICY)
+    T, R = hw.get_mdp()
+    Ut = transmission_lookahead(T, R, hw)
+    Um = memoized_loopy_lookahead(hw)
+    assert np.allclose(Ut, Um)
+
+    # deep lookaheads converge to the iterative evaluation
+    Ui, _ = iterative_policy_evaluation(T, R, HexMove.EAST.value, tol=0, max_iter=201)
+    Um = memoized_loopy_lookahead(hw, max_depth=200)
+    nonterminal = np.isfinite(Um)
+    assert np.allclose(Um[nonterminal], Ui[:-1][nonterminal])
+
+
+def test_memoized_loopy_lookahead_bounded_table():
+    hw = HexWorld(grid=GRID, policy=EAST_POLICY)
+    table = LRUCache(maxsize=8)
+    Um = memoized_loopy_lookahead(hw, max_depth=6, table=table)
+    assert len(table) == 8
+    assert np.allclose(Um, memoized_loopy_lookahead(hw, max_depth=6))
+
+
+def test_transmission_lookahead_uses_hex_world_policy():
+    rng = np.random.default_rng(1)
+    moves = list(HexMove)
+    policy = [[moves[i] for i in rng.integers(0, 6, size=10)] for _ in range(3)]
+    hw = HexWorld(grid=GRID, policy=policy)
+    T, R = hw.get_mdp()
+    Ut = transmission_lookahead(T, R, hw)
+    Um = memoized_loopy_lookahead(hw)
+    assert np.allclose(Ut, Um)
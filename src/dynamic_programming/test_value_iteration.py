@@ -0,0 +1,66 @@
+import numpy as np
+from hex_world import HexMove, HexWorld, GRID, predecessor_lists
+from lookahead_policy_evaluation import linear_system_policy_evaluation
+from value_iteration import (
+    value_iteration,
+    gauss_seidel_value_iteration,
+    prioritized_sweeping_value_iteration,
+    policy_iteration,
+)
+
+EAST_POLICY = [[HexMove.EAST for _ in range(10)] for _ in range(3)]
+SOLVERS = [
+    value_iteration,
+    gauss_seidel_value_iteration,
+    prioritized_sweeping_value_iteration,
+    policy_iteration,
+]
+
+
+def test_solvers_agree_on_optimal_values():
+    hw = HexWorld(grid=GRID, policy=EAST_POLICY)
+    T, R = hw.get_mdp()
+    V_star, policy_star, _ = policy_iteration(T, R)
+    for solver in SOLVERS:
+        V, policy, trace = solver(T, R)
+        assert np.allclose(V, V_star, atol=1e-6)
+        assert np.allclose(linear_system_policy_evaluation(T, R, policy), V_star)
+        assert len(trace) == len(trace.times) == len(trace.policy_changes)
+        assert trace.residuals[-1] <= 1e-8
+
+
+def test_optimal_values_beat_east_policy():
+    hw = HexWorld(grid=GRID, policy=EAST_POLICY)
+    T, R = hw.get_mdp()
+    V_star, _, _ = value_iteration(T, R)
+    V_east = linear_system_policy_evaluation(T, R, HexMove.EAST.value)
+    assert np.all(V_star >= V_east - 1e-6)
+    assert np.any(V_star > V_east + 1e-3)
+
+
+def test_solvers_on_sparse_mdp_match_dense_mdp():
+    hw = HexWorld(grid=GRID, policy=EAST_POLICY)
+    T, R = hw.get_mdp()
+    T_sparse, _ = hw.get_mdp_sparse()
+    for solver in SOLVERS:
+        V, policy, _ = solver(T, R)
+        V_sparse, policy_sparse, _ = solver(T_sparse, R)
+        assert np.allclose(V, V_sparse)
+        assert np.array_equal(policy, policy_sparse)
+
+
+def test_value_iteration_residuals_shrink():
+    hw = HexWorld(grid=GRID, policy=EAST_POLICY)
+    T, R = hw.get_mdp_sparse()
+    _, _, trace = value_iteration(T, R)
+    assert np.all(np.diff(trace.residuals) <= 1e-12)
+    assert trace.policy_changes[-1] == 0
+
+
+def test_predecessor_lists_sparse_match_dense():
+    hw = HexWorld(grid=GRID, policy=EAST_POLICY)
+    T = hw.get_mdp_transition_matrix()
+    T_sparse = hw.get_mdp_transition_matrix_sparse()
+    for dense, sparse in zip(predecessor_lists(T), predecessor_lists(T_sparse)):
+        assert np.array_equal(dense, sparse)
+    assert 29 in predecessor_lists(T)[30]  # the 10 hexagon moves to the terminal state
@@ -0,0 +1,238 @@
+"""Value iteration and policy iteration for the hex world mdp.
+
+All solvers use the reward convention of lookahead_backup_terms and work on dense
+transition matrices or SparseTransitionMatrix. Each returns the values, the greedy
+policy and a SolverTrace of per iteration residual, time and policy changes.
+"""
+
+import heapq
+import time
+import numpy as np
+from hex_world import (
+    HexWorld,
+    expected_next_values,
+    state_expected_next_values,
+    predecessor_lists,
+)
+from lookahead_policy_evaluation import (
+    GRID,
+    EAST_POLICY,
+    LinearPolicyEvaluator,
+    lookahead_backup_terms,
+)
+
+
+class SolverTrace:
+    """Per iteration record of a solver run.
+
+    residual is the largest Bellman error max_a Q(s, a) - V(s) after the iteration,
+    time the seconds since the solver started and policy_changes the number of states
+    whose greedy action changed.
+    """
+
+    def __init__(self):
+        self.residuals = []
+        self.times = []
+        self.policy_changes = []
+        self.start = time.perf_counter()
+
+    def __len__(self):
+        return len(self.residuals)
+
+    def record(self, residual: float, policy_changes: int):
+        self.residuals.append(float(residual))
+        self.times.append(time.perf_counter() - self.start)
+        self.policy_changes.append(int(policy_changes))
+
+
+def action_backup_terms(T, R, gamma=0.99, wall_cost=1.0):
+    """Reward and discount of every state and action, see lookahead_backup_terms.
+
+    Returns:
+        |states| x |actions| reward and discount arrays such that
+        Q = reward + discount * E[V(s') | s, a].
+    """
+    terms = [
+        lookahead_backup_terms(T, R, a, gamma, wall_cost)[1:] for a in range(R.shape[1])
+    ]
+    reward = np.stack([reward for reward, _ in terms], axis=1)
+    discount = np.stack([discount for _, discount in terms], axis=1)
+    return reward, discount
+
+
+def bellman_backup(T, reward, discount, V):
+    """Get Q(s, a) for every state and action from V in one batched product."""
+    return reward + discount * expected_next_values(T, V)
+
+
+def greedy_policy(Q, policy=None):
+    """Get the greedy action of each state, keeping the action of policy on ties."""
+    greedy = np.argmax(Q, axis=1)
+    if policy is None:
+        return greedy
+    states = np.arange(len(Q))
+    keep = Q[states, policy] >= Q[states, greedy]
+    return np.where(keep, policy, greedy)
+
+
+def value_iteration(T, R, gamma=0.99, tol=1e-8, max_iter=1000, wall_cost=1.0):
+    """Sweep V <- max_a Q(s, a) over all states at once until V stops changing.
+
+    Args:
+        T: dense transition matrix or SparseTransitionMatrix
+        R (np.ndarray): |states| x |actions| reward matrix
+        gamma (float): discount
+        tol (float): stop once the Bellman residual is at most tol
+        max_iter (int): maximum number of sweeps
+        wall_cost (float): cost of each move into a wall, see lookahead_backup_terms
+
+    Returns:
+        values, greedy policy and SolverTrace
+    """
+    trace = SolverTrace()
+    reward, discount = action_backup_terms(T, R, gamma, wall_cost)
+    V = np.zeros(len(R))
+    policy = np.zeros(len(R), dtype=int)
+    for _ in range(max_iter):
+        Q = bellman_backup(T, reward, discount, V)
+        V_next = np.max(Q, axis=1)
+        next_policy = greedy_policy(Q, policy)
+        trace.record(np.max(np.abs(V_next - V)), np.sum(next_policy != policy))
+        V, policy = V_next, next_policy
+        if trace.residuals[-1] <= tol:
+            break
+    return V, policy, trace
+
+
+def gauss_seidel_value_iteration(T, R, gamma=0.99, tol=1e-8, max_iter=1000):
+    """Value iteration updating V in place, state by state.
+
+    Later states in a sweep already see the new values of earlier ones, which usually
+    takes fewer sweeps than value_iteration at a higher cost per sweep.
+    """
+    trace = SolverTrace()
+    reward, discount = action_backup_terms(T, R, gamma)
+    V = np.zeros(len(R))
+    policy = np.zeros(len(R), dtype=int)
+    for _ in range(max_iter):
+        residual = 0.0
+        changes = 0
+        for s in range(len(R)):
+            q = reward[s] + discount[s] * state_expected_next_values(T, V, s)
+            action = policy[s] if q[policy[s]] >= np.max(q) else np.argmax(q)
+            residual = max(residual, abs(q[action] - V[s]))
+            changes += action != policy[s]
+            V[s] = q[action]
+            policy[s] = action
+        trace.record(residual, changes)
+        if residual <= tol:
+            break
+    return V, policy, trace
+
+
+def prioritized_sweeping_value_iteration(
+    T, R, gamma=0.99, tol=1e-8, max_updates=1_000_000
+):
+    """Value iteration that always backs up the state with the largest Bellman error.
+
+    After each update only the predecessors of the updated state can change, so only
+    their errors are recomputed. The heap holds stale entries, which are skipped when
+    their priority no longer matches. One trace iteration covers |states| updates.
+
+    Args:
+        T: dense transition matrix or SparseTransitionMatrix
+        R (np.ndarray): |states| x |actions| reward matrix
+        gamma (float): discount
+        tol (float): stop once the largest Bellman error is at most tol
+        max_updates (int): maximum number of state backups
+
+    Returns:
+        values, greedy policy and SolverTrace
+    """
+    trace = SolverTrace()
+    reward, discount = action_backup_terms(T, R, gamma)
+    predecessors = predecessor_lists(T)
+    V = np.zeros(len(R))
+    Q = bellman_backup(T, reward, discount, V)
+    policy = greedy_policy(Q)
+    priority = np.abs(np.max(Q, axis=1) - V)
+    heap = [(-p, s) for s, p in enumerate(priority) if p > tol]
+    heapq.heapify(heap)
+
+    changes = 0
+    for update in range(1, max_updates + 1):
+        while heap and -heap[0][0] != priority[heap[0][1]]:
+            heapq.heappop(heap)
+        if not heap:
+            break
+        _, s = heapq.heappop(heap)
+        q = reward[s] + discount[s] * state_expected_next_values(T, V, s)
+        action = policy[s] if q[policy[s]] >= np.max(q) else np.argmax(q)
+        changes += action != policy[s]
+        V[s] = q[action]
+        policy[s] = action
+        priority[s] = 0.0
+
+        for p in predecessors[s]:
+            q = reward[p] + discount[p] * state_expected_next_values(T, V, p)
+            priority[p] = abs(np.max(q) - V[p])
+            if priority[p] > tol:
+                heapq.heappush(heap, (-priority[p], p))
+
+        if update % len(R) == 0:
+            trace.record(np.max(priority), changes)
+            changes = 0
+    trace.record(np.max(priority), changes)
+    return V, policy, trace
+
+
+def policy_iteration(T, R, gamma=0.99, policy=None, max_iter=100, method="auto"):
+    """Alternate exact policy evaluation and greedy improvement until the policy is stable.
+
+    Evaluation solves the linear system with a LinearPolicyEvaluator.
+
+    Args:
+        T: dense transition matrix or SparseTransitionMatrix
+        R (np.ndarray): |states| x |actions| reward matrix
+        gamma (float): discount
+        policy (np.ndarray, optional): initial action per state. Defaults to action 0.
+        max_iter (int): maximum number of improvements
+        method (str): LinearPolicyEvaluator method
+
+    Returns:
+        values, greedy policy and SolverTrace
+    """
+    trace = SolverTrace()
+    reward, discount = action_backup_terms(T, R, gamma)
+    evaluator = LinearPolicyEvaluator(T, R, method=method, cache_size=1)
+    policy = np.zeros(len(R), dtype=int) if policy is None else np.array(policy)
+    for _ in range(max_iter):
+        V = evaluator.evaluate(policy, gamma)
+        Q = bellman_backup(T, reward, discount, V)
+        next_policy = greedy_policy(Q, policy)
+        changes = np.sum(next_policy != policy)
+        trace.record(np.max(np.max(Q, axis=1) - V), changes)
+        policy = next_policy
+        if changes == 0:
+            break
+    return V, policy, trace
+
+
+if __name__ == "__main__":
+    hw = HexWorld(grid=GRID, policy=EAST_POLICY)
+    T, R = hw.get_mdp_sparse()
+    shape = hw.get_grid_shape()
+
+    for solver in [
+        value_iteration,
+        gauss_seidel_value_iteration,
+        prioritized_sweeping_value_iteration,
+        policy_iteration,
+    ]:
+        V, policy, trace = solver(T, R)
+        print(
+            f"{solver.__name__:40s} {len(trace):4d} iterations "
+            f"{trace.times[-1] * 1000:8.2f}ms residual {trace.residuals[-1]:.2e}"
+        )
+    print(V[:-1].reshape(shape))
+    print(policy[:-1].reshape(shape))
@@ -1,6 +1,16 @@
+import os
 import numpy as np
 import matplotlib.pyplot as plt
-from hex_world import HexMove
+import scipy.stats
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from typing import Optional
+from hex_world import (
+    HexMove,
+    SparseTransitionMatrix,
+    sample_index,
+    transition_successors,
+)
 
 GRID = [
     [
@@ -31,15 +41,10 @@ GRID = [
 ]
 
 
-def get_hex_world_prior():
-    p_init = np.ones(30)
-    count = 0
-    for ri, row in enumerate(GRID):
-        for ci, col in enumerate(row):
-            if col != "0":
-                p_init[ri * 10 + ci] = 0
-                count += 1
-    p_init /= 30 - count
+def get_hex_world_prior(grid=GRID):
+    """Uniform initial state distribution over the unscored hexagons of grid."""
+    p_init = (np.array(grid) == "0").ravel().astype(float)
+    p_init /= np.sum(p_init)
     return p_init
 
 
@@ -47,35 +52,37 @@ def policy_list_to_matrix(policy):
     """
     policy maps state to action so is |states| x |actions|
     """
-    policy_matrix = np.zeros((30, 6))
-    for ri, row in enumerate(policy):
-        for ci, col in enumerate(row):
-            xi = [h for h in HexMove].index(col)
-            policy_matrix[ri * 10 + ci][xi] = 1
+    actions = np.array([[move.value for move in row] for row in policy]).ravel()
+    policy_matrix = np.zeros((len(actions), len(HexMove)))
+    policy_matrix[np.arange(len(actions)), actions] = 1
     return policy_matrix
 
 
 def sample_trajectories(transmission_matrix, policy_matrix, p_init, n=1):
     """
-    Reward from action in state deterministic
+    Reward from action in state deterministic. transmission_matrix can be a dense
+    array or a SparseTransitionMatrix.
     """
+    terminal = transmission_matrix.shape[0] - 1
     trajectories = []
     for _ in range(n):
-        current_index = np.random.choice(np.arange(30), p=p_init)
+        current_index = np.random.choice(len(p_init), p=p_init)
         trajectory = []
         count = 0
         while True:
             count += 1
-            if current_index == 30 or count > 1000:
+            if current_index == terminal or count > 1000:
                 break
             trajectory.append(current_index)
             a = np.random.choice(
                 np.arange(policy_matrix.shape[1]), p=policy_matrix[current_index]
             )
             trajectory.append(a)
-            # sample next state
-            next_state_prob = transmission_matrix[current_index, a, :]
-            current_index = np.random.choice(np.arange(31), p=next_state_prob)
+            # sample next state, transmission matrix can be dense or sparse
+            next_states, next_state_prob = transition_successors(
+                transmission_matrix, current_index, a
+            )
+            current_index = np.random.choice(next_states, p=next_state_prob)
 
         if (
             count < 1000
@@ -85,24 +92,342 @@ def sample_trajectories(transmission_matrix, policy_matrix, p_init, n=1):
     return trajectories
 
 
+class PackedEpisodes:
+    """Episodes packed into flat arrays.
+
+    The steps of episode i are states[offsets[i]:offsets[i + 1]], with the matching
+    actions and rewards. The terminal state is not stored.
+    """
+
+    def __init__(self, states, actions, rewards, offsets):
+        self.states = states
+        self.actions = actions
+        self.rewards = rewards
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    @property
+    def lengths(self):
+        return np.diff(self.offsets)
+
+    def episode(self, i: int):
+        """Get the states, actions and rewards of episode i."""
+        steps = slice(self.offsets[i], self.offsets[i + 1])
+        return self.states[steps], self.actions[steps], self.rewards[steps]
+
+    def batch(self, start: int, stop: int):
+        """Get episodes start to stop as PackedEpisodes, viewing the same arrays."""
+        stop = min(stop, len(self))
+        steps = slice(self.offsets[start], self.offsets[stop])
+        return PackedEpisodes(
+            self.states[steps],
+            self.actions[steps],
+            self.rewards[steps],
+            self.offsets[start : stop + 1] - self.offsets[start],
+        )
+
+
+def joint_outcome_table(transmission_matrix, policy_matrix):
+    """Precompute the cumulative distribution of (action, next state) from each state.
+
+    Drawing a single uniform against a state's row samples the action from the policy
+    and the next state from the transition lottery at once.
+
+    Returns:
+        cumulative probabilities, and the action and next state of each outcome, each
+        |policy states| x |actions * lottery width|
+    """
+    if not isinstance(transmission_matrix, SparseTransitionMatrix):
+        transmission_matrix = SparseTransitionMatrix.from_dense(transmission_matrix)
+    num_states, num_actions = policy_matrix.shape
+    width = transmission_matrix.next_states.shape[2]
+    probs = policy_matrix[:, :, None] * transmission_matrix.probs[:num_states]
+    cumulative = np.cumsum(probs.reshape(num_states, -1), axis=1)
+    actions = np.repeat(np.arange(num_actions), width)
+    next_states = transmission_matrix.next_states[:num_states].reshape(num_states, -1)
+    return cumulative, np.broadcast_to(actions, next_states.shape), next_states
+
+
+def sample_episodes(
+    transmission_matrix,
+    policy_matrix,
+    reward_matrix,
+    p_init,
+    n=1,
+    max_steps=1000,
+    rng: Optional[np.random.Generator] = None,
+):
+    """Sample n episodes in lockstep.
+
+    Every step advances all unfinished episodes together with one uniform draw each.
+    Episodes still running after max_steps are dropped, as in sample_trajectories,
+    so fewer than n episodes may be returned.
+
+    Args:
+        transmission_matrix: dense transition matrix or SparseTransitionMatrix, the
+            last state is the terminal state
+        policy_matrix (np.ndarray): |states| x |actions| action probabilities
+        reward_matrix (np.ndarray): |states| x |actions| rewards
+        p_init (np.ndarray): initial state distribution over the policy states
+        n (int): number of episodes
+        max_steps (int): longest episode kept
+        rng (np.random.Generator, optional): random source. Defaults to np.random.
+
+    Returns:
+        PackedEpisodes
+    """
+    rng = np.random if rng is None else rng
+    terminal = transmission_matrix.shape[0] - 1
+    cumulative, outcome_actions, outcome_states = joint_outcome_table(
+        transmission_matrix, policy_matrix
+    )
+
+    current = sample_index(np.broadcast_to(np.cumsum(p_init), (n, len(p_init))), rng)
+    active = np.arange(n)
+    steps = []  # (episode, state, action) of every step, one array per time step
+    for _ in range(max_steps):
+        if len(active) == 0:
+            break
+        states = current[active]
+        outcome = sample_index(cumulative[states], rng)
+        actions = outcome_actions[states, outcome]
+        steps.append((active, states, actions))
+
+        next_states = outcome_states[states, outcome]
+        running = next_states != terminal
+        active = active[running]
+        current[active] = next_states[running]
+
+    if steps:
+        episode, states, actions = (np.concatenate(step) for step in zip(*steps))
+    else:
+        episode = states = actions = np.zeros(0, dtype=int)
+    keep = ~np.isin(episode, active)  # drop truncated episodes
+    order = np.argsort(episode[keep], kind="stable")
+    episode, states, actions = (x[keep][order] for x in (episode, states, actions))
+
+    _, lengths = np.unique(episode, return_counts=True)
+    offsets = np.concatenate([[0], np.cumsum(lengths)])
+    return PackedEpisodes(states, actions, reward_matrix[states, actions], offsets)
+
+
+def discounted_returns(episodes: PackedEpisodes, gamma: float):
+    """Get the return G_t = r_t + gamma * G_t+1 of every step of every episode.
+
+    Scans backwards from the end of all episodes at once, so the Python loop runs
+    once per step of the longest episode rather than once per step overall.
+    """
+    G = np.zeros(len(episodes.rewards))
+    ends = episodes.offsets[1:] - 1
+    lengths = episodes.lengths
+    for steps_from_end in range(int(lengths.max(initial=0))):
+        t = ends[lengths > steps_from_end] - steps_from_end
+        G[t] = episodes.rewards[t]
+        if steps_from_end > 0:
+            G[t] += gamma * G[t + 1]
+    return G
+
+
+def first_visit_indices(episodes: PackedEpisodes, num_states: int):
+    """Get the flat index of the first visit to each state in each episode."""
+    episode = np.repeat(np.arange(len(episodes)), episodes.lengths)
+    _, first = np.unique(episode * num_states + episodes.states, return_index=True)
+    return first
+
+
+class ReturnStatistics:
+    """Per-state count, sum and sum of squares of first-visit returns.
+
+    These are sufficient statistics for the mean and its standard error, and
+    statistics gathered from separate sets of episodes merge exactly by adding them.
+    """
+
+    def __init__(self, num_states: int):
+        self.count = np.zeros(num_states)
+        self.total = np.zeros(num_states)
+        self.total_squares = np.zeros(num_states)
+
+    def add_episodes(self, episodes: PackedEpisodes, gamma: float):
+        num_states = len(self.count)
+        first = first_visit_indices(episodes, num_states)
+        states = episodes.states[first]
+        G = discounted_returns(episodes, gamma)[first]
+        self.count += np.bincount(states, minlength=num_states)
+        self.total += np.bincount(states, weights=G, minlength=num_states)
+        self.total_squares += np.bincount(states, weights=G**2, minlength=num_states)
+
+    def merge(self, other: "ReturnStatistics"):
+        self.count += other.count
+        self.total += other.total
+        self.total_squares += other.total_squares
+
+    @property
+    def value(self):
+        """Mean return of each state, 0 for unvisited states."""
+        return np.divide(
+            self.total, self.count, out=np.zeros_like(self.total), where=self.count > 0
+        )
+
+    @property
+    def standard_error(self):
+        """Standard error of each state's value, inf for states visited under twice."""
+        visited = self.count > 1
+        variance = np.full_like(self.total, np.inf)
+        variance[visited] = (
+            self.total_squares[visited] - self.total[visited] ** 2 / self.count[visited]
+        ) / (self.count[visited] - 1)
+        with np.errstate(invalid="ignore"):
+            return np.sqrt(np.maximum(variance, 0) / np.maximum(self.count, 1))
+
+    def half_width(self, confidence=0.95):
+        """Half width of the normal confidence interval of each state's value."""
+        return scipy.stats.norm.ppf((1 + confidence) / 2) * self.standard_error
+
+
 def first_visit_monte_carlo_policy_eval(
-    transsmision_matrix, policy_matrix, reward_matrix, p_init
+    transsmision_matrix,
+    policy_matrix,
+    reward_matrix,
+    p_init,
+    n_iterations=1000,
+    n_episodes=10,
+    gamma=0.99,
+    rng: Optional[np.random.Generator] = None,
+    store=None,
+):
+    """Estimate the value of each state as the mean of its first-visit returns.
+
+    Every iteration samples n_episodes episodes and folds all of their first-visit
+    returns into per-state counts and running means, so no sampled episode is wasted.
+    With a TrajectoryStore as store the episodes are also appended to it, to be
+    replayed later without sampling them again.
+
+    Returns:
+        value per state, including the terminal state
+
+    Raises:
+        ValueError: if store holds episodes of a different MDP
+    """
+    if store is not None:
+        store.check_mdp(transsmision_matrix, reward_matrix)
+    statistics = ReturnStatistics(transsmision_matrix.shape[0])
+    for _ in range(n_iterations):
+        episodes = sample_episodes(
+            transsmision_matrix,
+            policy_matrix,
+            reward_matrix,
+            p_init,
+            n=n_episodes,
+            rng=rng,
+        )
+        statistics.add_episodes(episodes, gamma)
+        if store is not None:
+            store.append(episodes)
+    return statistics.value
+
+
+def _share_arrays(arrays: dict):
+    """Copy arrays into shared memory, returning the blocks and how to attach them."""
+    blocks = []
+    specs = {}
+    for name, array in arrays.items():
+        array = np.ascontiguousarray(array)
+        block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        np.ndarray(array.shape, array.dtype, buffer=block.buf)[...] = array
+        blocks.append(block)
+        specs[name] = (block.name, array.shape, array.dtype.str)
+    return blocks, specs
+
+
+_worker_arrays = {}
+_worker_blocks = []
+
+
+def _attach_worker_arrays(specs: dict):
+    for name, (block_name, shape, dtype) in specs.items():
+        block = shared_memory.SharedMemory(name=block_name)
+        _worker_blocks.append(block)
+        _worker_arrays[name] = np.ndarray(shape, np.dtype(dtype), buffer=block.buf)
+
+
+def _sample_batch_statistics(batch: int, n_episodes: int, gamma: float, entropy: int):
+    arrays = _worker_arrays
+    rng = np.random.default_rng(np.random.SeedSequence(entropy, spawn_key=(batch,)))
+    T = SparseTransitionMatrix(arrays["next_states"], arrays["probs"])
+    episodes = sample_episodes(
+        T,
+        arrays["policy_matrix"],
+        arrays["reward_matrix"],
+        arrays["p_init"],
+        n=n_episodes,
+        rng=rng,
+    )
+    statistics = ReturnStatistics(T.shape[0])
+    statistics.add_episodes(episodes, gamma)
+    return statistics
+
+
+def parallel_first_visit_monte_carlo_policy_eval(
+    transsmision_matrix,
+    policy_matrix,
+    reward_matrix,
+    p_init,
+    n_batches=100,
+    n_episodes=1000,
+    gamma=0.99,
+    target_half_width: Optional[float] = None,
+    confidence=0.95,
+    max_workers: Optional[int] = None,
+    entropy=0,
 ):
-    value_function = np.zeros(31)
-    gamma = 0.99
-    for _ in range(1000):
-        samples = sample_trajectories(transsmision_matrix, policy_matrix, p_init, n=10)
-        trajectory = np.array(samples[0])
-        G = 0
-        returns = [[] for _ in range(31)]  # empty returns per state
-        remaining_states = trajectory[::2]
-        T_index = int((len(trajectory) + 2) / 2)
-        for t in range(T_index - 2, -1, -1):  # count down to 0
-            state, action = trajectory[t * 2], trajectory[t * 2 + 1]
-            reward = reward_matrix[state, action]
-            G = gamma * G + reward
-            remaining_states = remaining_states[: len(remaining_states) - 1]
-            if state not in remaining_states:  # first visit condition
-                returns[state].append(G)
-                value_function[state] = sum(returns[state]) / len(returns[state])
-    return value_function
+    """First-visit MC evaluation with batches of episodes sampled on a process pool.
+
+    The mdp, policy and p_init are copied into shared memory once. Each batch samples
+    n_episodes episodes from its own SeedSequence stream and returns ReturnStatistics,
+    which are merged in batch order. Evaluation stops early once every visited
+    state's confidence interval half width is at most target_half_width. Merging in
+    order makes the result independent of the number of workers.
+
+    Returns:
+        ReturnStatistics, with the value and standard error of each state
+    """
+    if not isinstance(transsmision_matrix, SparseTransitionMatrix):
+        transsmision_matrix = SparseTransitionMatrix.from_dense(transsmision_matrix)
+    blocks, specs = _share_arrays(
+        {
+            "next_states": transsmision_matrix.next_states,
+            "probs": transsmision_matrix.probs,
+            "policy_matrix": policy_matrix,
+            "reward_matrix": reward_matrix,
+            "p_init": p_init,
+        }
+    )
+    statistics = ReturnStatistics(transsmision_matrix.shape[0])
+    in_flight = 2 * (max_workers or os.cpu_count() or 1)
+    try:
+        with ProcessPoolExecutor(
+            max_workers, initializer=_attach_worker_arrays, initargs=(specs,)
+        ) as pool:
+            futures = {}
+            for batch in range(n_batches):
+                for queued in range(
+                    len(futures) + batch, min(batch + in_flight, n_batches)
+                ):
+                    futures[queued] = pool.submit(
+                        _sample_batch_statistics, queued, n_episodes, gamma, entropy
+                    )
+                statistics.merge(futures.pop(batch).result())
+                if target_half_width is not None:
+                    visited = statistics.count > 0
+                    half_width = statistics.half_width(confidence)[visited]
+                    if np.all(half_width <= target_half_width):
+                        break
+            for future in futures.values():
+                future.cancel()
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
+    return statistics
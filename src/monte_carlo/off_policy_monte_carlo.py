@@ -0,0 +1,302 @@
+"""Off-policy Monte Carlo prediction and control with weighted importance sampling.
+
+Episodes sampled once from a behavior policy b are reused to evaluate any number of
+target policies. A step's importance ratio is pi(a|s) / b(a|s), and the weight of a
+return is the product of the ratios over the rest of its episode. These products are
+found for every target policy at once by scanning backwards from the end of all the
+packed episodes together, as discounted_returns does for the returns.
+"""
+
+import numpy as np
+from typing import Optional
+from hex_world import HexMove, HexWorld
+from monte_carlo_policy_eval import (
+    GRID,
+    PackedEpisodes,
+    sample_episodes,
+    discounted_returns,
+    first_visit_indices,
+    get_hex_world_prior,
+)
+
+
+def backward_products(episodes: PackedEpisodes, factors: np.ndarray):
+    """Get P_t = factors_t * P_t+1 of every step of every episode, with the product
+    ending at the episode's last step.
+
+    Args:
+        episodes (PackedEpisodes): episodes the steps belong to
+        factors (np.ndarray): factor of each step in the last axis, any leading axes
+            (such as one per target policy) are scanned together
+    """
+    products = np.array(factors, dtype=float)
+    ends = episodes.offsets[1:] - 1
+    lengths = episodes.lengths
+    for steps_from_end in range(1, int(lengths.max(initial=0))):
+        t = ends[lengths > steps_from_end] - steps_from_end
+        products[..., t] *= products[..., t + 1]
+    return products
+
+
+def importance_weights(
+    episodes: PackedEpisodes, behavior_policy: np.ndarray, target_policies: np.ndarray
+):
+    """Get the importance sampling weights of every step for each target policy.
+
+    Args:
+        episodes (PackedEpisodes): episodes sampled with behavior_policy
+        behavior_policy (np.ndarray): |states| x |actions| action probabilities
+        target_policies (np.ndarray): |policies| x |states| x |actions| probabilities
+
+    Returns:
+        state weights, the ratio product from step t to the end of the episode, and
+        action weights, the product from step t + 1, both |policies| x |steps|
+    """
+    states, actions = episodes.states, episodes.actions
+    ratios = target_policies[:, states, actions] / behavior_policy[states, actions]
+    state_weights = backward_products(episodes, ratios)
+    action_weights = np.ones_like(state_weights)
+    not_last = np.ones(len(states), dtype=bool)
+    not_last[episodes.offsets[1:] - 1] = False
+    action_weights[:, not_last] = state_weights[:, 1:][:, not_last[:-1]]
+    return state_weights, action_weights
+
+
+def first_action_visit_indices(
+    episodes: PackedEpisodes, num_states: int, num_actions: int
+):
+    """Get the flat index of the first visit to each state and action pair in each
+    episode."""
+    episode = np.repeat(np.arange(len(episodes)), episodes.lengths)
+    keys = (episode * num_states + episodes.states) * num_actions + episodes.actions
+    _, first = np.unique(keys, return_index=True)
+    return first
+
+
+class ImportanceSamplingStatistics:
+    """Per target policy sums of importance weights and weighted returns.
+
+    The weighted importance sampling estimate of a value is the weighted return sum
+    over the weight sum. Like ReturnStatistics, statistics from separate sets of
+    episodes merge exactly by adding them.
+    """
+
+    def __init__(self, n_policies: int, num_states: int, num_actions: int):
+        self.state_weight_sums = np.zeros((n_policies, num_states))
+        self.state_weighted_returns = np.zeros((n_policies, num_states))
+        self.action_weight_sums = np.zeros((n_policies, num_states, num_actions))
+        self.action_weighted_returns = np.zeros((n_policies, num_states, num_actions))
+
+    def add_episodes(
+        self,
+        episodes: PackedEpisodes,
+        behavior_policy: np.ndarray,
+        target_policies: np.ndarray,
+        gamma: float,
+        first_visit: bool = False,
+    ):
+        """Add the returns of episodes sampled with behavior_policy, weighted for each
+        of target_policies. Every visit is used unless first_visit is set."""
+        n_policies, num_states, num_actions = self.action_weight_sums.shape
+        state_weights, action_weights = importance_weights(
+            episodes, behavior_policy, target_policies
+        )
+        G = discounted_returns(episodes, gamma)
+        states, actions = episodes.states, episodes.actions
+        state_steps = action_steps = np.arange(len(states))
+        if first_visit:
+            # state values count a state's first visit, action values the first
+            # time each action is taken from it
+            state_steps = first_visit_indices(episodes, num_states)
+            action_steps = first_action_visit_indices(episodes, num_states, num_actions)
+
+        policy_offsets = np.arange(n_policies)[:, None]
+        state_keys = policy_offsets * num_states + states[state_steps]
+        action_keys = (
+            policy_offsets * num_states + states[action_steps]
+        ) * num_actions + actions[action_steps]
+        for keys, steps, weights, weight_sums, weighted_returns in [
+            (
+                state_keys,
+                state_steps,
+                state_weights,
+                self.state_weight_sums,
+                self.state_weighted_returns,
+            ),
+            (
+                action_keys,
+                action_steps,
+                action_weights,
+                self.action_weight_sums,
+                self.action_weighted_returns,
+            ),
+        ]:
+            size = weight_sums.size
+            weights = weights[:, steps]
+            weight_sums += np.bincount(
+                keys.ravel(), weights=weights.ravel(), minlength=size
+            ).reshape(weight_sums.shape)
+            weighted_returns += np.bincount(
+                keys.ravel(), weights=(weights * G[steps]).ravel(), minlength=size
+            ).reshape(weight_sums.shape)
+
+    def merge(self, other: "ImportanceSamplingStatistics"):
+        self.state_weight_sums += other.state_weight_sums
+        self.state_weighted_returns += other.state_weighted_returns
+        self.action_weight_sums += other.action_weight_sums
+        self.action_weighted_returns += other.action_weighted_returns
+
+    @property
+    def value(self):
+        """|policies| x |states| value estimates, 0 where no return has weight."""
+        return np.divide(
+            self.state_weighted_returns,
+            self.state_weight_sums,
+            out=np.zeros_like(self.state_weighted_returns),
+            where=self.state_weight_sums > 0,
+        )
+
+    @property
+    def action_value(self):
+        """|policies| x |states| x |actions| action value estimates, 0 where no
+        return has weight."""
+        return np.divide(
+            self.action_weighted_returns,
+            self.action_weight_sums,
+            out=np.zeros_like(self.action_weighted_returns),
+            where=self.action_weight_sums > 0,
+        )
+
+
+def weighted_importance_sampling_eval(
+    episodes: PackedEpisodes,
+    behavior_policy: np.ndarray,
+    target_policies: np.ndarray,
+    num_states: int,
+    gamma: float = 0.99,
+    first_visit: bool = False,
+):
+    """Evaluate target policies from episodes of a behavior policy with weighted
+    importance sampling.
+
+    Args:
+        episodes (PackedEpisodes): episodes sampled with behavior_policy
+        behavior_policy (np.ndarray): |states| x |actions| action probabilities, must
+            be nonzero wherever a target policy is
+        target_policies (np.ndarray): |states| x |actions| probabilities of one target
+            policy, or |policies| x |states| x |actions| for several
+        num_states (int): number of states, including the terminal state
+        gamma (float): discount factor
+        first_visit (bool): only use the first visit to each state, and to each state
+            and action pair for the action values, in an episode
+
+    Returns:
+        ImportanceSamplingStatistics, with value and action_value per target policy
+    """
+    target_policies = np.asarray(target_policies)
+    if target_policies.ndim == 2:
+        target_policies = target_policies[None]
+    statistics = ImportanceSamplingStatistics(
+        len(target_policies), num_states, behavior_policy.shape[1]
+    )
+    statistics.add_episodes(
+        episodes, behavior_policy, target_policies, gamma, first_visit
+    )
+    return statistics
+
+
+def greedy_policy_matrix(Q: np.ndarray, policy_matrix: Optional[np.ndarray] = None):
+    """Deterministic policy taking the best action of each state.
+
+    Actions with a nan value are never taken. States where every value is nan keep
+    their action from policy_matrix, or take action 0 without one.
+    """
+    num_states, num_actions = Q.shape
+    known = ~np.all(np.isnan(Q), axis=1)
+    actions = np.zeros(num_states, dtype=int)
+    if policy_matrix is not None:
+        actions = np.argmax(policy_matrix, axis=1)
+    actions[known] = np.nanargmax(Q[known], axis=1)
+    greedy = np.zeros((num_states, num_actions))
+    greedy[np.arange(num_states), actions] = 1
+    return greedy
+
+
+def off_policy_monte_carlo_control(
+    episodes: PackedEpisodes,
+    behavior_policy: np.ndarray,
+    num_states: int,
+    gamma: float = 0.99,
+    batch_size: int = 100,
+    n_passes: int = 1,
+    policy_matrix: Optional[np.ndarray] = None,
+):
+    """Off-policy MC control with weighted importance sampling (Sutton and Barto 5.7),
+    over batches of episodes from a behavior policy.
+
+    The target policy is greedy in the action values. Each batch of episodes is
+    weighted for the current target and added to the weight and weighted return sums
+    of every earlier batch, then the target is made greedy in the new action values.
+    Returns only have weight while the rest of their episode follows the target. The
+    episodes can be passed over n_passes times, no new episodes are sampled.
+
+    Args:
+        episodes (PackedEpisodes): episodes sampled with behavior_policy
+        behavior_policy (np.ndarray): |states| x |actions| action probabilities,
+            nonzero for every action
+        num_states (int): number of states, including the terminal state
+        gamma (float): discount factor
+        batch_size (int): episodes added between greedy updates
+        n_passes (int): passes over episodes
+        policy_matrix (np.ndarray, optional): initial target policy. Defaults to
+            action 0 everywhere.
+
+    Returns:
+        action values and the greedy target as a |states| x |actions| policy matrix
+    """
+    num_policy_states, num_actions = behavior_policy.shape
+    if policy_matrix is None:
+        policy_matrix = greedy_policy_matrix(np.zeros((num_policy_states, num_actions)))
+    statistics = ImportanceSamplingStatistics(1, num_states, num_actions)
+    for _ in range(n_passes):
+        for start in range(0, len(episodes), batch_size):
+            statistics.add_episodes(
+                episodes.batch(start, start + batch_size),
+                behavior_policy,
+                policy_matrix[None],
+                gamma,
+            )
+            Q = np.where(
+                statistics.action_weight_sums[0] > 0,
+                statistics.action_value[0],
+                np.nan,
+            )
+            policy_matrix = greedy_policy_matrix(Q[:num_policy_states], policy_matrix)
+    return statistics.action_value[0], policy_matrix
+
+
+if __name__ == "__main__":
+    import time
+
+    hw = HexWorld(grid=GRID, policy=[[HexMove.EAST] * 10 for _ in range(3)])
+    T, R = hw.get_mdp_sparse()
+    num_states, num_actions = T.shape[0], len(HexMove)
+    behavior = np.full((num_states - 1, num_actions), 1 / num_actions)
+    rng = np.random.default_rng(0)
+    episodes = sample_episodes(T, behavior, R, get_hex_world_prior(), n=20_000, rng=rng)
+
+    for n_policies in [1, 10, 50]:
+        targets = rng.dirichlet(np.ones(num_actions), (n_policies, num_states - 1))
+        start = time.perf_counter()
+        weighted_importance_sampling_eval(episodes, behavior, targets, num_states, 0.9)
+        print(
+            f"{n_policies} target policies over {len(episodes.states)} steps "
+            f"{time.perf_counter() - start:.3f}s"
+        )
+
+    start = time.perf_counter()
+    Q, policy_matrix = off_policy_monte_carlo_control(
+        episodes, behavior, num_states, gamma=0.9, batch_size=1000
+    )
+    print(f"control {time.perf_counter() - start:.3f}s")
+    print(np.array([move.name for move in HexMove])[policy_matrix.argmax(axis=1)])
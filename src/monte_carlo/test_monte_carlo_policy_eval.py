@@ -0,0 +1,189 @@
+import numpy as np
+from hex_world import HexMove, HexWorld, policy_mdp
+from lookahead_policy_evaluation import linear_system_policy_evaluation
+from monte_carlo_policy_eval import (
+    GRID,
+    get_hex_world_prior,
+    policy_list_to_matrix,
+    sample_trajectories,
+    sample_episodes,
+    PackedEpisodes,
+    discounted_returns,
+    first_visit_indices,
+    first_visit_monte_carlo_policy_eval,
+    parallel_first_visit_monte_carlo_policy_eval,
+    ReturnStatistics,
+)
+
+EAST_POLICY = [[HexMove.EAST for _ in range(10)] for _ in range(3)]
+UNIFORM_POLICY_MATRIX = np.ones((30, 6)) / 6
+
+
+def test_sample_episodes_packed_format():
+    hw = HexWorld(grid=GRID, policy=EAST_POLICY)
+    T, R = hw.get_mdp()
+    episodes = sample_episodes(T, UNIFORM_POLICY_MATRIX, R, get_hex_world_prior(), n=50)
+    assert len(episodes) == 50
+    assert episodes.offsets[0] == 0
+    assert episodes.offsets[-1] == len(episodes.states) == len(episodes.actions)
+    assert np.all(episodes.lengths > 0)
+    assert np.array_equal(episodes.rewards, R[episodes.states, episodes.actions])
+
+    for i in range(len(episodes)):
+        states, actions, _ = episodes.episode(i)
+        assert get_hex_world_prior()[states[0]] > 0
+        # every step is possible and the last one can reach the terminal state
+        assert np.all(T[states[:-1], actions[:-1], states[1:]] > 0)
+        assert T[states[-1], actions[-1], 30] > 0
+
+
+def test_sample_episodes_sparse_matches_dense_distribution():
+    hw = HexWorld(grid=GRID, policy=EAST_POLICY)
+    T, R = hw.get_mdp()
+    T_sparse, _ = hw.get_mdp_sparse()
+    p_init = get_hex_world_prior()
+    rng = np.random.default_rng(0)
+    dense = sample_episodes(T, UNIFORM_POLICY_MATRIX, R, p_init, n=20000, rng=rng)
+    sparse = sample_episodes(
+        T_sparse, UNIFORM_POLICY_MATRIX, R, p_init, n=20000, rng=rng
+    )
+    dense_visits = np.bincount(dense.states, minlength=30) / len(dense.states)
+    sparse_visits = np.bincount(sparse.states, minlength=30) / len(sparse.states)
+    assert np.allclose(dense_visits, sparse_visits, atol=0.01)
+
+
+def test_sample_episodes_drops_truncated_episodes():
+    hw = HexWorld(grid=GRID, policy=EAST_POLICY)
+    T, R = hw.get_mdp()
+    episodes = sample_episodes(
+        T, UNIFORM_POLICY_MATRIX, R, get_hex_world_prior(), n=200, max_steps=3
+    )
+    assert len(episodes) < 200
+    assert np.all(episodes.lengths <= 3)
+
+
+def test_discounted_returns_and_first_visits():
+    episodes = PackedEpisodes(
+        states=np.array([3, 4, 3, 5, 7, 7]),
+        actions=np.zeros(6, dtype=int),
+        rewards=np.array([0.0, 0.0, 0.0, 10.0, 1.0, 2.0]),
+        offsets=np.array([0, 4, 6]),
+    )
+    G = discounted_returns(episodes, gamma=0.5)
+    assert np.allclose(G, [1.25, 2.5, 5.0, 10.0, 2.0, 2.0])
+    assert np.array_equal(first_visit_indices(episodes, 8), [0, 1, 3, 4])
+
+
+def test_first_visit_monte_carlo_matches_exact_values():
+    hw = HexWorld(grid=GRID, policy=EAST_POLICY)
+    T, R = hw.get_mdp()
+    gamma = 0.9
+    exact = linear_system_policy_evaluation(
+        *policy_mdp(T, R, UNIFORM_POLICY_MATRIX), 0, gamma, wall_cost=0
+    )[:30]
+
+    V = first_visit_monte_carlo_policy_eval(
+        T,
+        UNIFORM_POLICY_MATRIX,
+        R,
+        get_hex_world_prior(),
+        n_iterations=200,
+        n_episodes=100,
+        gamma=gamma,
+        rng=np.random.default_rng(0),
+    )
+    assert V.shape == (31,)
+    visited = get_hex_world_prior() > 0
+    assert np.allclose(V[:30][visited], exact[visited], atol=0.25)
+
+
+def test_return_statistics_merge_exactly():
+    hw = HexWorld(grid=GRID, policy=EAST_POLICY)
+    T, R = hw.get_mdp()
+    episodes = sample_episodes(T, UNIFORM_POLICY_MATRIX, R, get_hex_world_prior(), n=60)
+    split = episodes.offsets[30]
+    halves = [
+        PackedEpisodes(
+            episodes.states[steps],
+            episodes.actions[steps],
+            episodes.rewards[steps],
+            offsets,
+        )
+        for steps, offsets in [
+            (slice(None, split), episodes.offsets[:31]),
+            (slice(split, None), episodes.offsets[30:] - split),
+        ]
+    ]
+    whole = ReturnStatistics(31)
+    whole.add_episodes(episodes, 0.9)
+    merged = ReturnStatistics(31)
+    for half in halves:
+        statistics = ReturnStatistics(31)
+        statistics.add_episodes(half, 0.9)
+        merged.merge(statistics)
+    assert np.array_equal(merged.count, whole.count)
+    assert np.allclose(merged.value, whole.value)
+    assert np.allclose(merged.standard_error, whole.standard_error)
+
+
+def test_parallel_monte_carlo_independent_of_workers():
+    hw = HexWorld(grid=GRID, policy=EAST_POLICY)
+    T, R = hw.get_mdp()
+    kwargs = {"n_batches": 4, "n_episodes": 50, "gamma": 0.9, "entropy": 3}
+    serial = parallel_first_visit_monte_carlo_policy_eval(
+        T, UNIFORM_POLICY_MATRIX, R, get_hex_world_prior(), max_workers=1, **kwargs
+    )
+    parallel = parallel_first_visit_monte_carlo_policy_eval(
+        T, UNIFORM_POLICY_MATRIX, R, get_hex_world_prior(), max_workers=2, **kwargs
+    )
+    assert serial.count.sum() > 0
+    assert np.array_equal(serial.count, parallel.count)
+    assert np.array_equal(serial.value, parallel.value)
+
+
+def test_parallel_monte_carlo_stops_at_target_half_width():
+    hw = HexWorld(grid=GRID, policy=EAST_POLICY)
+    T_sparse, R = hw.get_mdp_sparse()
+    statistics = parallel_first_visit_monte_carlo_policy_eval(
+        T_sparse,
+        UNIFORM_POLICY_MATRIX,
+        R,
+        get_hex_world_prior(),
+        n_batches=50,
+        n_episodes=200,
+        gamma=0.9,
+        target_half_width=0.5,
+        max_workers=2,
+    )
+    visited = statistics.count > 0
+    assert np.all(statistics.half_width()[visited] <= 0.5)
+    assert statistics.count.max() < 50 * 200
+
+
+def test_prior_and_policy_matrix_sizes_follow_grid():
+    p_init = get_hex_world_prior()
+    assert p_init.shape == (30,)
+    assert np.isclose(p_init.sum(), 1)
+    assert np.all(p_init[[10, 13, 16, 17, 22, 24, 28, 29]] == 0)
+
+    grid = [["0", "X", "0", "0"], ["5", "0", "0", "0"]]
+    assert np.allclose(
+        get_hex_world_prior(grid), np.array([1, 0, 1, 1, 0, 1, 1, 1]) / 6
+    )
+
+    policy = [[HexMove.WEST, HexMove.EAST], [HexMove.NORTH_WEST, HexMove.EAST]]
+    policy_matrix = policy_list_to_matrix(policy)
+    assert policy_matrix.shape == (4, 6)
+    assert np.array_equal(np.argmax(policy_matrix, axis=1), [5, 2, 0, 2])
+    assert np.all(policy_matrix.sum(axis=1) == 1)
+
+
+def test_sample_trajectories_on_other_grid_size():
+    grid = [["0", "0", "0", "0", "10"], ["0", "X", "0", "0", "0"]]
+    policy = [[HexMove.EAST for _ in range(5)] for _ in range(2)]
+    hw = HexWorld(grid=grid, policy=policy)
+    T, R = hw.get_mdp_sparse()
+    policy_matrix = np.ones((10, 6)) / 6
+    trajectories = sample_trajectories(T, policy_matrix, get_hex_world_prior(grid), n=5)
+    # episodes end by leaving the scored hexagon for the terminal state
+    assert all(trajectory[-2] == 4 for trajectory in trajectories)
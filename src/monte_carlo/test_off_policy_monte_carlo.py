@@ -0,0 +1,224 @@
+import numpy as np
+import pytest
+from hex_world import HexWorld, policy_mdp
+from lookahead_policy_evaluation import EAST_POLICY, linear_system_policy_evaluation
+from monte_carlo_policy_eval import (
+    GRID,
+    get_hex_world_prior,
+    sample_episodes,
+    discounted_returns,
+)
+from off_policy_monte_carlo import (
+    backward_products,
+    importance_weights,
+    ImportanceSamplingStatistics,
+    weighted_importance_sampling_eval,
+    greedy_policy_matrix,
+    off_policy_monte_carlo_control,
+)
+
+UNIFORM_POLICY_MATRIX = np.ones((30, 6)) / 6
+
+
+def gridworld_episodes(n, seed=0):
+    """The gridworld mdp and n episodes of the uniform behavior policy."""
+    T, R = HexWorld(grid=GRID, policy=EAST_POLICY).get_mdp()
+    rng = np.random.default_rng(seed)
+    episodes = sample_episodes(
+        T, UNIFORM_POLICY_MATRIX, R, get_hex_world_prior(), n=n, rng=rng
+    )
+    return T, R, episodes
+
+
+def random_soft_policies(n, epsilon, seed=0):
+    rng = np.random.default_rng(seed)
+    greedy = np.eye(6)[rng.integers(0, 6, (n, 30))]
+    return (1 - epsilon) * greedy + epsilon / 6
+
+
+def sequential_weighted_importance_sampling(episodes, behavior, target, gamma):
+    """Incremental off-policy MC prediction of Q, one episode at a time backwards
+    (Sutton and Barto 5.6)."""
+    Q = np.zeros((31, 6))
+    C = np.zeros((31, 6))
+    for i in range(len(episodes)):
+        states, actions, rewards = episodes.episode(i)
+        G, W = 0.0, 1.0
+        for s, a, r in zip(states[::-1], actions[::-1], rewards[::-1]):
+            G = gamma * G + r
+            C[s, a] += W
+            Q[s, a] += W / C[s, a] * (G - Q[s, a])
+            W *= target[s, a] / behavior[s, a]
+            if W == 0:
+                break
+    return Q
+
+
+def first_visit_weighted_importance_sampling(episodes, behavior, target, gamma):
+    """First-visit weighted importance sampling of V and Q, one episode at a time."""
+    sums = {"V": np.zeros((31, 2)), "Q": np.zeros((31, 6, 2))}
+    for i in range(len(episodes)):
+        states, actions, rewards = episodes.episode(i)
+        G = np.zeros(len(states) + 1)
+        W = np.ones(len(states) + 1)  # ratio product from step t to the end
+        for t in reversed(range(len(states))):
+            G[t] = rewards[t] + gamma * G[t + 1]
+            W[t] = (
+                W[t + 1]
+                * target[states[t], actions[t]]
+                / behavior[states[t], actions[t]]
+            )
+        seen_states, seen_pairs = set(), set()
+        for t, (s, a) in enumerate(zip(states, actions)):
+            if s not in seen_states:
+                seen_states.add(s)
+                sums["V"][s] += [W[t], W[t] * G[t]]
+            if (s, a) not in seen_pairs:
+                seen_pairs.add((s, a))
+                sums["Q"][s, a] += [W[t + 1], W[t + 1] * G[t]]
+    values = {}
+    for name, total in sums.items():
+        weight = total[..., 0]
+        values[name] = np.divide(
+            total[..., 1], weight, out=np.zeros_like(weight), where=weight > 0
+        )
+    return values["V"], values["Q"]
+
+
+def test_backward_products_match_per_episode_products():
+    _, _, episodes = gridworld_episodes(50)
+    factors = np.random.default_rng(0).uniform(0.5, 1.5, (2, len(episodes.states)))
+    products = backward_products(episodes, factors)
+    for i in range(len(episodes)):
+        steps = slice(episodes.offsets[i], episodes.offsets[i + 1])
+        expected = np.cumprod(factors[:, steps][:, ::-1], axis=1)[:, ::-1]
+        assert np.allclose(products[:, steps], expected)
+
+
+def test_importance_weights_shift_by_one_step():
+    _, _, episodes = gridworld_episodes(20)
+    targets = random_soft_policies(3, 0.5)
+    state_weights, action_weights = importance_weights(
+        episodes, UNIFORM_POLICY_MATRIX, targets
+    )
+    ends = episodes.offsets[1:] - 1
+    assert np.all(action_weights[:, ends] == 1)
+    ratios = targets[:, episodes.states, episodes.actions] * 6
+    assert np.allclose(state_weights, ratios * action_weights)
+
+
+def test_behavior_target_gives_every_visit_mean():
+    _, _, episodes = gridworld_episodes(200)
+    statistics = weighted_importance_sampling_eval(
+        episodes, UNIFORM_POLICY_MATRIX, UNIFORM_POLICY_MATRIX, 31, gamma=0.9
+    )
+    G = discounted_returns(episodes, 0.9)
+    counts = np.bincount(episodes.states, minlength=31)
+    expected = np.bincount(episodes.states, weights=G, minlength=31)
+    visited = counts > 0
+    assert np.allclose(
+        statistics.value[0][visited], expected[visited] / counts[visited]
+    )
+
+
+def test_matches_sequential_weighted_importance_sampling():
+    _, _, episodes = gridworld_episodes(300)
+    target = random_soft_policies(1, 0.3)[0]
+    statistics = weighted_importance_sampling_eval(
+        episodes, UNIFORM_POLICY_MATRIX, target, 31, gamma=0.9
+    )
+    Q = sequential_weighted_importance_sampling(
+        episodes, UNIFORM_POLICY_MATRIX, target, 0.9
+    )
+    assert np.allclose(statistics.action_value[0], Q)
+
+
+def test_many_targets_match_one_at_a_time():
+    _, _, episodes = gridworld_episodes(200)
+    targets = random_soft_policies(5, 0.4)
+    together = weighted_importance_sampling_eval(
+        episodes, UNIFORM_POLICY_MATRIX, targets, 31, gamma=0.9, first_visit=True
+    )
+    for i, target in enumerate(targets):
+        alone = weighted_importance_sampling_eval(
+            episodes, UNIFORM_POLICY_MATRIX, target, 31, gamma=0.9, first_visit=True
+        )
+        assert np.allclose(together.value[i], alone.value[0])
+        assert np.allclose(together.action_value[i], alone.action_value[0])
+
+
+def test_statistics_merge_exactly():
+    _, _, episodes = gridworld_episodes(200)
+    targets = random_soft_policies(2, 0.5)
+    whole = ImportanceSamplingStatistics(2, 31, 6)
+    whole.add_episodes(episodes, UNIFORM_POLICY_MATRIX, targets, 0.9)
+    merged = ImportanceSamplingStatistics(2, 31, 6)
+    for start in range(0, 200, 64):
+        part = ImportanceSamplingStatistics(2, 31, 6)
+        part.add_episodes(
+            episodes.batch(start, start + 64), UNIFORM_POLICY_MATRIX, targets, 0.9
+        )
+        merged.merge(part)
+    assert np.allclose(merged.value, whole.value)
+    assert np.allclose(merged.action_value, whole.action_value)
+
+
+def test_weighted_importance_sampling_matches_exact_values():
+    T, R, episodes = gridworld_episodes(20000)
+    targets = random_soft_policies(3, 0.7)
+    statistics = weighted_importance_sampling_eval(
+        episodes, UNIFORM_POLICY_MATRIX, targets, 31, gamma=0.9
+    )
+    visited = get_hex_world_prior() > 0
+    for i, target in enumerate(targets):
+        # weighted importance sampling is biased and noisy per state, values span ~10
+        exact = linear_system_policy_evaluation(
+            *policy_mdp(T, R, target), 0, 0.9, wall_cost=0
+        )[:30][visited]
+        error = np.abs(statistics.value[i, :30][visited] - exact)
+        assert error.mean() < 0.6
+        assert error.max() < 2.5
+
+
+def test_greedy_policy_matrix_skips_unknown_values():
+    Q = np.array([[1.0, np.nan, 3.0], [np.nan, np.nan, np.nan], [np.nan, -1, -2]])
+    previous = np.eye(3)[[0, 2, 0]]
+    greedy = greedy_policy_matrix(Q, previous)
+    assert np.array_equal(greedy, np.eye(3)[[2, 2, 1]])
+
+
+@pytest.mark.parametrize("batch_size", [1, 500])
+def test_off_policy_control_improves_on_behavior(batch_size):
+    T, R, episodes = gridworld_episodes(5000)
+    Q, policy_matrix = off_policy_monte_carlo_control(
+        episodes, UNIFORM_POLICY_MATRIX, 31, gamma=0.9, batch_size=batch_size
+    )
+    assert Q.shape == (31, 6)
+    assert np.allclose(policy_matrix.sum(axis=1), 1)
+    visited = get_hex_world_prior() > 0
+    behavior_values, learned_values = [
+        linear_system_policy_evaluation(*policy_mdp(T, R, policy), 0, 0.9, wall_cost=0)[
+            :30
+        ][visited]
+        for policy in [UNIFORM_POLICY_MATRIX, policy_matrix]
+    ]
+    assert learned_values.mean() > behavior_values.mean() + 2
+
+
+def test_first_visit_matches_per_episode_reference():
+    _, _, episodes = gridworld_episodes(300)
+    target = random_soft_policies(1, 0.5)[0]
+    statistics = weighted_importance_sampling_eval(
+        episodes, UNIFORM_POLICY_MATRIX, target, 31, gamma=0.9, first_visit=True
+    )
+    V, Q = first_visit_weighted_importance_sampling(
+        episodes, UNIFORM_POLICY_MATRIX, target, 0.9
+    )
+    assert np.allclose(statistics.value[0], V)
+    assert np.allclose(statistics.action_value[0], Q)
+    # revisits that take another action must count towards that action
+    every_visit = weighted_importance_sampling_eval(
+        episodes, UNIFORM_POLICY_MATRIX, target, 31, gamma=0.9
+    )
+    visited = every_visit.action_weight_sums[0] > 0
+    assert np.all(statistics.action_weight_sums[0][visited] > 0)
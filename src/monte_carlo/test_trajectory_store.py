@@ -0,0 +1,198 @@
+import os
+import numpy as np
+import pytest
+from hex_world import HexMove, HexWorld
+from monte_carlo_policy_eval import (
+    GRID,
+    PackedEpisodes,
+    get_hex_world_prior,
+    sample_episodes,
+    ReturnStatistics,
+    first_visit_monte_carlo_policy_eval,
+)
+from trajectory_store import (
+    TrajectoryStore,
+    mdp_hash,
+    sample_episodes_to_store,
+    replay_first_visit_monte_carlo_policy_eval,
+    transitions,
+)
+
+EAST_POLICY = [[HexMove.EAST for _ in range(10)] for _ in range(3)]
+UNIFORM_POLICY_MATRIX = np.ones((30, 6)) / 6
+
+
+def gridworld_mdp():
+    return HexWorld(grid=GRID, policy=EAST_POLICY).get_mdp_sparse()
+
+
+def test_mdp_hash_same_for_dense_and_sparse():
+    hw = HexWorld(grid=GRID, policy=EAST_POLICY)
+    T, R = hw.get_mdp()
+    sparse_T, sparse_R = hw.get_mdp_sparse()
+    assert mdp_hash(T, R) == mdp_hash(sparse_T, sparse_R)
+    other_grid = [row[:] for row in GRID]
+    other_grid[0][0] = "1"
+    assert mdp_hash(T, R) != mdp_hash(*HexWorld(other_grid, EAST_POLICY).get_mdp())
+
+
+def test_appended_episodes_read_back_memory_mapped(tmp_path):
+    T, R = gridworld_mdp()
+    rng = np.random.default_rng(0)
+    batches = [
+        sample_episodes(
+            T, UNIFORM_POLICY_MATRIX, R, get_hex_world_prior(), n=n, rng=rng
+        )
+        for n in (30, 1, 50)
+    ]
+    store = TrajectoryStore.create(str(tmp_path / "store"), mdp_hash(T, R))
+    for batch in batches:
+        store.append(batch)
+
+    reopened = TrajectoryStore(str(tmp_path / "store"), mdp_hash(T, R))
+    episodes = reopened.episodes()
+    assert len(reopened) == len(episodes) == 81
+    assert isinstance(episodes.states, np.memmap)
+    for column in ["states", "actions", "rewards"]:
+        expected = np.concatenate([getattr(batch, column) for batch in batches])
+        assert np.array_equal(getattr(episodes, column), expected)
+    i = 0
+    for batch in batches:
+        for j in range(len(batch)):
+            for stored, sampled in zip(episodes.episode(i), batch.episode(j)):
+                assert np.array_equal(stored, sampled)
+            i += 1
+
+
+def test_store_rejects_other_mdp_and_existing_store(tmp_path):
+    T, R = gridworld_mdp()
+    path = str(tmp_path / "store")
+    store = TrajectoryStore.create(path, "not the gridworld")
+    with pytest.raises(ValueError):
+        TrajectoryStore(path, mdp_hash(T, R))
+    with pytest.raises(ValueError):
+        sample_episodes_to_store(
+            store, T, UNIFORM_POLICY_MATRIX, R, get_hex_world_prior()
+        )
+    with pytest.raises(FileExistsError):
+        TrajectoryStore.create(path, mdp_hash(T, R))
+    with pytest.raises(ValueError):
+        first_visit_monte_carlo_policy_eval(
+            T, UNIFORM_POLICY_MATRIX, R, get_hex_world_prior(), store=store
+        )
+    assert len(store) == 0
+
+
+def test_append_rejects_values_that_do_not_fit(tmp_path):
+    T, R = gridworld_mdp()
+    store = TrajectoryStore.create(str(tmp_path), mdp_hash(T, R))
+    episodes = sample_episodes(
+        T,
+        UNIFORM_POLICY_MATRIX,
+        R,
+        get_hex_world_prior(),
+        n=5,
+        rng=np.random.default_rng(0),
+    )
+    store.append(episodes)
+    actions = episodes.actions.astype(np.int64)
+    actions[0] = 300
+    overflowing = PackedEpisodes(
+        episodes.states, actions, episodes.rewards, episodes.offsets
+    )
+    with pytest.raises(ValueError):
+        store.append(overflowing)
+    reopened = TrajectoryStore(str(tmp_path))
+    assert len(reopened) == len(episodes)
+    assert np.array_equal(reopened.episodes().actions, episodes.actions)
+    for column in ("states", "actions"):
+        size = os.path.getsize(os.path.join(str(tmp_path), column))
+        assert size == len(episodes.states) * reopened.column(column).itemsize
+
+
+def test_empty_store(tmp_path):
+    store = TrajectoryStore.create(str(tmp_path), "hash")
+    episodes = store.episodes()
+    assert len(episodes) == 0
+    assert len(episodes.states) == 0
+    assert list(store.batches(10)) == []
+
+
+def test_interrupted_append_is_ignored_and_overwritten(tmp_path):
+    T, R = gridworld_mdp()
+    rng = np.random.default_rng(0)
+    store = TrajectoryStore.create(str(tmp_path), mdp_hash(T, R))
+    first = sample_episodes(
+        T, UNIFORM_POLICY_MATRIX, R, get_hex_world_prior(), n=5, rng=rng
+    )
+    store.append(first)
+    # columns written but the header never updated
+    with open(os.path.join(str(tmp_path), "states"), "ab") as f:
+        f.write(np.arange(7, dtype=np.int32).tobytes())
+    reopened = TrajectoryStore(str(tmp_path))
+    assert np.array_equal(reopened.episodes().states, first.states)
+
+    second = sample_episodes(
+        T, UNIFORM_POLICY_MATRIX, R, get_hex_world_prior(), n=5, rng=rng
+    )
+    reopened.append(second)
+    states = TrajectoryStore(str(tmp_path)).episodes().states
+    assert np.array_equal(states, np.concatenate([first.states, second.states]))
+
+
+def test_replay_matches_in_memory_monte_carlo(tmp_path):
+    T, R = gridworld_mdp()
+    store = TrajectoryStore.create(str(tmp_path), mdp_hash(T, R))
+    sample_episodes_to_store(
+        store,
+        T,
+        UNIFORM_POLICY_MATRIX,
+        R,
+        get_hex_world_prior(),
+        n=1000,
+        batch_size=300,
+        rng=np.random.default_rng(0),
+    )
+    assert len(store) <= 1000
+    replayed = replay_first_visit_monte_carlo_policy_eval(store, 31, 0.9, batch_size=64)
+    statistics = ReturnStatistics(31)
+    statistics.add_episodes(store.episodes(), 0.9)
+    assert np.allclose(replayed.value, statistics.value)
+    assert np.array_equal(replayed.count, statistics.count)
+
+
+def test_transitions_follow_episodes():
+    T, R = gridworld_mdp()
+    episodes = sample_episodes(
+        T,
+        UNIFORM_POLICY_MATRIX,
+        R,
+        get_hex_world_prior(),
+        n=20,
+        rng=np.random.default_rng(0),
+    )
+    states, actions, rewards, next_states, dones = transitions(episodes, 30)
+    assert np.count_nonzero(dones) == 20
+    assert np.all(next_states[dones] == 30)
+    assert np.array_equal(next_states[~dones], states[1:][~dones[:-1]])
+    assert np.array_equal(rewards, R[states, actions])
+
+
+def test_monte_carlo_run_recorded_and_replayed(tmp_path):
+    T, R = gridworld_mdp()
+    store = TrajectoryStore.create(str(tmp_path), mdp_hash(T, R))
+    V = first_visit_monte_carlo_policy_eval(
+        T,
+        UNIFORM_POLICY_MATRIX,
+        R,
+        get_hex_world_prior(),
+        n_iterations=5,
+        n_episodes=40,
+        gamma=0.9,
+        rng=np.random.default_rng(0),
+        store=store,
+    )
+    replayed = replay_first_visit_monte_carlo_policy_eval(
+        TrajectoryStore(str(tmp_path)), 31, 0.9
+    )
+    assert np.allclose(replayed.value, V)
@@ -0,0 +1,289 @@
+"""Append-only on-disk store of sampled episodes.
+
+A store is a directory holding one raw binary file per column, states, actions and
+rewards with one entry per step and offsets with one entry per episode boundary, and
+a header.json with the dtypes, the number of steps and episodes written, and a hash
+of the MDP the episodes came from. Appends write the columns first and then replace
+the header, so a reader only ever sees whole episodes even if a write is cut short.
+Columns are read back as np.memmap, so datasets larger than memory can be replayed
+in batches without loading them.
+"""
+
+import hashlib
+import json
+import os
+import numpy as np
+from typing import Optional
+from hex_world import SparseTransitionMatrix
+from monte_carlo_policy_eval import PackedEpisodes, ReturnStatistics, sample_episodes
+
+HEADER = "header.json"
+COLUMNS = ("states", "actions", "rewards", "offsets")
+
+
+def cast_column(array, dtype, column: str) -> np.ndarray:
+    """Cast array to a column's dtype, raising ValueError instead of wrapping values
+    the dtype cannot hold."""
+    array = np.asarray(array)
+    dtype = np.dtype(dtype)
+    if np.issubdtype(dtype, np.integer):
+        if not np.issubdtype(array.dtype, np.integer):
+            raise ValueError(f"{column} must be integers to store as {dtype}")
+        info = np.iinfo(dtype)
+        if array.size and (array.min() < info.min or array.max() > info.max):
+            raise ValueError(
+                f"{column} range [{array.min()}, {array.max()}] does not fit {dtype}"
+            )
+    elif not np.can_cast(array.dtype, dtype, casting="same_kind"):
+        raise ValueError(f"cannot store {column} of dtype {array.dtype} as {dtype}")
+    return np.ascontiguousarray(array, dtype=dtype)
+
+
+def mdp_hash(transmission_matrix, reward_matrix) -> str:
+    """Hash of an MDP that is the same for its dense and sparse transition matrices.
+
+    Each state and action's lottery is reduced to its distinct next states, in order,
+    with their summed probabilities rounded to 12 decimals.
+    """
+    if isinstance(transmission_matrix, SparseTransitionMatrix):
+        num_states, num_actions, _ = transmission_matrix.shape
+        rows = np.arange(num_states * num_actions).reshape(num_states, num_actions, 1)
+        keys = rows * num_states + transmission_matrix.next_states
+        nonzero = transmission_matrix.probs > 0
+        keys, inverse = np.unique(keys[nonzero], return_inverse=True)
+        probs = np.bincount(inverse, weights=transmission_matrix.probs[nonzero])
+    else:
+        keys = np.flatnonzero(transmission_matrix > 0)
+        probs = transmission_matrix.ravel()[keys]
+    digest = hashlib.sha256()
+    digest.update(np.array(transmission_matrix.shape, dtype=np.int64).tobytes())
+    digest.update(keys.astype(np.int64).tobytes())
+    digest.update(np.round(probs, 12).astype(np.float64).tobytes())
+    digest.update(np.ascontiguousarray(reward_matrix, dtype=np.float64).tobytes())
+    return digest.hexdigest()
+
+
+class TrajectoryStore:
+    """Episodes stored on disk in path, see the module docstring.
+
+    Open an existing store with TrajectoryStore(path) and make a new one with
+    TrajectoryStore.create. Only one process should append to a store at a time.
+
+    Args:
+        path (str): directory of the store
+        expected_mdp_hash (str, optional): raise ValueError if the store's episodes
+            come from a different MDP
+    """
+
+    def __init__(self, path: str, expected_mdp_hash: Optional[str] = None):
+        self.path = path
+        with open(os.path.join(path, HEADER)) as f:
+            self.header = json.load(f)
+        if expected_mdp_hash is not None and self.mdp_hash != expected_mdp_hash:
+            raise ValueError(
+                f"store {path} holds episodes of MDP {self.mdp_hash}, "
+                f"expected {expected_mdp_hash}"
+            )
+
+    @classmethod
+    def create(
+        cls,
+        path: str,
+        mdp_hash: str,
+        state_dtype=np.int32,
+        action_dtype=np.int8,
+        reward_dtype=np.float64,
+    ):
+        """Make an empty store in path, which must not already hold one."""
+        os.makedirs(path, exist_ok=True)
+        if os.path.exists(os.path.join(path, HEADER)):
+            raise FileExistsError(f"{path} already holds a trajectory store")
+        dtypes = {
+            "states": np.dtype(state_dtype).str,
+            "actions": np.dtype(action_dtype).str,
+            "rewards": np.dtype(reward_dtype).str,
+            "offsets": np.dtype(np.int64).str,
+        }
+        for column in COLUMNS:
+            with open(os.path.join(path, column), "wb") as f:
+                if column == "offsets":
+                    f.write(np.zeros(1, dtype=dtypes[column]).tobytes())
+        header = {"mdp_hash": mdp_hash, "num_steps": 0, "num_episodes": 0}
+        cls._write_header(path, dict(header, dtypes=dtypes))
+        return cls(path)
+
+    @staticmethod
+    def _write_header(path: str, header: dict):
+        temporary = os.path.join(path, HEADER + ".tmp")
+        with open(temporary, "w") as f:
+            json.dump(header, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, os.path.join(path, HEADER))
+
+    @property
+    def mdp_hash(self) -> str:
+        return self.header["mdp_hash"]
+
+    @property
+    def num_steps(self) -> int:
+        return self.header["num_steps"]
+
+    def check_mdp(self, transmission_matrix, reward_matrix):
+        """Raise ValueError if the store holds episodes of a different MDP."""
+        if self.mdp_hash != mdp_hash(transmission_matrix, reward_matrix):
+            raise ValueError(f"store {self.path} holds episodes of a different MDP")
+
+    def __len__(self):
+        return self.header["num_episodes"]
+
+    def column_length(self, column: str) -> int:
+        return len(self) + 1 if column == "offsets" else self.num_steps
+
+    def append(self, episodes: PackedEpisodes):
+        """Write episodes to the end of the store.
+
+        Raises:
+            ValueError: if a column's values do not fit its dtype, nothing is written
+        """
+        num_steps = self.num_steps
+        arrays = {
+            "states": episodes.states,
+            "actions": episodes.actions,
+            "rewards": episodes.rewards,
+            "offsets": np.asarray(episodes.offsets[1:]) + num_steps,
+        }
+        arrays = {
+            column: cast_column(array, self.header["dtypes"][column], column)
+            for column, array in arrays.items()
+        }
+        for column, array in arrays.items():
+            dtype = array.dtype
+            with open(os.path.join(self.path, column), "r+b") as f:
+                # drop anything past the header's count left by an interrupted append
+                f.truncate(self.column_length(column) * dtype.itemsize)
+                f.seek(0, os.SEEK_END)
+                f.write(array.tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+        self.header["num_steps"] = num_steps + len(episodes.states)
+        self.header["num_episodes"] = len(self) + len(episodes)
+        self._write_header(self.path, self.header)
+
+    def column(self, column: str) -> np.ndarray:
+        """Read-only memory map of a column, up to the length in the header."""
+        dtype = np.dtype(self.header["dtypes"][column])
+        length = self.column_length(column)
+        if length == 0:
+            return np.zeros(0, dtype=dtype)
+        return np.memmap(
+            os.path.join(self.path, column), dtype=dtype, mode="r", shape=(length,)
+        )
+
+    def episodes(self) -> PackedEpisodes:
+        """Get every stored episode, with memory mapped columns."""
+        return PackedEpisodes(*(self.column(column) for column in COLUMNS))
+
+    def batches(self, batch_size: int):
+        """Iterate over the stored episodes batch_size episodes at a time."""
+        episodes = self.episodes()
+        for start in range(0, len(episodes), batch_size):
+            yield episodes.batch(start, start + batch_size)
+
+
+def sample_episodes_to_store(
+    store: TrajectoryStore,
+    transmission_matrix,
+    policy_matrix,
+    reward_matrix,
+    p_init,
+    n=1,
+    batch_size=10_000,
+    max_steps=1000,
+    rng: Optional[np.random.Generator] = None,
+):
+    """Sample n episodes with sample_episodes, appending them to store batch_size at
+    a time so they are never all in memory.
+
+    Raises:
+        ValueError: if the store holds episodes of a different MDP
+    """
+    store.check_mdp(transmission_matrix, reward_matrix)
+    for start in range(0, n, batch_size):
+        store.append(
+            sample_episodes(
+                transmission_matrix,
+                policy_matrix,
+                reward_matrix,
+                p_init,
+                n=min(batch_size, n - start),
+                max_steps=max_steps,
+                rng=rng,
+            )
+        )
+
+
+def replay_first_visit_monte_carlo_policy_eval(
+    store: TrajectoryStore, num_states: int, gamma=0.99, batch_size=10_000
+):
+    """First-visit MC evaluation of the policy that sampled the stored episodes.
+
+    Returns:
+        ReturnStatistics, with the value and standard error of each state
+    """
+    statistics = ReturnStatistics(num_states)
+    for episodes in store.batches(batch_size):
+        statistics.add_episodes(episodes, gamma)
+    return statistics
+
+
+def transitions(episodes: PackedEpisodes, terminal: int):
+    """Get the (state, action, reward, next state, done) arrays of every step, for
+    replaying stored episodes to TD learners. The next state of a last step is the
+    terminal state."""
+    states = np.asarray(episodes.states)
+    dones = np.zeros(len(states), dtype=bool)
+    dones[np.asarray(episodes.offsets[1:]) - 1] = True
+    next_states = np.empty_like(states)
+    next_states[:-1] = states[1:]
+    next_states[dones] = terminal
+    return (
+        states,
+        np.asarray(episodes.actions),
+        np.asarray(episodes.rewards),
+        next_states,
+        dones,
+    )
+
+
+if __name__ == "__main__":
+    import tempfile
+    import time
+    from hex_world import HexMove, HexWorld
+    from monte_carlo_policy_eval import GRID, get_hex_world_prior
+
+    hw = HexWorld(grid=GRID, policy=[[HexMove.EAST] * 10 for _ in range(3)])
+    T, R = hw.get_mdp_sparse()
+    policy_matrix = np.full((30, len(HexMove)), 1 / len(HexMove))
+    with tempfile.TemporaryDirectory() as path:
+        store = TrajectoryStore.create(path, mdp_hash(T, R))
+        start = time.perf_counter()
+        sample_episodes_to_store(
+            store,
+            T,
+            policy_matrix,
+            R,
+            get_hex_world_prior(),
+            n=100_000,
+            rng=np.random.default_rng(0),
+        )
+        print(
+            f"sampled and stored {store.num_steps} steps "
+            f"in {time.perf_counter() - start:.2f}s"
+        )
+        start = time.perf_counter()
+        statistics = replay_first_visit_monte_carlo_policy_eval(
+            TrajectoryStore(path, mdp_hash(T, R)), T.shape[0], gamma=0.9
+        )
+        print(f"replayed in {time.perf_counter() - start:.2f}s")
+        print(statistics.value.reshape(-1)[:30].reshape(3, 10).round(2))
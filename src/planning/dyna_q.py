@@ -0,0 +1,343 @@
+"""Dyna-Q, Dyna-Q+ and prioritized sweeping on hex world.
+
+The agents learn a tabular model of the world from real experience and plan with
+it between real steps. The model of each learner is array backed: visit counts and
+reward sums per state and action, up to max_successors observed next states per
+state and action with their counts, and a predecessor index of the state action
+pairs seen leading into each state.
+"""
+
+import time
+import numpy as np
+from hex_world import HexWorld, GRID, HexMove, sample_index
+from td import TabularTD
+
+
+class TabularModel:
+    """Learned model of a batch of learners, see the module docstring.
+
+    State action pairs are stored as keys state * num_actions + action.
+    """
+
+    def __init__(
+        self,
+        n_learners: int,
+        num_states: int,
+        num_actions: int,
+        max_successors: int = 4,
+        predecessor_capacity: int = 8,
+    ):
+        shape = (n_learners, num_states, num_actions)
+        self.learners = np.arange(n_learners)
+        self.num_actions = num_actions
+        self.visits = np.zeros(shape, dtype=np.int64)
+        self.reward_sums = np.zeros(shape)
+        self.last_tried = np.zeros(shape, dtype=np.int64)
+        self.successors = np.full(shape + (max_successors,), -1, dtype=np.int64)
+        self.successor_counts = np.zeros(shape + (max_successors,), dtype=np.int64)
+        # state action pairs tried so far, in the order they were first tried
+        self.observed = np.zeros((n_learners, num_states * num_actions), dtype=np.int64)
+        self.num_observed = np.zeros(n_learners, dtype=np.int64)
+        self.predecessors = np.zeros(
+            (n_learners, num_states, predecessor_capacity), dtype=np.int64
+        )
+        self.num_predecessors = np.zeros((n_learners, num_states), dtype=np.int64)
+
+    def update(self, states, actions, rewards, next_states, step: int):
+        """Record one real transition of every learner."""
+        learners = self.learners
+        index = (learners, states, actions)
+        slots = self.successors[index]
+        match = slots == next_states[:, None]
+        known = np.any(match, axis=1)
+        empty = slots == -1
+        if np.any(~known & ~np.any(empty, axis=1)):
+            raise ValueError("a state action pair has more than max_successors")
+        slot = np.where(known, np.argmax(match, axis=1), np.argmax(empty, axis=1))
+
+        keys = states * self.num_actions + actions
+        first = self.visits[index] == 0
+        self.observed[learners[first], self.num_observed[first]] = keys[first]
+        self.num_observed[first] += 1
+
+        self.successors[index + (slot,)] = next_states
+        self.successor_counts[index + (slot,)] += 1
+        self.visits[index] += 1
+        self.reward_sums[index] += rewards
+        self.last_tried[index] = step
+
+        new = ~known
+        new_learners, new_states = learners[new], next_states[new]
+        counts = self.num_predecessors[new_learners, new_states]
+        if len(counts) and np.max(counts) >= self.predecessors.shape[2]:
+            self.predecessors = np.concatenate(
+                [self.predecessors, np.zeros_like(self.predecessors)], axis=2
+            )
+        self.predecessors[new_learners, new_states, counts] = keys[new]
+        self.num_predecessors[new_learners, new_states] += 1
+
+    def mean_rewards(self, states, actions):
+        index = (self.learners, states, actions)
+        return self.reward_sums[index] / np.maximum(self.visits[index], 1)
+
+    def sample_observed(self, rng):
+        """Sample one tried state action pair per learner, uniformly."""
+        index = (rng.random(len(self.learners)) * self.num_observed).astype(np.int64)
+        return np.divmod(self.observed[self.learners, index], self.num_actions)
+
+    def sample_next_states(self, states, actions, rng):
+        """Sample a next state per learner from the observed transition counts."""
+        index = (self.learners, states, actions)
+        slot = sample_index(np.cumsum(self.successor_counts[index], axis=1), rng)
+        return self.successors[index + (slot,)]
+
+    def successor_probs(self, learner: int, state: int, action: int):
+        """Observed next states of one state and action, and their frequencies."""
+        counts = self.successor_counts[learner, state, action]
+        seen = counts > 0
+        next_states = self.successors[learner, state, action][seen]
+        return next_states, counts[seen] / np.sum(counts)
+
+    def predecessor_pairs(self, learner: int, state: int):
+        """Keys of the state action pairs seen moving into state."""
+        return self.predecessors[
+            learner, state, : self.num_predecessors[learner, state]
+        ]
+
+
+class DynaQ(TabularTD):
+    """Q-learning with planning_steps simulated Q-learning updates per real step.
+
+    Each planning update samples a tried state and action, a next state from the
+    model and its mean reward, for every learner at once. Time spent planning is
+    tracked apart from the real steps.
+    """
+
+    def __init__(
+        self,
+        hw: HexWorld,
+        planning_steps: int = 10,
+        max_successors: int = 4,
+        **kwargs,
+    ):
+        """
+        Args:
+            hw (HexWorld): world to learn in
+            planning_steps (int): planning updates per real step
+            max_successors (int): most next states recorded per state and action
+            **kwargs: passed to TabularTD
+        """
+        super().__init__(hw, "q_learning", **kwargs)
+        self.planning_steps = planning_steps
+        self.model = TabularModel(
+            self.n_learners, hw.num_states + 1, self.num_actions, max_successors
+        )
+        self.time = 0
+        self.planning_updates = 0
+        self.planning_elapsed = 0.0
+
+    @property
+    def planning_updates_per_second(self) -> float:
+        if self.planning_elapsed <= 0:
+            return 0.0
+        return self.planning_updates / self.planning_elapsed
+
+    @property
+    def environment_steps_per_second(self) -> float:
+        """Real steps per second, not counting the time spent planning."""
+        elapsed = self.elapsed - self.planning_elapsed
+        return self.updates / elapsed if elapsed > 0 else 0.0
+
+    def update(self, states, actions, rewards, next_states, next_actions, dones):
+        super().update(states, actions, rewards, next_states, next_actions, dones)
+        self.time += 1
+        self.model.update(states, actions, rewards, next_states, self.time)
+        start = time.perf_counter()
+        self.plan()
+        self.planning_elapsed += time.perf_counter() - start
+
+    def planning_sample(self):
+        """Sample the simulated state, action, reward and next state of every learner."""
+        states, actions = self.model.sample_observed(self.rng)
+        next_states = self.model.sample_next_states(states, actions, self.rng)
+        return states, actions, self.model.mean_rewards(states, actions), next_states
+
+    def plan(self):
+        for _ in range(self.planning_steps):
+            states, actions, rewards, next_states = self.planning_sample()
+            target = rewards + self.gamma * np.max(
+                self.values[self.learners, next_states], axis=1
+            )
+            index = (self.learners, states, actions)
+            self.values[index] += self.alpha * (target - self.values[index])
+        self.planning_updates += self.planning_steps * self.n_learners
+
+
+class DynaQPlus(DynaQ):
+    """Dyna-Q with an exploration bonus kappa * sqrt(steps since last tried) on the
+    planning rewards.
+
+    Planning picks any action in a tried state. Actions never tried are modelled as
+    staying put with reward 0, so their bonus draws the agent to try them.
+    """
+
+    def __init__(self, hw: HexWorld, kappa: float = 1e-3, **kwargs):
+        super().__init__(hw, **kwargs)
+        self.kappa = kappa
+
+    def planning_sample(self):
+        states, _ = self.model.sample_observed(self.rng)
+        actions = (self.rng.random(self.n_learners) * self.num_actions).astype(int)
+        tried = self.model.visits[self.learners, states, actions] > 0
+        next_states = np.where(
+            tried, self.model.sample_next_states(states, actions, self.rng), states
+        )
+        waited = self.time - self.model.last_tried[self.learners, states, actions]
+        rewards = np.where(tried, self.model.mean_rewards(states, actions), 0.0)
+        return states, actions, rewards + self.kappa * np.sqrt(waited), next_states
+
+
+class IndexedPriorityQueue:
+    """Max priority queue over integer keys 0..capacity-1.
+
+    Each key is queued at most once. Pushing a queued key raises its priority if the
+    new one is higher, moving it up the binary heap in place.
+    """
+
+    def __init__(self, capacity: int):
+        self.heap = []  # keys, highest priority first
+        self.position = [-1] * capacity  # index of each key in heap, -1 if not queued
+        self.priority = [0.0] * capacity
+
+    def __len__(self):
+        return len(self.heap)
+
+    def __contains__(self, key: int):
+        return self.position[key] != -1
+
+    def push(self, key: int, priority: float):
+        if self.position[key] == -1:
+            self.heap.append(key)
+            self.position[key] = len(self.heap) - 1
+        elif priority <= self.priority[key]:
+            return
+        self.priority[key] = priority
+        self.sift_up(self.position[key])
+
+    def pop(self):
+        """Remove and return the key with the highest priority, and its priority."""
+        key = self.heap[0]
+        last = self.heap.pop()
+        self.position[key] = -1
+        if self.heap:
+            self.heap[0] = last
+            self.position[last] = 0
+            self.sift_down(0)
+        return key, self.priority[key]
+
+    def sift_up(self, i: int):
+        heap, position, priority = self.heap, self.position, self.priority
+        key = heap[i]
+        while i > 0:
+            parent = (i - 1) // 2
+            if priority[heap[parent]] >= priority[key]:
+                break
+            heap[i] = heap[parent]
+            position[heap[i]] = i
+            i = parent
+        heap[i] = key
+        position[key] = i
+
+    def sift_down(self, i: int):
+        heap, position, priority = self.heap, self.position, self.priority
+        key = heap[i]
+        n = len(heap)
+        while 2 * i + 1 < n:
+            child = 2 * i + 1
+            if child + 1 < n and priority[heap[child + 1]] > priority[heap[child]]:
+                child += 1
+            if priority[heap[child]] <= priority[key]:
+                break
+            heap[i] = heap[child]
+            position[heap[i]] = i
+            i = child
+        heap[i] = key
+        position[key] = i
+
+
+class PrioritizedSweeping(DynaQ):
+    """Dyna planning that backs up the state action pairs with the largest expected
+    change first.
+
+    Real transitions are not learned from directly. They update the model and queue
+    their state and action by |TD error|. Each planning step pops the top pair and
+    sets its value to the expected target over its observed next states, then queues
+    every predecessor pair whose expected target now differs from its value by more
+    than theta. Each learner has its own queue and plans in turn.
+    """
+
+    def __init__(self, hw: HexWorld, theta: float = 1e-4, **kwargs):
+        super().__init__(hw, **kwargs)
+        self.theta = theta
+        num_keys = (hw.num_states + 1) * self.num_actions
+        self.queues = [IndexedPriorityQueue(num_keys) for _ in self.learners]
+
+    def expected_targets(self, learner: int, keys):
+        """Expected one step targets of state action pairs under the model."""
+        model = self.model
+        index = (learner,) + np.divmod(keys, self.num_actions)
+        # unused successor slots are -1, the terminal row, and have count 0
+        max_next = np.max(self.values[learner][model.successors[index]], axis=2)
+        expected = np.sum(model.successor_counts[index] * max_next, axis=1)
+        return (model.reward_sums[index] + self.gamma * expected) / model.visits[index]
+
+    def update(self, states, actions, rewards, next_states, next_actions, dones):
+        self.time += 1
+        self.model.update(states, actions, rewards, next_states, self.time)
+        target = rewards + self.gamma * np.max(
+            self.values[self.learners, next_states], axis=1
+        )
+        priorities = np.abs(target - self.values[self.learners, states, actions])
+        for learner in np.flatnonzero(priorities > self.theta):
+            key = states[learner] * self.num_actions + actions[learner]
+            self.queues[learner].push(key, priorities[learner])
+        start = time.perf_counter()
+        self.plan()
+        self.planning_elapsed += time.perf_counter() - start
+
+    def plan(self):
+        for learner, queue in enumerate(self.queues):
+            Q = self.values[learner].reshape(-1)
+            for _ in range(self.planning_steps):
+                if not queue:
+                    break
+                key, _ = queue.pop()
+                Q[key] = self.expected_targets(learner, np.array([key]))[0]
+                self.planning_updates += 1
+
+                keys = self.model.predecessor_pairs(learner, key // self.num_actions)
+                priorities = np.abs(self.expected_targets(learner, keys) - Q[keys])
+                for key, priority in zip(keys.tolist(), priorities.tolist()):
+                    if priority > self.theta:
+                        queue.push(key, priority)
+
+
+if __name__ == "__main__":
+    EAST_POLICY = [[HexMove.EAST for _ in range(10)] for _ in range(3)]
+    hw = HexWorld(grid=GRID, policy=EAST_POLICY)
+    for name, agent in [
+        ("q-learning", DynaQ(hw, planning_steps=0, rng=np.random.default_rng(0))),
+        ("dyna-q", DynaQ(hw, planning_steps=10, rng=np.random.default_rng(0))),
+        ("dyna-q+", DynaQPlus(hw, planning_steps=10, rng=np.random.default_rng(0))),
+        (
+            "prioritized sweeping",
+            PrioritizedSweeping(hw, planning_steps=10, rng=np.random.default_rng(0)),
+        ),
+    ]:
+        rewards = agent.run(5000)
+        print(
+            f"{name:22s} {agent.episodes:5d} episodes "
+            f"reward {rewards.sum():8.1f} "
+            f"{agent.environment_steps_per_second / 1e3:8.1f}k env steps/s "
+            f"{agent.planning_updates_per_second / 1e3:8.1f}k planning updates/s"
+        )
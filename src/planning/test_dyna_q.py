@@ -0,0 +1,87 @@
+import numpy as np
+import pytest
+from hex_world import HexMove, HexWorld, GRID
+from monte_carlo_policy_eval import get_hex_world_prior
+from td import TabularTD
+from value_iteration import value_iteration
+from dyna_q import (
+    TabularModel,
+    DynaQ,
+    DynaQPlus,
+    PrioritizedSweeping,
+    IndexedPriorityQueue,
+)
+
+EAST_POLICY = [[HexMove.EAST for _ in range(10)] for _ in range(3)]
+
+
+def test_tabular_model_counts_and_predecessors():
+    model = TabularModel(2, 5, 2, max_successors=2, predecessor_capacity=1)
+    transitions = [
+        ([0, 1], [1, 0], [0.0, 1.0], [2, 3]),
+        ([0, 1], [1, 0], [2.0, 1.0], [3, 3]),
+        ([0, 4], [1, 1], [1.0, 0.0], [2, 3]),
+    ]
+    for step, (states, actions, rewards, next_states) in enumerate(transitions):
+        model.update(
+            *(np.array(x) for x in (states, actions, rewards, next_states)), step
+        )
+
+    next_states, probs = model.successor_probs(0, 0, 1)
+    assert np.array_equal(next_states, [2, 3])
+    assert np.allclose(probs, [2 / 3, 1 / 3])
+    assert np.allclose(model.mean_rewards(np.array([0, 1]), np.array([1, 0])), [1, 1])
+    assert np.array_equal(model.predecessor_pairs(1, 3), [1 * 2 + 0, 4 * 2 + 1])
+    assert np.array_equal(model.predecessor_pairs(0, 3), [1])
+    assert np.array_equal(model.num_observed, [1, 2])
+    assert model.last_tried[0, 0, 1] == 2
+
+    with pytest.raises(ValueError):
+        model.update(
+            np.array([0, 1]), np.array([1, 0]), np.zeros(2), np.array([4, 3]), 3
+        )
+
+
+def test_indexed_priority_queue():
+    queue = IndexedPriorityQueue(10)
+    for key, priority in [(3, 1.0), (5, 4.0), (7, 2.0), (1, 3.0)]:
+        queue.push(key, priority)
+    queue.push(7, 10.0)  # raised
+    queue.push(5, 0.5)  # lower, ignored
+    assert len(queue) == 4 and 7 in queue
+    popped = [queue.pop() for _ in range(4)]
+    assert popped == [(7, 10.0), (5, 4.0), (1, 3.0), (3, 1.0)]
+    assert not queue and 7 not in queue
+
+
+def test_dyna_q_without_planning_is_q_learning():
+    hw = HexWorld(grid=GRID, policy=EAST_POLICY)
+    dyna = DynaQ(hw, planning_steps=0, n_learners=3, rng=np.random.default_rng(0))
+    q_learning = TabularTD(hw, "q_learning", n_learners=3, rng=np.random.default_rng(0))
+    dyna.run(1000)
+    q_learning.run(1000)
+    assert np.array_equal(dyna.values, q_learning.values)
+    assert dyna.planning_updates == 0
+
+
+def value_error(agent, V_star):
+    visited = get_hex_world_prior() > 0
+    V = np.max(agent.values.mean(axis=0), axis=1)
+    return np.max(np.abs(V[:30] - V_star[:30])[visited])
+
+
+@pytest.mark.parametrize("agent_class", [DynaQ, DynaQPlus, PrioritizedSweeping])
+def test_planning_needs_fewer_real_steps(agent_class):
+    hw = HexWorld(grid=GRID, policy=EAST_POLICY)
+    T, R = hw.get_mdp()
+    gamma = 0.9
+    V_star, _, _ = value_iteration(T, R, gamma, wall_cost=0)
+    kwargs = dict(n_learners=4, gamma=gamma, epsilon=0.3)
+    planner = agent_class(hw, planning_steps=10, rng=np.random.default_rng(0), **kwargs)
+    q_learning = DynaQ(hw, planning_steps=0, rng=np.random.default_rng(0), **kwargs)
+    planner.run(1500)
+    q_learning.run(1500)
+    assert value_error(planner, V_star) < 0.5 * value_error(q_learning, V_star)
+    assert planner.planning_updates > 0
+    assert planner.planning_updates_per_second > 0
+    assert planner.environment_steps_per_second > 0
@@ -1,8 +1,8 @@
-"""Implementation of hexworld problem. 
+"""Implementation of hexworld problem.
 
-Hexworld is a discrete sequential decision problem. The agent attempts to traverse the hexagonal grid 
-to reach one of the scored terminal states. Most tiles give no reward. Moves are probalistic. A policy 
-maps a move to a tile. 
+Hexworld is a discrete sequential decision problem. The agent attempts to traverse the hexagonal grid
+to reach one of the scored terminal states. Most tiles give no reward. Moves are probalistic. A policy
+maps a move to a tile.
 """
 
 import numpy as np
@@ -77,26 +77,80 @@ move2anti_clockwise_move = {
     HexMove.NORTH_EAST: HexMove.NORTH_WEST,
 }
 
+# (row, col) offset of the neighbouring hexagon for each move, indexed by HexMove.value.
+# Odd rows are shifted half a hexagon east, so the diagonal moves depend on row parity.
+EVEN_ROW_OFFSETS = np.array([[-1, -1], [-1, 0], [0, 1], [1, 0], [1, -1], [0, -1]])
+ODD_ROW_OFFSETS = np.array([[-1, 0], [-1, 1], [0, 1], [1, 1], [1, 0], [0, -1]])
+
+# the lottery of Hexagon.reachable_states as arrays, indexed by HexMove.value
+LOTTERY_MOVES = np.array(
+    [
+        [
+            move2clockwise_move[move].value,
+            move.value,
+            move2anti_clockwise_move[move].value,
+        ]
+        for move in HexMove
+    ]
+)
+LOTTERY_PROBS = np.array([0.15, 0.7, 0.15])
+
 
 class Hexagon:
-    def __init__(
-        self, score: int, blank: bool = False, policy: Optional[HexMove] = None
-    ):
-        self.score = int(score)
-        self.blank = blank
-        self.north_west = None
-        self.north_east = None
-        self.east = None
-        self.south_east = None
-        self.south_west = None
-        self.west = None
-        self.policy = policy
+    """View of one hexagon of a HexWorld.
+
+    The world keeps its hexagons as arrays indexed by state id, a Hexagon only holds
+    the world and its state id and reads everything else from the arrays.
+    """
+
+    __slots__ = ("world", "state_id")
+
+    def __init__(self, world: "HexWorld", state_id: int):
+        self.world = world
+        self.state_id = state_id
+
+    @property
+    def score(self) -> int:
+        return int(self.world.scores[self.state_id])
+
+    @property
+    def blank(self) -> bool:
+        return bool(self.world.blank[self.state_id])
+
+    @property
+    def policy(self) -> HexMove:
+        return HexMove(int(self.world.policy[self.state_id]))
+
+    @policy.setter
+    def policy(self, move: HexMove):
+        self.world.policy[self.state_id] = move.value
+
+    @property
+    def north_west(self):
+        return self.get_next_hexagon(HexMove.NORTH_WEST)
+
+    @property
+    def north_east(self):
+        return self.get_next_hexagon(HexMove.NORTH_EAST)
+
+    @property
+    def east(self):
+        return self.get_next_hexagon(HexMove.EAST)
+
+    @property
+    def south_east(self):
+        return self.get_next_hexagon(HexMove.SOUTH_EAST)
+
+    @property
+    def south_west(self):
+        return self.get_next_hexagon(HexMove.SOUTH_WEST)
+
+    @property
+    def west(self):
+        return self.get_next_hexagon(HexMove.WEST)
 
     def reachable_states(self, move: HexMove):
         """Returns a lottery of reachable states from this hexagon"""
-        # return [
-        #     (1, self.get_next_hexagon(move)),
-        # ]
         return [
             (0.15, self.get_next_hexagon(move2clockwise_move[move])),
             (0.7, self.get_next_hexagon(move)),
@@ -104,20 +158,10 @@ class Hexagon:
         ]
 
     def get_next_hexagon(self, move: HexMove):
-        if move == HexMove.NORTH_WEST:
-            return self.north_west
-        elif move == HexMove.NORTH_EAST:
-            return self.north_east
-        elif move == HexMove.EAST:
-            return self.east
-        elif move == HexMove.SOUTH_EAST:
-            return self.south_east
-        elif move == HexMove.SOUTH_WEST:
-            return self.south_west
-        elif move == HexMove.WEST:
-            return self.west
-        else:
+        if not isinstance(move, HexMove):
             raise ValueError("Invalid move")
+        next_state = self.world.neighbors[self.state_id, move.value]
+        return None if next_state == -1 else self.world.get_hexagon(next_state)
 
     def fuzzy_move(self, move: HexMove) -> HexMove:
         r = np.random.random()
@@ -136,96 +180,250 @@ class Hexagon:
         return self.get_next_hexagon(fuzzy_move)
 
 
+class SparseTransitionMatrix:
+    """Transition matrix stored as a padded lottery per state and action.
+
+    next_states[s, a, k] is the k-th state reachable from s under action a and
+    probs[s, a, k] its probability. Unused entries have probability 0. A state may
+    appear more than once in a lottery, in which case its probabilities add.
+    """
+
+    def __init__(self, next_states, probs):
+        self.next_states = next_states
+        self.probs = probs
+
+    @classmethod
+    def from_dense(cls, T):
+        """Build from a dense transition matrix, padding each lottery to the largest
+        number of reachable states."""
+        num_states, num_actions, _ = T.shape
+        nonzero = T > 0
+        width = max(int(np.max(np.sum(nonzero, axis=2))), 1)
+        # stable sort moves the reachable states to the front, in state order
+        order = np.argsort(~nonzero, axis=2, kind="stable")[:, :, :width]
+        probs = np.take_along_axis(T, order, axis=2)
+        next_states = np.where(probs > 0, order, np.arange(num_states)[:, None, None])
+        return cls(next_states, probs)
+
+    @property
+    def shape(self):
+        num_states, num_actions, _ = self.next_states.shape
+        return num_states, num_actions, num_states
+
+    def successors(self, state: int, action: int):
+        """Get the distinct reachable states from state under action and their probabilities."""
+        probs = self.probs[state, action]
+        keep = probs > 0
+        next_states, inverse = np.unique(
+            self.next_states[state, action][keep], return_inverse=True
+        )
+        return next_states, np.bincount(inverse, weights=probs[keep])
+
+    def expected_values(self, V, actions=None):
+        """Expected value of the next state for every state and action, or for the
+        action taken in each state if actions is given."""
+        if actions is None:
+            return np.sum(self.probs * V[self.next_states], axis=2)
+        states = np.arange(len(actions))
+        return np.sum(
+            self.probs[states, actions] * V[self.next_states[states, actions]], axis=1
+        )
+
+    def self_transition_probs(self, actions):
+        """Probability of each state moving back into itself under the given actions."""
+        states = np.arange(len(actions))
+        return np.sum(
+            self.probs[states, actions],
+            axis=1,
+            where=self.next_states[states, actions] == states[:, None],
+        )
+
+    def todense(self):
+        num_states, num_actions, width = self.next_states.shape
+        T = np.zeros(self.shape)
+        np.add.at(
+            T,
+            (
+                np.arange(num_states)[:, None, None],
+                np.arange(num_actions)[None, :, None],
+                self.next_states,
+            ),
+            self.probs,
+        )
+        return T
+
+
+def transition_successors(T, state: int, action: int):
+    """Get the reachable states from state under action, and their probabilities.
+
+    T can be a dense |states| x |actions| x |states| array or a SparseTransitionMatrix.
+    """
+    if isinstance(T, SparseTransitionMatrix):
+        return T.successors(state, action)
+    probs = T[state, action]
+    next_states = np.flatnonzero(probs)
+    return next_states, probs[next_states]
+
+
+def expected_next_values(T, V, actions=None):
+    """Expected value of the next state, E[V(s') | s, a].
+
+    Returns a |states| x |actions| array, or a |states| array for the action taken
+    in each state if actions is given. T can be dense or a SparseTransitionMatrix.
+    """
+    if isinstance(T, SparseTransitionMatrix):
+        return T.expected_values(V, actions)
+    if actions is None:
+        return T @ V
+    return T[np.arange(len(actions)), actions] @ V
+
+
+def state_expected_next_values(T, V, state: int):
+    """Expected value of the next state from one state, for every action.
+
+    T can be dense or a SparseTransitionMatrix.
+    """
+    if isinstance(T, SparseTransitionMatrix):
+        return np.sum(T.probs[state] * V[T.next_states[state]], axis=1)
+    return T[state] @ V
+
+
+def predecessor_lists(T):
+    """Get, for every state, the states that can move into it under some action."""
+    num_states = T.shape[0]
+    if isinstance(T, SparseTransitionMatrix):
+        keep = T.probs.ravel() > 0
+        from_states = np.repeat(np.arange(num_states), T.next_states[0].size)[keep]
+        pairs = np.unique(from_states * num_states + T.next_states.ravel()[keep])
+        from_states, to_states = np.divmod(pairs, num_states)
+    else:
+        from_states, to_states = np.nonzero(np.any(T > 0, axis=1))
+    order = np.argsort(to_states, kind="stable")
+    offsets = np.searchsorted(to_states[order], np.arange(num_states + 1))
+    return [from_states[order][offsets[s] : offsets[s + 1]] for s in range(num_states)]
+
+
+def policy_mdp(T, R, policy_matrix):
+    """Get the dense single action mdp of following a stochastic policy.
+
+    Args:
+        T (np.ndarray): dense |states| x |actions| x |states| transition matrix
+        R (np.ndarray): |states| x |actions| reward matrix
+        policy_matrix (np.ndarray): action probabilities of the first states, like the
+            |states - 1| x |actions| matrices that leave out the terminal state. Any
+            remaining states take action 0.
+
+    Returns:
+        |states| x 1 x |states| transitions and |states| x 1 rewards
+    """
+    probs = np.zeros(R.shape)
+    probs[:, 0] = 1
+    probs[: len(policy_matrix)] = policy_matrix
+    T_pi = np.einsum("sa,sat->st", probs, T)
+    R_pi = np.sum(probs * R, axis=1)
+    return T_pi[:, None], R_pi[:, None]
+
+
+def self_transition_probs(T, actions):
+    """Probability of each state moving back into itself under the given actions."""
+    if isinstance(T, SparseTransitionMatrix):
+        return T.self_transition_probs(actions)
+    states = np.arange(len(actions))
+    return T[states, actions, states]
+
+
+def sample_index(cumulative, rng):
+    """Sample one index from each row of cumulative probabilities with one draw."""
+    u = rng.random(len(cumulative))[:, None] * cumulative[:, -1:]
+    return np.minimum(np.sum(cumulative <= u, axis=1), cumulative.shape[1] - 1)
+
+
+def grid_neighbor_table(blank, rows: int, cols: int):
+    """Get the state id reached by each move from each state of a rows x cols grid.
+
+    Returns a |states| x |actions| int32 array. Entries are -1 where the move leaves
+    the grid or hits a blank hexagon, and blank hexagons have no neighbours.
+    """
+    row_index, col_index = np.divmod(np.arange(rows * cols), cols)
+    offsets = np.where(
+        (row_index % 2 == 0)[:, None, None], EVEN_ROW_OFFSETS, ODD_ROW_OFFSETS
+    )
+    next_row = row_index[:, None] + offsets[:, :, 0]
+    next_col = col_index[:, None] + offsets[:, :, 1]
+    on_grid = (next_row >= 0) & (next_row < rows) & (next_col >= 0) & (next_col < cols)
+    neighbors = np.where(on_grid, next_row * cols + next_col, -1).astype(np.int32)
+    neighbors[on_grid & blank[np.maximum(neighbors, 0)]] = -1
+    neighbors[blank] = -1
+    return neighbors
+
+
 class HexWorld:
-    def __init__(self, grid: list, policy: list):
+    """Hexagon world stored as arrays indexed by state id.
+
+    State ids run along the rows, state_id = row * cols + col. The world keeps
+    scores (int32, -1 for blank hexagons), blank (bool), policy (int8 HexMove values)
+    and neighbors, an int32 |states| x 6 table of the state reached by each move with
+    -1 for walls. Hexagon views are only built when hexagons is used.
+    """
+
+    def __init__(self, grid: list, policy):
         self.position = [0, 0]
-        self.hexagons = []
         self.grid = grid
-        # init hexagons
-        for row_index, row in enumerate(grid):
-            hexagon_row = []
-            for col_index, hexagon in enumerate(row):
-                if hexagon != "X":
-                    hexagon = Hexagon(
-                        score=int(hexagon), policy=policy[row_index][col_index]
-                    )
-                    hexagon_row.append(hexagon)
-                else:
-                    hexagon = Hexagon(
-                        score=-1, blank=True, policy=policy[row_index][col_index]
-                    )
-                    hexagon_row.append(hexagon)
-            self.hexagons.append(hexagon_row)
-
-        # link hexagons
-        for row_index, row in enumerate(grid):
-            for col_index, hexagon_row in enumerate(row):
-                if hexagon_row != "X":
-                    hexagon = self.hexagons[row_index][col_index]
-
-                    if col_index + 1 < len(row):
-                        if not self.hexagons[row_index][col_index + 1].blank:
-                            hexagon.east = self.hexagons[row_index][col_index + 1]
-
-                    if col_index - 1 >= 0:
-                        if not self.hexagons[row_index][col_index - 1].blank:
-                            hexagon.west = self.hexagons[row_index][col_index - 1]
-
-                    if row_index % 2 == 0:
-                        # north east
-                        if row_index - 1 >= 0:
-                            if not self.hexagons[row_index - 1][col_index].blank:
-                                hexagon.north_east = self.hexagons[row_index - 1][
-                                    col_index
-                                ]
-                        # north west
-                        if row_index - 1 >= 0 and col_index - 1 >= 0:
-                            if not self.hexagons[row_index - 1][col_index - 1].blank:
-                                hexagon.north_west = self.hexagons[row_index - 1][
-                                    col_index - 1
-                                ]
-
-                        # south east
-                        if row_index + 1 < len(grid):
-                            if not self.hexagons[row_index + 1][col_index].blank:
-                                hexagon.south_east = self.hexagons[row_index + 1][
-                                    col_index
-                                ]
-
-                        # south west
-                        if row_index + 1 < len(grid) and col_index - 1 >= 0:
-                            if not self.hexagons[row_index + 1][col_index - 1].blank:
-                                hexagon.south_west = self.hexagons[row_index + 1][
-                                    col_index - 1
-                                ]
-
-                    if row_index % 2 != 0:
-                        # north east
-                        if row_index - 1 >= 0 and col_index + 1 < len(row):
-                            if not self.hexagons[row_index - 1][col_index + 1].blank:
-                                hexagon.north_east = self.hexagons[row_index - 1][
-                                    col_index + 1
-                                ]
-                        # north west
-                        if row_index - 1 >= 0:
-                            if not self.hexagons[row_index - 1][col_index].blank:
-                                hexagon.north_west = self.hexagons[row_index - 1][
-                                    col_index
-                                ]
-
-                        # south east
-                        if row_index + 1 < len(grid) and col_index + 1 < len(row):
-                            if not self.hexagons[row_index + 1][col_index + 1].blank:
-                                hexagon.south_east = self.hexagons[row_index + 1][
-                                    col_index + 1
-                                ]
-
-                        # south west
-                        if row_index + 1 < len(grid) and col_index > 0:
-                            if not self.hexagons[row_index + 1][col_index].blank:
-                                hexagon.south_west = self.hexagons[row_index + 1][
-                                    col_index
-                                ]
+        rows, cols = len(grid), len(grid[0])
+        if any(len(row) != cols for row in grid):
+            raise ValueError("grid must be rectangular")
+        self.shape = (rows, cols)
+
+        cells = np.array(grid, dtype=str).reshape(-1)
+        self.blank = cells == "X"
+        self.scores = np.where(self.blank, "-1", cells).astype(np.int32)
+        if isinstance(policy, np.ndarray):
+            self.policy = policy.astype(np.int8).reshape(-1)
+            if len(self.policy) != rows * cols:
+                raise ValueError("policy must have one move per hexagon")
+        else:
+            self.policy = np.array(
+                [policy[row][col].value for row in range(rows) for col in range(cols)],
+                dtype=np.int8,
+            )
+        self.neighbors = grid_neighbor_table(self.blank, rows, cols)
+        self._hexagons = None
+
+    @property
+    def num_states(self) -> int:
+        return len(self.scores)
+
+    def get_hexagon(self, state_id: int) -> Hexagon:
+        cols = self.shape[1]
+        return self.hexagons[state_id // cols][state_id % cols]
+
+    @property
+    def hexagons(self):
+        """Rows of Hexagon views, built on first use."""
+        if self._hexagons is None:
+            rows, cols = self.shape
+            self._hexagons = [
+                [Hexagon(self, row * cols + col) for col in range(cols)]
+                for row in range(rows)
+            ]
+        return self._hexagons
+
+    def move(self, states, moves, rng=None):
+        """Take fuzzy moves from many states at once.
+
+        Args:
+            states (np.ndarray): state ids
+            moves (np.ndarray): HexMove value taken in each state
+            rng (np.random.Generator, optional): random generator. Defaults to np.random.
+
+        Returns:
+            np.ndarray: state id reached from each state, -1 where the move hit a wall
+        """
+        rng = np.random if rng is None else rng
+        r = rng.random(np.shape(states))
+        # lottery column: 0 clockwise, 1 the move, 2 anticlockwise
+        outcome = np.where(r < 0.15, 2, np.where(r > 0.85, 0, 1))
+        return self.neighbors[states, LOTTERY_MOVES[moves, outcome]]
 
     def get_mdp_transition_matrix(self):
         """Get transsmisions matrix corresponding to the hexagon world.
@@ -281,6 +479,105 @@ class HexWorld:
     def get_mdp(self):
         return self.get_mdp_transition_matrix(), self.get_mdp_reward_matrix()
 
+    def get_grid_shape(self):
+        """Get (rows, cols) of the grid."""
+        return self.shape
+
+    def get_scores(self):
+        """Get the score of each state, indexed by state id. Blank hexagons score -1."""
+        return self.scores
+
+    def get_blank_mask(self):
+        """Get a boolean array marking the blank states, indexed by state id."""
+        return self.blank
+
+    def get_policy_actions(self):
+        """Get the action (HexMove value) of the policy in each state, indexed by state id."""
+        return self.policy
+
+    def get_neighbor_table(self):
+        """Get the state id reached by each move from each state, -1 for walls."""
+        return self.neighbors
+
+    def get_terminal_mask(self):
+        """Get a boolean array marking the scored states, which move to the terminal state."""
+        scores = self.get_scores()
+        return ~self.get_blank_mask() & (scores != 0) & (scores != -1)
+
+    def get_mdp_transition_matrix_vectorized(self):
+        """Array based version of get_mdp_transition_matrix.
+
+        Builds the same |states|+1 x |actions| x |states|+1 matrix from the neighbour
+        table with a single scatter, instead of searching the state list per hexagon.
+        """
+        rows, cols = self.get_grid_shape()
+        num_states = rows * cols
+        blank = self.get_blank_mask()
+        terminal = self.get_terminal_mask()
+        neighbors = self.get_neighbor_table()
+
+        T = np.zeros((num_states + 1, 6, num_states + 1))
+        from_index = np.flatnonzero(~blank & ~terminal)
+        to_index = neighbors[from_index][:, LOTTERY_MOVES]  # states x moves x lottery
+        # moving into a wall or blank hexagon leaves the agent where it is
+        to_index = np.where(to_index == -1, from_index[:, None, None], to_index)
+        np.add.at(
+            T,
+            (from_index[:, None, None], np.arange(6)[None, :, None], to_index),
+            LOTTERY_PROBS,
+        )
+        T[np.flatnonzero(terminal), :, num_states] = 1
+        T[num_states, :, num_states] = 1
+        return T
+
+    def get_mdp_reward_matrix_vectorized(self):
+        """Array based version of get_mdp_reward_matrix."""
+        scores = self.get_scores()
+        R = np.zeros((len(scores) + 1, 6))
+        R[: len(scores)] = scores[:, None]
+        return R
+
+    def get_mdp_vectorized(self):
+        return (
+            self.get_mdp_transition_matrix_vectorized(),
+            self.get_mdp_reward_matrix_vectorized(),
+        )
+
+    def get_mdp_transition_matrix_sparse(self):
+        """Sparse version of get_mdp_transition_matrix.
+
+        Each state and action keeps only its lottery of at most three reachable
+        states, so memory grows with |states| rather than |states|^2.
+        """
+        rows, cols = self.get_grid_shape()
+        num_states = rows * cols
+        blank = self.get_blank_mask()
+        terminal = self.get_terminal_mask()
+        neighbors = self.get_neighbor_table()
+        moving = ~blank & ~terminal
+
+        # unused lottery entries point back at the state with probability 0
+        next_states = np.repeat(np.arange(num_states + 1), 6 * 3).reshape(-1, 6, 3)
+        probs = np.zeros((num_states + 1, 6, 3))
+
+        to_index = neighbors[moving][:, LOTTERY_MOVES]
+        from_index = np.flatnonzero(moving)[:, None, None]
+        next_states[:num_states][moving] = np.where(
+            to_index == -1, from_index, to_index
+        )
+        probs[:num_states][moving] = LOTTERY_PROBS
+
+        next_states[:num_states][terminal, :, 0] = num_states
+        probs[:num_states][terminal, :, 0] = 1
+        probs[num_states, :, 0] = 1
+        return SparseTransitionMatrix(next_states, probs)
+
+    def get_mdp_sparse(self):
+        return (
+            self.get_mdp_transition_matrix_sparse(),
+            self.get_mdp_reward_matrix_vectorized(),
+        )
+
     def graph(self, ax, show_score=True, show_policy=False):
         vertices = np.array(
             [
@@ -339,6 +636,74 @@ class HexWorld:
         plt.axis("off")
 
 
+class VecHexWorld:
+    """Many HexWorld agents stepped together.
+
+    State ids are those of the HexWorld, with the terminal state numbered |states|.
+    An agent in a scored hexagon receives its score and moves to the terminal state,
+    any other agent takes a fuzzy move and stays put if it hits a wall. Finished
+    agents are reset from p_init straight away, so states always holds live states.
+    """
+
+    def __init__(
+        self,
+        hw: HexWorld,
+        p_init=None,
+        rng: Optional[np.random.Generator] = None,
+    ):
+        """
+        Args:
+            hw (HexWorld): world to simulate
+            p_init (np.ndarray, optional): initial state distribution over the
+                hexagons. Defaults to uniform over the unscored hexagons.
+            rng (np.random.Generator, optional): random source. Defaults to np.random.
+        """
+        self.rng = np.random if rng is None else rng
+        self.num_states = hw.num_states
+        terminal = hw.get_terminal_mask()
+        if p_init is None:
+            p_init = (~hw.get_blank_mask() & (hw.get_scores() == 0)).astype(float)
+        self.cumulative_init = np.cumsum(p_init)
+
+        # next state for each state, move and lottery outcome (clockwise, move, anticlockwise)
+        states = np.arange(self.num_states, dtype=np.int32)
+        next_states = hw.get_neighbor_table()[:, LOTTERY_MOVES]
+        next_states = np.where(next_states == -1, states[:, None, None], next_states)
+        next_states[terminal] = self.num_states
+        self.next_states = next_states.astype(np.int32)
+        self.rewards = np.where(terminal, hw.get_scores(), 0).astype(float)
+        self.terminal = terminal
+        self.states = np.zeros(0, dtype=np.int32)
+
+    def sample_initial_states(self, n: int):
+        u = self.rng.random(n) * self.cumulative_init[-1]
+        return np.searchsorted(self.cumulative_init, u, side="right").astype(np.int32)
+
+    def reset(self, n: int):
+        """Start n agents from p_init and return their states."""
+        self.states = self.sample_initial_states(n)
+        return self.states.copy()
+
+    def step(self, actions):
+        """Take one action (HexMove value) per agent.
+
+        Returns:
+            tuple: next state, reward and done flag of each agent. The next state of
+                a finished agent is the terminal state, its reset state is in states.
+        """
+        states = self.states
+        r = self.rng.random(len(states))
+        outcome = (r < 0.85).astype(np.intp) + (r < 0.15)
+        next_states = self.next_states[states, actions, outcome]
+        rewards = self.rewards[states]
+        dones = self.terminal[states]
+
+        self.states = next_states.copy()
+        finished = np.flatnonzero(dones)
+        self.states[finished] = self.sample_initial_states(len(finished))
+        return next_states, rewards, dones
+
+
 if __name__ == "__main__":
     grid = [["1", "2"], ["3", "4"]]
     hw = HexWorld(grid=grid)
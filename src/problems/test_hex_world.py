@@ -1,6 +1,13 @@
 import pytest
 import numpy as np
-from hex_world import HexMove, HexWorld
+from hex_world import (
+    HexMove,
+    HexWorld,
+    GRID,
+    SparseTransitionMatrix,
+    VecHexWorld,
+    transition_successors,
+)
 
 
 def test_small_hex_world():
@@ -38,3 +45,145 @@ def test_small_hex_world():
     assert hw.hexagons[1][0].south_west == None
     assert hw.hexagons[1][0].south_east == None
     assert hw.hexagons[1][0].east.score == 4
+
+
+def test_state_ids_follow_grid_order():
+    policy = [[HexMove.EAST for _ in range(2)] for _ in range(2)]
+    grid = [["1", "2"], ["3", "4"]]
+    hw = HexWorld(grid=grid, policy=policy)
+    state_ids = [hexagon.state_id for row in hw.hexagons for hexagon in row]
+    assert state_ids == [0, 1, 2, 3]
+
+
+def test_vectorized_mdp_matches_loop_mdp():
+    policy = [[HexMove.EAST for _ in range(10)] for _ in range(3)]
+    hw = HexWorld(grid=GRID, policy=policy)
+    T, R = hw.get_mdp()
+    T_vec, R_vec = hw.get_mdp_vectorized()
+    assert np.array_equal(T, T_vec)
+    assert np.array_equal(R, R_vec)
+
+
+def test_vectorized_mdp_matches_loop_mdp_random_grid():
+    rng = np.random.default_rng(0)
+    grid = rng.choice(["0", "0", "0", "0", "X", "5", "-10"], size=(7, 6)).tolist()
+    policy = [[HexMove.EAST for _ in range(6)] for _ in range(7)]
+    hw = HexWorld(grid=grid, policy=policy)
+    T, R = hw.get_mdp()
+    T_vec, R_vec = hw.get_mdp_vectorized()
+    assert np.array_equal(T, T_vec)
+    assert np.array_equal(R, R_vec)
+
+
+def test_sparse_mdp_matches_dense_mdp():
+    policy = [[HexMove.EAST for _ in range(10)] for _ in range(3)]
+    hw = HexWorld(grid=GRID, policy=policy)
+    T, R = hw.get_mdp()
+    T_sparse, R_sparse = hw.get_mdp_sparse()
+    assert T_sparse.shape == T.shape
+    assert T_sparse.next_states.shape == (31, 6, 3)
+    assert np.array_equal(T_sparse.todense(), T)
+    assert np.array_equal(R_sparse, R)
+
+
+def test_sparse_successors_match_dense_successors():
+    policy = [[HexMove.EAST for _ in range(10)] for _ in range(3)]
+    hw = HexWorld(grid=GRID, policy=policy)
+    T = hw.get_mdp_transition_matrix()
+    T_sparse = hw.get_mdp_transition_matrix_sparse()
+    for state in range(T.shape[0]):
+        for action in range(6):
+            next_states, probs = transition_successors(T, state, action)
+            sparse_next_states, sparse_probs = transition_successors(
+                T_sparse, state, action
+            )
+            assert np.array_equal(next_states, sparse_next_states)
+            assert np.array_equal(probs, sparse_probs)
+
+
+def test_sparse_from_dense_round_trip():
+    policy = [[HexMove.EAST for _ in range(10)] for _ in range(3)]
+    hw = HexWorld(grid=GRID, policy=policy)
+    T = hw.get_mdp_transition_matrix()
+    T_sparse = SparseTransitionMatrix.from_dense(T)
+    assert T_sparse.next_states.shape == (31, 6, 3)
+    assert np.array_equal(T_sparse.todense(), T)
+
+
+def test_hexagon_views_write_through_to_world():
+    policy = [[HexMove.EAST for _ in range(10)] for _ in range(3)]
+    hw = HexWorld(grid=GRID, policy=policy)
+    hexagon = hw.hexagons[1][2]
+    assert hexagon is hw.get_hexagon(12)
+    hexagon.policy = HexMove.WEST
+    assert hw.get_policy_actions()[12] == HexMove.WEST.value
+    assert hw.hexagons[1][3].blank
+    assert hw.hexagons[1][3].score == -1
+
+
+def test_array_world_builds_mdp_without_hexagon_views():
+    rows, cols = 100, 100
+    grid = [["0"] * cols for _ in range(rows)]
+    grid[-1][-1] = "10"
+    policy = np.full((rows, cols), HexMove.EAST.value)
+    hw = HexWorld(grid=grid, policy=policy)
+    T_sparse, R = hw.get_mdp_sparse()
+    assert hw._hexagons is None
+    assert hw.neighbors.dtype == np.int32
+    nbytes = hw.scores.nbytes + hw.blank.nbytes + hw.policy.nbytes
+    assert (nbytes + hw.neighbors.nbytes) / (rows * cols) <= 32
+
+
+def test_array_move_follows_lottery():
+    policy = [[HexMove.EAST for _ in range(10)] for _ in range(3)]
+    hw = HexWorld(grid=GRID, policy=policy)
+    T = hw.get_mdp_transition_matrix()
+    rng = np.random.default_rng(0)
+    n = 20000
+    states = np.full(n, 11)
+    next_states = hw.move(states, np.full(n, HexMove.EAST.value), rng=rng)
+    # a wall leaves the agent where it is
+    next_states = np.where(next_states == -1, states, next_states)
+    counts = np.bincount(next_states, minlength=T.shape[0]) / n
+    assert np.allclose(counts, T[11, HexMove.EAST.value], atol=0.02)
+
+
+def test_vec_hex_world_step_follows_transition_matrix():
+    policy = [[HexMove.EAST for _ in range(10)] for _ in range(3)]
+    hw = HexWorld(grid=GRID, policy=policy)
+    T = hw.get_mdp_transition_matrix()
+    env = VecHexWorld(hw, rng=np.random.default_rng(0))
+    n = 20000
+    env.reset(n)
+    for state, action in [(11, HexMove.EAST.value), (0, HexMove.NORTH_WEST.value)]:
+        env.states[:] = state
+        next_states, rewards, dones = env.step(np.full(n, action))
+        counts = np.bincount(next_states, minlength=T.shape[0]) / n
+        assert np.allclose(counts, T[state, action], atol=0.02)
+        assert not dones.any() and not rewards.any()
+
+
+def test_vec_hex_world_scored_states_finish_and_reset():
+    policy = [[HexMove.EAST for _ in range(10)] for _ in range(3)]
+    hw = HexWorld(grid=GRID, policy=policy)
+    env = VecHexWorld(hw, rng=np.random.default_rng(0))
+    states = env.reset(1000)
+    assert np.all(hw.get_scores()[states] == 0)
+    env.states[:500] = 10  # scores 5
+    next_states, rewards, dones = env.step(np.zeros(1000, dtype=int))
+    assert np.all(dones[:500]) and not dones[500:].any()
+    assert np.all(rewards[:500] == 5)
+    assert np.all(next_states[:500] == hw.num_states)
+    assert np.all(hw.get_scores()[env.states[:500]] == 0)
+
+
+def test_vec_hex_world_is_reproducible():
+    policy = [[HexMove.EAST for _ in range(10)] for _ in range(3)]
+    hw = HexWorld(grid=GRID, policy=policy)
+    runs = []
+    for _ in range(2):
+        env = VecHexWorld(hw, rng=np.random.default_rng(1))
+        env.reset(100)
+        runs.append([env.step(hw.get_policy_actions()[env.states]) for _ in range(50)])
+    for (s1, r1, d1), (s2, r2, d2) in zip(*runs):
+        assert np.array_equal(s1, s2) and np.array_equal(r1, r2)
@@ -0,0 +1,123 @@
+"""TD(lambda) and SARSA(lambda) with sparse eligibility traces.
+
+A trace decays by gamma * lambda per step, so once it falls below trace_threshold it
+is dropped. The traces of a learner are then the states (or state action pairs) it
+visited in the last m steps, kept in a circular buffer of length m, and each step
+costs O(m) rather than O(|states|). Accumulating traces add up repeat visits inside
+the window, replacing traces only keep the most recent one.
+"""
+
+import numpy as np
+from hex_world import HexWorld, GRID, HexMove
+from td import TabularTD, td0_bootstrap, sarsa_bootstrap
+
+TRACE_RULES = {
+    "td0": (td0_bootstrap, False),
+    "sarsa": (sarsa_bootstrap, True),
+}
+
+
+def trace_length(decay: float, trace_threshold: float, max_traces: int) -> int:
+    """Number of steps before a trace decaying by decay falls below trace_threshold.
+
+    Raises:
+        ValueError: if that takes more than max_traces steps, as dropping the longer
+            traces would change the values learned
+    """
+    if decay <= 0:
+        return 1
+    steps = np.inf if decay >= 1 else np.ceil(np.log(trace_threshold) / np.log(decay))
+    if steps > max_traces:
+        raise ValueError(
+            f"traces decaying by {decay} take {steps:.0f} steps to fall below "
+            f"{trace_threshold}, more than max_traces={max_traces}. Raise max_traces "
+            "or trace_threshold, or lower lambda."
+        )
+    return max(int(steps), 1)
+
+
+class TDLambda(TabularTD):
+    """Batch of TD(lambda) learners with truncated sparse traces, see TabularTD."""
+
+    rules = TRACE_RULES
+
+    def __init__(
+        self,
+        hw: HexWorld,
+        rule: str = "td0",
+        lam: float = 0.9,
+        trace: str = "accumulating",
+        trace_threshold: float = 1e-3,
+        max_traces: int = 1000,
+        **kwargs,
+    ):
+        """
+        Args:
+            hw (HexWorld): world to learn in
+            rule (str): key of TRACE_RULES
+            lam (float): trace decay lambda
+            trace (str): "accumulating" or "replacing"
+            trace_threshold (float): traces smaller than this are dropped
+            max_traces (int): most traces kept per learner, ValueError is raised if
+                the traces would need more
+            **kwargs: passed to TabularTD
+        """
+        super().__init__(hw, rule, **kwargs)
+        if trace not in ("accumulating", "replacing"):
+            raise ValueError(f"Unknown trace {trace}")
+        self.lam = lam
+        self.trace = trace
+        decay = self.gamma * lam
+        self.num_traces = trace_length(decay, trace_threshold, max_traces)
+        self.decay_powers = decay ** np.arange(self.num_traces)
+
+    def reset(self):
+        states = super().reset()
+        m = self.num_traces
+        self.flat_values = self.values.reshape(self.n_learners, -1)
+        self.buffer_keys = np.zeros((m, self.n_learners), dtype=np.intp)
+        self.time = 0  # global step, the visit of step t is stored at slot t % m
+        self.episode_start = np.zeros(self.n_learners, dtype=np.int64)
+        if self.trace == "replacing":
+            self.last_visit = np.full(self.flat_values.shape, -1, dtype=np.int64)
+        return states
+
+    def update(self, states, actions, rewards, next_states, next_actions, dones):
+        t, m = self.time, self.num_traces
+        keys = states * self.num_actions + actions if self.control else states
+        self.buffer_keys[t % m] = keys
+
+        bootstrap = self.bootstrap(self, next_states, next_actions)
+        delta = rewards + self.gamma * bootstrap - self.flat_values[self.learners, keys]
+
+        steps = np.arange(t, max(t - m, -1), -1)  # newest visit first
+        trace_keys = self.buffer_keys[steps % m]
+        active = steps[:, None] >= self.episode_start
+        if self.trace == "replacing":
+            self.last_visit[self.learners, keys] = t
+            active &= self.last_visit[self.learners, trace_keys] == steps[:, None]
+        weights = self.decay_powers[: len(steps), None] * active
+        np.add.at(
+            self.flat_values,
+            (np.broadcast_to(self.learners, trace_keys.shape), trace_keys),
+            self.alpha * weights * delta,
+        )
+
+        self.episode_start[dones] = t + 1
+        self.time += 1
+
+
+if __name__ == "__main__":
+    EAST_POLICY = [[HexMove.EAST for _ in range(10)] for _ in range(3)]
+    hw = HexWorld(grid=GRID, policy=EAST_POLICY)
+    for rule in TRACE_RULES:
+        for trace in ["accumulating", "replacing"]:
+            engine = TDLambda(
+                hw, rule, trace=trace, n_learners=100, rng=np.random.default_rng(0)
+            )
+            engine.run(5_000)
+            print(
+                f"{rule:6s} {trace:12s} {engine.num_traces} traces "
+                f"{engine.updates_per_second / 1e6:.2f}M updates/s "
+                f"{engine.episodes} episodes"
+            )
@@ -0,0 +1,184 @@
+"""n-step TD, n-step SARSA, n-step tree backup and n-step Q(sigma).
+
+The last n transitions of every learner are kept in circular buffers indexed by
+global step % n, so the cost per step is O(n) however long the episodes are. When
+an episode ends all of its buffered transitions are updated with truncated returns
+and the buffer of that learner starts over.
+"""
+
+import numpy as np
+from hex_world import HexWorld, GRID, HexMove
+from td import TabularTD, td0_bootstrap, sarsa_bootstrap
+
+# update rule name -> (bootstrap of the n-step return, whether it learns action values)
+# tree backup and Q(sigma) build their return recursively instead of bootstrapping
+N_STEP_RULES = {
+    "td0": (td0_bootstrap, False),
+    "sarsa": (sarsa_bootstrap, True),
+    "tree_backup": (None, True),
+    "q_sigma": (None, True),
+}
+
+
+class NStepTD(TabularTD):
+    """Batch of n-step TD learners, see TabularTD.
+
+    td0 and sarsa use the discounted sum of the buffered rewards plus
+    gamma^n times the value of the state (and action) n steps on. tree_backup and
+    q_sigma learn the action values of a target policy that is epsilon greedy with
+    target_epsilon, from the recursion of Sutton and Barto (7.17). sigma=1 samples
+    with importance sampling ratios, sigma=0 is tree backup.
+    """
+
+    rules = N_STEP_RULES
+
+    def __init__(
+        self,
+        hw: HexWorld,
+        rule: str = "sarsa",
+        n: int = 4,
+        sigma: float = 0.5,
+        target_epsilon: float = 0.0,
+        **kwargs,
+    ):
+        """
+        Args:
+            hw (HexWorld): world to learn in
+            rule (str): key of N_STEP_RULES
+            n (int): number of steps before bootstrapping
+            sigma (float): degree of sampling of q_sigma
+            target_epsilon (float): exploration of the target policy of tree_backup
+                and q_sigma
+            **kwargs: passed to TabularTD
+        """
+        super().__init__(hw, rule, **kwargs)
+        self.n = n
+        self.sigma = 0.0 if rule == "tree_backup" else sigma
+        self.target_epsilon = target_epsilon
+        self.gamma_powers = self.gamma ** np.arange(n + 1)
+
+    def reset(self):
+        states = super().reset()
+        self.buffer_states = np.zeros((self.n, self.n_learners), dtype=np.intp)
+        self.buffer_actions = np.zeros((self.n, self.n_learners), dtype=np.intp)
+        self.buffer_rewards = np.zeros((self.n, self.n_learners))
+        self.time = 0  # global step, transition t is stored at slot t % n
+        self.episode_start = np.zeros(self.n_learners, dtype=np.int64)
+        return states
+
+    def update(self, states, actions, rewards, next_states, next_actions, dones):
+        slot = self.time % self.n
+        self.buffer_states[slot] = states
+        self.buffer_actions[slot] = actions
+        self.buffer_rewards[slot] = rewards
+        if self.bootstrap is None:
+            self.q_sigma_update(next_states, next_actions, dones)
+        else:
+            self.n_step_update(next_states, next_actions, dones)
+        self.episode_start[dones] = self.time + 1
+        self.time += 1
+
+    def apply(self, slot: int, mask, G):
+        """Move the value of the transition at slot towards G for learners in mask."""
+        learners = self.learners[mask]
+        states = self.buffer_states[slot, mask]
+        if self.control:
+            index = (learners, states, self.buffer_actions[slot, mask])
+        else:
+            index = (learners, states)
+        self.values[index] += self.alpha * (G[mask] - self.values[index])
+
+    def n_step_update(self, next_states, next_actions, dones):
+        t, n = self.time, self.n
+        # running learners with n buffered transitions update the oldest one
+        full = ~dones & (t - self.episode_start + 1 >= n)
+        if np.any(full):
+            tau = t - n + 1
+            slots = (tau + np.arange(n)) % n
+            G = self.gamma_powers[:n] @ self.buffer_rewards[slots]
+            G += self.gamma_powers[n] * self.bootstrap(self, next_states, next_actions)
+            self.apply(tau % n, full, G)
+
+        # finished learners update every buffered transition, oldest first, with
+        # returns accumulated from the newest
+        if np.any(dones):
+            returns = []
+            G = np.zeros(self.n_learners)
+            for step in range(t, max(t - n, -1), -1):
+                G = self.buffer_rewards[step % n] + self.gamma * G
+                returns.append((step, G))
+            for step, G in reversed(returns):
+                self.apply(step % n, dones & (step >= self.episode_start), G)
+
+    def target_terms(self, states, actions):
+        """Expected value V(s) of the target policy, and the target probability,
+        importance sampling ratio and current value of the action taken in s.
+
+        states and actions hold one entry per learner along their last axis.
+        """
+        Q = self.values[self.learners, states]
+        greedy = np.argmax(Q, axis=-1)[..., None]
+        is_greedy = np.arange(self.num_actions) == greedy
+        target_probs = (
+            self.target_epsilon / self.num_actions
+            + (1 - self.target_epsilon) * is_greedy
+        )
+        behavior_probs = (
+            self.epsilon / self.num_actions + (1 - self.epsilon) * is_greedy
+        )
+        actions = actions[..., None]
+        target_prob = np.take_along_axis(target_probs, actions, axis=-1)[..., 0]
+        behavior_prob = np.take_along_axis(behavior_probs, actions, axis=-1)[..., 0]
+        ratio = np.divide(
+            target_prob,
+            behavior_prob,
+            out=np.zeros_like(target_prob),
+            where=behavior_prob > 0,
+        )
+        q = np.take_along_axis(Q, actions, axis=-1)[..., 0]
+        return np.sum(target_probs * Q, axis=-1), target_prob, ratio, q
+
+    def q_sigma_update(self, next_states, next_actions, dones):
+        t, n = self.time, self.n
+        steps = np.arange(t, max(t - n, -1), -1)  # newest first
+        slots = steps % n
+        # each transition is followed by the next buffered one, the newest by the
+        # next state and action. All terms use the values from before this update.
+        following_states = np.vstack([next_states, self.buffer_states[slots[:-1]]])
+        following_actions = np.vstack([next_actions, self.buffer_actions[slots[:-1]]])
+        expected, target_prob, ratio, q = self.target_terms(
+            following_states, following_actions
+        )
+        weight = self.sigma * ratio + (1 - self.sigma) * target_prob
+
+        G = q[0]  # so the newest return is R + gamma V(s')
+        returns = []
+        for i, slot in enumerate(slots):
+            G = self.buffer_rewards[slot] + self.gamma * (
+                weight[i] * (G - q[i]) + expected[i]
+            )
+            returns.append(G)
+
+        # running learners update the transition n - 1 steps back, finished
+        # learners every buffered transition, oldest first
+        oldest = t - n + 1
+        for step, G in zip(steps[::-1], returns[::-1]):
+            update = dones if step != oldest else np.ones(self.n_learners, bool)
+            update = update & (step >= self.episode_start)
+            if np.any(update):
+                self.apply(step % n, update, G)
+
+
+if __name__ == "__main__":
+    EAST_POLICY = [[HexMove.EAST for _ in range(10)] for _ in range(3)]
+    hw = HexWorld(grid=GRID, policy=EAST_POLICY)
+    for rule in N_STEP_RULES:
+        for n in [1, 4, 16]:
+            engine = NStepTD(
+                hw, rule, n=n, n_learners=100, rng=np.random.default_rng(0)
+            )
+            engine.run(5_000)
+            print(
+                f"{rule:12s} n={n:2d} {engine.updates_per_second / 1e6:.2f}M updates/s "
+                f"{engine.episodes} episodes"
+            )
@@ -1,2 +1,225 @@
-def one_step_td():
-    pass
+"""Tabular temporal difference learning on hex world.
+
+One engine, TabularTD, runs a batch of independent learners in lockstep, one agent
+each in a VecHexWorld. Every step samples an action per learner, steps the world
+and applies
+
+    value[s(, a)] += alpha * (r + gamma * bootstrap(s', a') - value[s(, a)])
+
+where the bootstrap of the chosen update rule is the only thing that differs
+between TD(0), SARSA, Q-learning and Expected SARSA. Tables have a row for the
+terminal state, which is never updated and so bootstraps to 0.
+"""
+
+import time
+import numpy as np
+from typing import Optional
+from hex_world import HexWorld, VecHexWorld, GRID, HexMove, sample_index
+
+
+def td0_bootstrap(engine: "TabularTD", next_states, next_actions):
+    return engine.values[engine.learners, next_states]
+
+
+def sarsa_bootstrap(engine: "TabularTD", next_states, next_actions):
+    return engine.values[engine.learners, next_states, next_actions]
+
+
+def q_learning_bootstrap(engine: "TabularTD", next_states, next_actions):
+    return np.max(engine.values[engine.learners, next_states], axis=1)
+
+
+def expected_sarsa_bootstrap(engine: "TabularTD", next_states, next_actions):
+    """Expected value of the next state under the epsilon greedy policy."""
+    Q = engine.values[engine.learners, next_states]
+    return (1 - engine.epsilon) * np.max(Q, axis=1) + engine.epsilon * np.mean(
+        Q, axis=1
+    )
+
+
+# update rule name -> (bootstrap, whether it learns action values)
+TD_RULES = {
+    "td0": (td0_bootstrap, False),
+    "sarsa": (sarsa_bootstrap, True),
+    "q_learning": (q_learning_bootstrap, True),
+    "expected_sarsa": (expected_sarsa_bootstrap, True),
+}
+
+
+class TabularTD:
+    """Batch of tabular TD learners sharing one hot loop.
+
+    values is preallocated as n_learners x |states|+1 for TD(0) and
+    n_learners x |states|+1 x |actions| for the control rules. TD(0) follows
+    policy_matrix through a precomputed cumulative table, the control rules act
+    epsilon greedily on their own Q with one uniform draw per learner and step.
+
+    Subclasses change the update by overriding rules, reset and update, run stays
+    the same loop for all of them.
+    """
+
+    rules = TD_RULES
+
+    def __init__(
+        self,
+        hw: HexWorld,
+        rule: str = "q_learning",
+        n_learners: int = 1,
+        alpha: float = 0.1,
+        gamma: float = 0.99,
+        epsilon: float = 0.1,
+        policy_matrix=None,
+        dtype=np.float64,
+        rng: Optional[np.random.Generator] = None,
+    ):
+        """
+        Args:
+            hw (HexWorld): world to learn in
+            rule (str): key of rules
+            n_learners (int): number of independent learners
+            alpha (float): step size
+            gamma (float): discount
+            epsilon (float): exploration rate of the control rules
+            policy_matrix (np.ndarray, optional): |states| x |actions| action
+                probabilities followed by TD(0). Defaults to the policy of hw.
+            dtype: float type of the value table
+            rng (np.random.Generator, optional): random source. Defaults to np.random.
+        """
+        if rule not in self.rules:
+            raise ValueError(f"Unknown rule {rule}")
+        self.rule = rule
+        self.bootstrap, self.control = self.rules[rule]
+        self.rng = np.random if rng is None else rng
+        self.env = VecHexWorld(hw, rng=self.rng)
+        self.n_learners = n_learners
+        self.learners = np.arange(n_learners)
+        self.alpha = alpha
+        self.gamma = gamma
+        self.epsilon = epsilon
+        self.num_actions = len(HexMove)
+        self.explore_scale = self.num_actions / epsilon if epsilon > 0 else 0.0
+
+        num_states = hw.num_states + 1
+        if self.control:
+            shape = (n_learners, num_states, self.num_actions)
+        else:
+            shape = (n_learners, num_states)
+            if policy_matrix is None:
+                policy_matrix = np.eye(self.num_actions)[hw.get_policy_actions()]
+            self.cumulative_policy = np.cumsum(policy_matrix, axis=1)
+        self.values = np.zeros(shape, dtype=dtype)
+
+        self.updates = 0
+        self.episodes = 0
+        self.elapsed = 0.0
+        self.pending_actions = None  # actions to take next, None before the first run
+
+    @property
+    def updates_per_second(self) -> float:
+        return self.updates / self.elapsed if self.elapsed > 0 else 0.0
+
+    def select_actions(self, states):
+        """Sample one action per learner in states."""
+        if not self.control:
+            return sample_index(self.cumulative_policy[states], self.rng)
+        u = self.rng.random(self.n_learners)
+        explore = u < self.epsilon
+        greedy = np.argmax(self.values[self.learners, states], axis=1)
+        # an exploring draw u < epsilon is rescaled into a uniform random action
+        random_actions = (u * self.explore_scale).astype(int)
+        return np.where(explore, random_actions, greedy)
+
+    def reset(self):
+        """Start an episode for every learner and return their states."""
+        self.pending_actions = None
+        return self.env.reset(self.n_learners)
+
+    def update(self, states, actions, rewards, next_states, next_actions, dones):
+        """Apply the one step update of every learner.
+
+        Finished learners have the terminal state as next state, so they bootstrap
+        from the terminal row.
+        """
+        target = rewards + self.gamma * self.bootstrap(self, next_states, next_actions)
+        if self.control:
+            index = (self.learners, states, actions)
+        else:
+            index = (self.learners, states)
+        self.values[index] += self.alpha * (target - self.values[index])
+
+    def run(self, n_steps: int, reset: bool = False):
+        """Run every learner for n_steps environment steps.
+
+        Learners carry on with their episodes from where the previous call stopped,
+        so a run can be split into chunks. The first call, or reset=True, starts new
+        episodes for every learner.
+
+        Returns:
+            np.ndarray: n_steps x n_learners rewards
+        """
+        rewards_per_step = np.zeros((n_steps, self.n_learners))
+        if reset or self.pending_actions is None:
+            states = self.reset()
+            actions = self.select_actions(states)
+        else:
+            states, actions = self.env.states, self.pending_actions
+        start = time.perf_counter()
+        for step in range(n_steps):
+            next_states, rewards, dones = self.env.step(actions)
+            # the next action of a finished learner is taken from its reset state
+            next_actions = self.select_actions(self.env.states)
+            self.update(states, actions, rewards, next_states, next_actions, dones)
+            rewards_per_step[step] = rewards
+            self.episodes += np.count_nonzero(dones)
+            states, actions = self.env.states, next_actions
+        self.pending_actions = actions
+        self.elapsed += time.perf_counter() - start
+        self.updates += n_steps * self.n_learners
+        return rewards_per_step
+
+    def greedy_policy(self):
+        """Get the greedy action of each learner in each state."""
+        if not self.control:
+            raise ValueError("TD(0) learns state values only")
+        return np.argmax(self.values, axis=2)
+
+
+def one_step_td(
+    hw: HexWorld,
+    policy_matrix=None,
+    n_steps: int = 10_000,
+    alpha: float = 0.1,
+    gamma: float = 0.99,
+    n_learners: int = 1,
+    rng: Optional[np.random.Generator] = None,
+):
+    """Estimate the state values of a policy with TD(0).
+
+    Returns:
+        np.ndarray: n_learners x |states|+1 values
+    """
+    engine = TabularTD(
+        hw,
+        "td0",
+        n_learners,
+        alpha,
+        gamma,
+        policy_matrix=policy_matrix,
+        rng=rng,
+    )
+    engine.run(n_steps)
+    return engine.values
+
+
+if __name__ == "__main__":
+    EAST_POLICY = [[HexMove.EAST for _ in range(10)] for _ in range(3)]
+    hw = HexWorld(grid=GRID, policy=EAST_POLICY)
+    shape = hw.get_grid_shape()
+    for rule in TD_RULES:
+        engine = TabularTD(hw, rule, n_learners=100, rng=np.random.default_rng(0))
+        engine.run(10_000)
+        print(
+            f"{rule:15s} {engine.updates_per_second / 1e6:.2f}M updates/s "
+            f"{engine.episodes} episodes"
+        )
+    print(engine.greedy_policy()[0, :-1].reshape(shape))
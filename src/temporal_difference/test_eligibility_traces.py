@@ -0,0 +1,109 @@
+import numpy as np
+import pytest
+from hex_world import HexMove, HexWorld, GRID, policy_mdp
+from monte_carlo_policy_eval import get_hex_world_prior
+from td import TabularTD
+from eligibility_traces import TDLambda, trace_length
+from lookahead_policy_evaluation import linear_system_policy_evaluation
+
+EAST_POLICY = [[HexMove.EAST for _ in range(10)] for _ in range(3)]
+UNIFORM_POLICY_MATRIX = np.ones((30, 6)) / 6
+
+
+class RecordedTDLambda(TDLambda):
+    """TDLambda that keeps every transition it learns from."""
+
+    def reset(self):
+        self.transitions = []
+        return super().reset()
+
+    def update(self, *transition):
+        self.transitions.append([np.copy(x) for x in transition])
+        super().update(*transition)
+
+
+def dense_td_lambda(transitions, lam, alpha, gamma, num_states, trace):
+    """TD(lambda) with a trace for every state."""
+    V = np.zeros(num_states)
+    e = np.zeros(num_states)
+    for states, _, rewards, next_states, _, dones in transitions:
+        s = states[0]
+        delta = rewards[0] + gamma * V[next_states[0]] - V[s]
+        e *= gamma * lam
+        e[s] = e[s] + 1 if trace == "accumulating" else 1
+        V += alpha * delta * e
+        if dones[0]:
+            e[:] = 0
+    return V
+
+
+@pytest.mark.parametrize("trace", ["accumulating", "replacing"])
+def test_sparse_traces_match_dense_traces(trace):
+    hw = HexWorld(grid=GRID, policy=EAST_POLICY)
+    engine = RecordedTDLambda(
+        hw,
+        "td0",
+        lam=0.8,
+        trace=trace,
+        trace_threshold=1e-12,
+        gamma=0.9,
+        alpha=0.1,
+        policy_matrix=UNIFORM_POLICY_MATRIX,
+        rng=np.random.default_rng(0),
+    )
+    engine.run(2000)
+    assert engine.episodes > 10
+    V = dense_td_lambda(engine.transitions, 0.8, 0.1, 0.9, 31, trace)
+    assert np.allclose(engine.values[0], V, atol=1e-9)
+
+
+@pytest.mark.parametrize("rule", ["td0", "sarsa"])
+def test_lambda_zero_matches_one_step_td(rule):
+    hw = HexWorld(grid=GRID, policy=EAST_POLICY)
+    common = dict(n_learners=3, policy_matrix=UNIFORM_POLICY_MATRIX)
+    engine = TDLambda(hw, rule, lam=0.0, rng=np.random.default_rng(1), **common)
+    one_step = TabularTD(hw, rule, rng=np.random.default_rng(1), **common)
+    engine.run(1000)
+    one_step.run(1000)
+    assert engine.num_traces == 1
+    assert np.allclose(engine.values, one_step.values)
+
+
+def test_trace_length():
+    assert trace_length(0.0, 1e-3, 100) == 1
+    assert trace_length(0.5, 1e-3, 100) == 10
+    assert 0.9 ** trace_length(0.9, 1e-3, 1000) < 1e-3
+
+
+@pytest.mark.parametrize("decay", [1.0, 0.999])
+def test_trace_length_longer_than_max_raises(decay):
+    with pytest.raises(ValueError):
+        trace_length(decay, 1e-3, 1000)
+    hw = HexWorld(grid=GRID, policy=EAST_POLICY)
+    with pytest.raises(ValueError):
+        TDLambda(hw, lam=1.0, gamma=decay, max_traces=1000)
+
+
+@pytest.mark.parametrize("trace", ["accumulating", "replacing"])
+def test_td_lambda_matches_exact_values(trace):
+    hw = HexWorld(grid=GRID, policy=EAST_POLICY)
+    T, R = hw.get_mdp()
+    gamma = 0.9
+    exact = linear_system_policy_evaluation(
+        *policy_mdp(T, R, UNIFORM_POLICY_MATRIX), 0, gamma, wall_cost=0
+    )[:30]
+    engine = TDLambda(
+        hw,
+        "td0",
+        lam=0.7,
+        trace=trace,
+        alpha=0.05,
+        gamma=gamma,
+        n_learners=100,
+        policy_matrix=UNIFORM_POLICY_MATRIX,
+        rng=np.random.default_rng(0),
+    )
+    engine.run(20000)
+    visited = get_hex_world_prior() > 0
+    V = engine.values.mean(axis=0)[:30]
+    assert np.allclose(V[visited], exact[visited], atol=0.4)
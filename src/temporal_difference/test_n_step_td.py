@@ -0,0 +1,136 @@
+import numpy as np
+import pytest
+from hex_world import HexMove, HexWorld, GRID, policy_mdp
+from monte_carlo_policy_eval import get_hex_world_prior
+from td import TabularTD
+from n_step_td import NStepTD
+from lookahead_policy_evaluation import linear_system_policy_evaluation
+from value_iteration import value_iteration
+
+EAST_POLICY = [[HexMove.EAST for _ in range(10)] for _ in range(3)]
+UNIFORM_POLICY_MATRIX = np.ones((30, 6)) / 6
+
+
+class RecordedNStepTD(NStepTD):
+    """NStepTD that keeps every transition it learns from."""
+
+    def reset(self):
+        self.transitions = []
+        return super().reset()
+
+    def update(self, *transition):
+        self.transitions.append([np.copy(x) for x in transition])
+        super().update(*transition)
+
+
+def naive_n_step_td(transitions, n, alpha, gamma, num_states):
+    """n-step TD keeping the whole episode and summing the rewards every step."""
+    V = np.zeros(num_states)
+    episode = []
+    for states, _, rewards, next_states, _, dones in transitions:
+        episode.append((states[0], rewards[0]))
+        t = len(episode) - 1
+        taus = range(max(t - n + 1, 0), t + 1) if dones[0] else [t - n + 1]
+        for tau in taus:
+            if tau < 0:
+                continue
+            G = sum(gamma ** (i - tau) * episode[i][1] for i in range(tau, t + 1))
+            if not dones[0]:
+                G += gamma**n * V[next_states[0]]
+            V[episode[tau][0]] += alpha * (G - V[episode[tau][0]])
+        if dones[0]:
+            episode = []
+    return V
+
+
+@pytest.mark.parametrize("n", [1, 3, 8])
+def test_n_step_td_matches_naive_implementation(n):
+    hw = HexWorld(grid=GRID, policy=EAST_POLICY)
+    engine = RecordedNStepTD(
+        hw,
+        "td0",
+        n=n,
+        gamma=0.9,
+        alpha=0.2,
+        policy_matrix=UNIFORM_POLICY_MATRIX,
+        rng=np.random.default_rng(0),
+    )
+    engine.run(2000)
+    assert engine.episodes > 10
+    V = naive_n_step_td(engine.transitions, n, 0.2, 0.9, 31)
+    assert np.allclose(engine.values[0], V)
+
+
+@pytest.mark.parametrize(
+    "rule, one_step_rule, kwargs",
+    [
+        ("td0", "td0", {}),
+        ("sarsa", "sarsa", {}),
+        ("tree_backup", "q_learning", {"target_epsilon": 0.0}),
+        ("q_sigma", "expected_sarsa", {"target_epsilon": 0.1, "sigma": 0.7}),
+    ],
+)
+def test_one_step_rules_match_tabular_td(rule, one_step_rule, kwargs):
+    hw = HexWorld(grid=GRID, policy=EAST_POLICY)
+    common = dict(n_learners=3, epsilon=0.1, policy_matrix=UNIFORM_POLICY_MATRIX)
+    engine = NStepTD(hw, rule, n=1, rng=np.random.default_rng(1), **common, **kwargs)
+    one_step = TabularTD(hw, one_step_rule, rng=np.random.default_rng(1), **common)
+    engine.run(1000)
+    one_step.run(1000)
+    assert np.allclose(engine.values, one_step.values)
+
+
+def test_n_step_td_matches_exact_values():
+    hw = HexWorld(grid=GRID, policy=EAST_POLICY)
+    T, R = hw.get_mdp()
+    gamma = 0.9
+    exact = linear_system_policy_evaluation(
+        *policy_mdp(T, R, UNIFORM_POLICY_MATRIX), 0, gamma, wall_cost=0
+    )[:30]
+    engine = NStepTD(
+        hw,
+        "td0",
+        n=4,
+        alpha=0.05,
+        gamma=gamma,
+        n_learners=200,
+        policy_matrix=UNIFORM_POLICY_MATRIX,
+        rng=np.random.default_rng(0),
+    )
+    engine.run(10000)
+    visited = get_hex_world_prior() > 0
+    V = engine.values.mean(axis=0)[:30]
+    assert np.allclose(V[visited], exact[visited], atol=0.4)
+
+
+@pytest.mark.parametrize("rule", ["tree_backup", "q_sigma"])
+def test_off_policy_n_step_learns_optimal_values(rule):
+    hw = HexWorld(grid=GRID, policy=EAST_POLICY)
+    T, R = hw.get_mdp()
+    gamma = 0.9
+    V_star, _, _ = value_iteration(T, R, gamma, wall_cost=0)
+    engine = NStepTD(
+        hw,
+        rule,
+        n=3,
+        n_learners=10,
+        alpha=0.3,
+        gamma=gamma,
+        epsilon=0.5,
+        rng=np.random.default_rng(0),
+    )
+    engine.run(8000)
+    V = np.max(engine.values.mean(axis=0), axis=1)
+    visited = get_hex_world_prior() > 0
+    assert np.allclose(V[:30][visited], V_star[:30][visited], atol=1.0)
+
+
+def test_n_step_run_in_chunks_matches_one_run():
+    hw = HexWorld(grid=GRID, policy=EAST_POLICY)
+    common = dict(n=4, n_learners=3, policy_matrix=UNIFORM_POLICY_MATRIX)
+    whole = NStepTD(hw, "sarsa", rng=np.random.default_rng(2), **common)
+    chunked = NStepTD(hw, "sarsa", rng=np.random.default_rng(2), **common)
+    whole.run(900)
+    for n in (3, 97, 800):
+        chunked.run(n)
+    assert np.array_equal(chunked.values, whole.values)
@@ -0,0 +1,139 @@
+import numpy as np
+import pytest
+from hex_world import HexMove, HexWorld, GRID, policy_mdp
+from monte_carlo_policy_eval import get_hex_world_prior
+from td import TabularTD, TD_RULES, one_step_td
+from lookahead_policy_evaluation import linear_system_policy_evaluation
+from value_iteration import value_iteration
+
+EAST_POLICY = [[HexMove.EAST for _ in range(10)] for _ in range(3)]
+UNIFORM_POLICY_MATRIX = np.ones((30, 6)) / 6
+
+
+def test_td0_matches_exact_values():
+    hw = HexWorld(grid=GRID, policy=EAST_POLICY)
+    T, R = hw.get_mdp()
+    gamma = 0.9
+    exact = linear_system_policy_evaluation(
+        *policy_mdp(T, R, UNIFORM_POLICY_MATRIX), 0, gamma, wall_cost=0
+    )[:30]
+
+    V = one_step_td(
+        hw,
+        UNIFORM_POLICY_MATRIX,
+        n_steps=20000,
+        alpha=0.05,
+        gamma=gamma,
+        n_learners=200,
+        rng=np.random.default_rng(0),
+    )
+    assert V.shape == (200, 31)
+    visited = get_hex_world_prior() > 0
+    assert np.allclose(V.mean(axis=0)[:30][visited], exact[visited], atol=0.4)
+
+
+def test_q_learning_learns_optimal_values():
+    hw = HexWorld(grid=GRID, policy=EAST_POLICY)
+    T, R = hw.get_mdp()
+    gamma = 0.9
+    V_star, _, _ = value_iteration(T, R, gamma, wall_cost=0)
+    engine = TabularTD(
+        hw,
+        "q_learning",
+        n_learners=20,
+        gamma=gamma,
+        epsilon=0.2,
+        rng=np.random.default_rng(0),
+    )
+    engine.run(50000)
+    V = np.max(engine.values.mean(axis=0), axis=1)
+    visited = get_hex_world_prior() > 0
+    assert np.allclose(V[:30][visited], V_star[:30][visited], atol=1.0)
+    assert engine.updates == 20 * 50000
+    assert engine.updates_per_second > 0
+
+
+@pytest.mark.parametrize("rule", ["sarsa", "expected_sarsa"])
+def test_on_policy_control_approaches_optimal_values(rule):
+    hw = HexWorld(grid=GRID, policy=EAST_POLICY)
+    T, R = hw.get_mdp()
+    gamma = 0.9
+    V_star, _, _ = value_iteration(T, R, gamma, wall_cost=0)
+    engine = TabularTD(
+        hw,
+        rule,
+        n_learners=20,
+        gamma=gamma,
+        epsilon=0.2,
+        rng=np.random.default_rng(0),
+    )
+    engine.run(50000)
+    V = np.max(engine.values.mean(axis=0), axis=1)
+    # epsilon greedy values are below the optimum, and close to it next to the 5
+    visited = get_hex_world_prior() > 0
+    assert np.all(V[:30][visited] <= V_star[:30][visited] + 0.3)
+    near_five = [0, 11, 20]
+    assert np.allclose(V[near_five], V_star[near_five], atol=0.5)
+
+
+def test_bootstraps_of_each_rule():
+    hw = HexWorld(grid=GRID, policy=EAST_POLICY)
+    engine = TabularTD(hw, "sarsa", n_learners=2, epsilon=0.5)
+    engine.values[:, 3] = [[1, 2, 3, 4, 5, 6], [6, 5, 4, 3, 2, 1]]
+    next_states = np.array([3, 30])
+    next_actions = np.array([1, 0])
+    expected = {
+        "sarsa": [2, 0],
+        "q_learning": [6, 0],
+        "expected_sarsa": [0.5 * 6 + 0.5 * 3.5, 0],
+    }
+    for rule, values in expected.items():
+        bootstrap, control = TD_RULES[rule]
+        assert control
+        assert np.allclose(bootstrap(engine, next_states, next_actions), values)
+
+
+def test_td_engine_is_reproducible_and_keeps_dtype():
+    hw = HexWorld(grid=GRID, policy=EAST_POLICY)
+    runs = []
+    for _ in range(2):
+        engine = TabularTD(
+            hw, "sarsa", n_learners=4, dtype=np.float32, rng=np.random.default_rng(3)
+        )
+        rewards = engine.run(500)
+        runs.append((rewards, engine.values))
+    assert runs[0][1].dtype == np.float32
+    assert np.array_equal(runs[0][0], runs[1][0])
+    assert np.array_equal(runs[0][1], runs[1][1])
+
+
+def test_greedy_epsilon_zero_never_explores():
+    hw = HexWorld(grid=GRID, policy=EAST_POLICY)
+    engine = TabularTD(hw, "q_learning", n_learners=5, epsilon=0.0)
+    engine.values[:, :, HexMove.WEST.value] = 1
+    actions = engine.select_actions(np.array([0, 1, 2, 3, 4]))
+    assert np.all(actions == HexMove.WEST.value)
+
+
+@pytest.mark.parametrize("rule", ["td0", "q_learning"])
+def test_run_in_chunks_matches_one_run(rule):
+    hw = HexWorld(grid=GRID, policy=EAST_POLICY)
+    common = dict(n_learners=4, policy_matrix=UNIFORM_POLICY_MATRIX)
+    whole = TabularTD(hw, rule, rng=np.random.default_rng(0), **common)
+    chunked = TabularTD(hw, rule, rng=np.random.default_rng(0), **common)
+    rewards = whole.run(1000)
+    chunks = [chunked.run(n) for n in (1, 299, 700)]
+    assert np.array_equal(np.concatenate(chunks), rewards)
+    assert np.array_equal(chunked.values, whole.values)
+    assert chunked.episodes == whole.episodes
+
+
+def test_run_reset_starts_new_episodes():
+    hw = HexWorld(grid=GRID, policy=EAST_POLICY)
+    engine = TabularTD(hw, "td0", n_learners=500, rng=np.random.default_rng(0))
+    engine.run(3)
+    engine.env.states[:] = 0
+    engine.run(1, reset=True)
+    assert not np.all(engine.env.states == 0)
+    engine.reset()
+    assert engine.pending_actions is None